@@ -0,0 +1,136 @@
+"""指令负载测试：用假交互并发驱动 TarotCog、FortuneCog 及其自动补全。
+
+默认生成大规模合成牌组（几千张牌、几百条宜忌），以便暴露读取与 embed 构建的扩展性问题。
+
+在仓库根目录运行:
+    python -m benchmarks.bench_cogs [--seconds 3] [--concurrency 50] [--rtt 0.05]
+    python -m benchmarks.bench_cogs --data-dir data          # 使用真实牌组
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+from benchmarks.fake_discord import FakeBot, FakeInteraction, FakeUser
+from benchmarks.harness import measure_allocations, measure_allocations_async, print_header, run_async, Result
+from benchmarks.synthetic import write_decks
+from utils.data_manager import deck_store, load_json_data
+from utils.draw_log import draw_log
+from utils.rate_limit import draw_limiter
+
+
+def bench_loading(tarot_file, fortune_file, seconds):
+    """牌组读取：每次解析 JSON 与命中 DeckStore 缓存的对比。"""
+    print_header("牌组读取")
+    cases = {
+        "load_json_data(tarot)": lambda: load_json_data(tarot_file),
+        "load_json_data(fortune)": lambda: load_json_data(fortune_file, {}),
+        "deck_store.get(tarot)": lambda: deck_store.get(tarot_file),
+        "deck_store.get(fortune)": lambda: deck_store.get(fortune_file, {}),
+    }
+    for name, call in cases.items():
+        samples = []
+        deadline = time.perf_counter() + seconds
+        start = time.perf_counter()
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            call()
+            samples.append(time.perf_counter() - t)
+        result = Result(name, samples, time.perf_counter() - start)
+        print(measure_allocations(result, call, calls=20).row())
+
+
+async def bench_commands(bot, args):
+    from cogs.tarot_cog import TarotCog
+    from cogs.fortune_cog import FortuneCog
+
+    if not args.rate_limit:
+        # 默认测量抽取本身；--rate-limit 时保留限流，大部分调用会在限流处被拒绝
+        draw_limiter.users = draw_limiter.guilds = None
+    tarot = TarotCog(bot)
+    fortune = FortuneCog(bot)
+    users = [FakeUser() for _ in range(1000)]
+    guilds = [None] + [random.randrange(10 ** 17, 10 ** 18) for _ in range(args.guilds)]
+    queries = ['', '合成', '01', '愚人', 'Synthetic 12', '等级', '大吉']
+
+    def interaction(command, interaction_type=discord.InteractionType.application_command):
+        return FakeInteraction(command, random.choice(guilds), random.choice(users), args.rtt, interaction_type)
+
+    async def checked(command, call):
+        inter = interaction(command)
+        await call(inter)
+        if inter.failed():
+            raise RuntimeError(f"{command} 返回了错误提示")
+
+    autocomplete = discord.InteractionType.autocomplete
+    scenarios = {
+        "/塔罗": lambda: checked('塔罗', lambda i: tarot.tarot.callback(tarot, i)),
+        "/塔罗牌阵 三张牌": lambda: checked('塔罗牌阵', lambda i: tarot.tarot_spread.callback(tarot, i, 'three_card')),
+        "/塔罗牌阵 凯尔特十字": lambda: checked('塔罗牌阵', lambda i: tarot.tarot_spread.callback(tarot, i, 'celtic_cross')),
+        "/运势": lambda: checked('运势', lambda i: fortune.fortune.callback(fortune, i)),
+        "塔罗牌自动补全": lambda: tarot.tarot_card_autocomplete(
+            interaction('更新塔罗图片', autocomplete), random.choice(queries)),
+        "运势等级自动补全": lambda: fortune.fortune_level_autocomplete(
+            interaction('更新运势图片', autocomplete), random.choice(queries)),
+    }
+
+    print_header(f"指令（并发 {args.concurrency}，模拟往返 {args.rtt * 1000:.0f}ms，{len(guilds)} 个服务器）")
+    for name, make_call in scenarios.items():
+        # 预热：加载牌组并构建编译缓存
+        await make_call()
+        result = await run_async(name, make_call, args.concurrency, args.seconds)
+        if not args.no_alloc:
+            rtt, args.rtt = args.rtt, 0.0
+            await measure_allocations_async(result, make_call)
+            args.rtt = rtt
+        print(result.row())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", help="使用已有的牌组目录，默认生成合成牌组")
+    parser.add_argument("--cards", type=int, default=5000, help="合成塔罗牌数量")
+    parser.add_argument("--activities", type=int, default=500, help="合成宜/忌池各自的条目数")
+    parser.add_argument("--seconds", type=float, default=3.0, help="每个场景的运行时长")
+    parser.add_argument("--concurrency", type=int, default=50, help="同时进行的交互数")
+    parser.add_argument("--rtt", type=float, default=0.0, help="模拟的 Discord API 往返时间（秒）")
+    parser.add_argument("--guilds", type=int, default=20, help="参与抽取的服务器数量")
+    parser.add_argument("--daily", action="store_true", help="以 FORTUNE_MODE=daily 运行 /运势")
+    parser.add_argument("--rate-limit", action="store_true", help="保留 DRAW_RATE_USER/DRAW_RATE_GUILD 限流")
+    parser.add_argument("--log", action="store_true", help="保留 INFO 日志（抽取事件按 LOG_SAMPLE_DRAW 采样），默认只输出警告")
+    parser.add_argument("--no-alloc", action="store_true", help="跳过 tracemalloc 分配统计")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="isha-bench-")
+    try:
+        data_dir = args.data_dir
+        if data_dir is None:
+            data_dir = os.path.join(workdir, 'data')
+            write_decks(data_dir, cards=args.cards, activities=args.activities)
+        # 抽取记录写到临时目录，不污染真实统计
+        draw_log.configure(log_dir=os.path.join(workdir, 'draws'))
+        if not args.log:
+            logging.getLogger().setLevel(logging.WARNING)
+        if args.daily:
+            os.environ['FORTUNE_MODE'] = 'daily'
+
+        tarot_file = os.path.join(data_dir, 'tarot.json')
+        fortune_file = os.path.join(data_dir, 'fortune.json')
+        print(f"牌组: {tarot_file} ({len(load_json_data(tarot_file))} 张), {fortune_file}")
+        bench_loading(tarot_file, fortune_file, min(args.seconds, 1.0))
+        asyncio.run(bench_commands(FakeBot(data_dir), args))
+    finally:
+        draw_log.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""运势抽取微基准：对比旧的逐次解析路径与预编译模型的每秒抽取次数。
+
+在仓库根目录运行: python -m benchmarks.bench_fortune [--seconds 2] [--file data/fortune.json]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+from utils.data_manager import load_json_data
+from utils.fortune_engine import compile_fortune
+
+MENTION = "<@123456789012345678>"
+
+
+def legacy_draw(fortune_data):
+    """重构前 `FortuneCog.fortune` 的抽取与 embed 组装逻辑（不含发送）。"""
+    if not all(k in fortune_data for k in ["levels", "activities", "domains", "connectors"]):
+        return None
+
+    chosen_level = random.choice(fortune_data["levels"])
+    level_name = chosen_level["level_name"]
+    stars = chosen_level.get("stars", 3)
+
+    activities = fortune_data.get("activities", {})
+    good_activities_pool = activities.get("good", [])
+    bad_activities_pool = activities.get("bad", [])
+    num_good = chosen_level.get("good_events", 2)
+    num_bad = chosen_level.get("bad_events", 2)
+    good_events = random.sample(good_activities_pool, min(num_good, len(good_activities_pool)))
+    bad_events = random.sample(bad_activities_pool, min(num_bad, len(bad_activities_pool)))
+
+    domain_fortunes = []
+    for domain in fortune_data.get("domains", []):
+        domain_name = domain.get("name")
+        fortune_text = domain.get("fortunes", {}).get(level_name)
+        if domain_name and fortune_text:
+            domain_fortunes.append(f"**{domain_name}**: {fortune_text}")
+
+    luck_type = "neutral"
+    if stars >= 5: luck_type = "good"
+    elif stars <= 2: luck_type = "bad"
+    color = discord.Color.light_grey()
+    if luck_type == "good": color = discord.Color.gold()
+    elif luck_type == "bad": color = discord.Color.dark_purple()
+
+    star_icons = {'heart': '❤️', 'coin': '💰', 'star': '✨', 'thorn': '🥀', 'skull': '💀'}
+    star_symbol = star_icons.get(chosen_level.get("star_shape", "star"), '✨')
+    stars_display = star_symbol * stars + '🖤' * (7 - stars)
+
+    embed = discord.Embed(title=f"今日运势 - {level_name}", description=f"喵~ {MENTION}，这是你今天的运势指引！", color=color)
+    embed.add_field(name="幸运等级", value=f"**{level_name}**", inline=True)
+    embed.add_field(name="幸运星", value=stars_display, inline=True)
+    if good_events:
+        embed.add_field(name="今日宜", value="\n".join([f"**{e['name']}**: {e['description']}" for e in good_events]), inline=False)
+    if bad_events:
+        embed.add_field(name="今日忌", value="\n".join([f"**{e['name']}**: {e['description']}" for e in bad_events]), inline=False)
+    if domain_fortunes:
+        embed.add_field(name="各领域运势", value="\n".join(domain_fortunes), inline=False)
+    connectors = fortune_data.get("connectors", {})
+    outro_options = connectors.get(f"outro_{luck_type}", [""])
+    embed.set_footer(text=random.choice(outro_options) if outro_options else "")
+    if chosen_level.get("image"):
+        embed.set_image(url=chosen_level["image"])
+    return embed
+
+
+def measure(fn, seconds):
+    """在给定时长内反复调用 fn，返回每秒调用次数。"""
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            fn()
+        count += 100
+    return count / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=2.0, help="每个场景的运行时长")
+    parser.add_argument("--file", default=os.path.join("data", "fortune.json"), help="运势数据文件")
+    args = parser.parse_args()
+
+    fortune_data = load_json_data(args.file, {})
+    model = compile_fortune(fortune_data)
+    if model is None:
+        sys.exit(f"{args.file} 结构不正确")
+
+    cases = {
+        "legacy (每次读取 JSON)": lambda: legacy_draw(load_json_data(args.file, {})),
+        "legacy (数据已在内存)": lambda: legacy_draw(fortune_data),
+        "compiled (draw + render)": lambda: model.render(model.draw(), MENTION),
+        "compiled (+ Embed.from_dict)": lambda: discord.Embed.from_dict(model.render(model.draw(), MENTION)),
+    }
+    baseline = None
+    for name, fn in cases.items():
+        rate = measure(fn, args.seconds)
+        baseline = baseline or rate
+        print(f"{name:<32} {rate:>12,.0f} 次/秒  ({rate / baseline:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""网页后台负载测试：并发请求 /tarot、/fortune 与 /health，报告延迟分位数、吞吐与分配。
+
+默认在进程内用 Flask 测试客户端驱动应用（使用合成牌组）；指定 --url 时改为通过 HTTP
+访问正在运行的服务（例如 Waitress 或集成模式），此时不统计分配。
+
+在仓库根目录运行:
+    python -m benchmarks.bench_web [--seconds 3] [--concurrency 8] [--cards 5000]
+    python -m benchmarks.bench_web --url http://localhost:7860
+"""
+import argparse
+import http.client
+import os
+import shutil
+import sys
+import tempfile
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_discord import FakeBot
+from benchmarks.harness import measure_allocations, print_header, run_threads
+from benchmarks.synthetic import write_decks
+
+PATHS = ('/health', '/tarot', '/fortune')
+
+
+def scenarios(paths):
+    """每个路径测三种请求：无缓存、带 gzip 的首次请求、带 ETag 的重新验证。"""
+    cases = []
+    for path in paths:
+        cases.append((f"GET {path}", path, {}, False))
+        cases.append((f"GET {path} (gzip)", path, {'Accept-Encoding': 'gzip'}, False))
+        cases.append((f"GET {path} (If-None-Match)", path, {'Accept-Encoding': 'gzip'}, True))
+    return cases
+
+
+def in_process_worker(app, path, headers, revalidate):
+    def make_worker():
+        client = app.test_client()
+        request_headers = dict(headers)
+        if revalidate:
+            etag = client.get(path, headers=headers).headers.get('ETag')
+            if etag:
+                request_headers['If-None-Match'] = etag
+
+        def call():
+            response = client.get(path, headers=request_headers)
+            response.close()
+            return response.status_code in (200, 304)
+        return call
+    return make_worker
+
+
+def http_worker(base_url, path, headers, revalidate):
+    parts = urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    prefix = parts.path.rstrip('/')
+
+    def make_worker():
+        # 每个线程一个长连接，避免把建连开销算进延迟
+        connection = connection_class(parts.netloc, timeout=30)
+        request_headers = dict(headers)
+
+        def get():
+            connection.request('GET', prefix + path, headers=request_headers)
+            response = connection.getresponse()
+            response.read()
+            return response
+
+        if revalidate:
+            etag = get().getheader('ETag')
+            if etag:
+                request_headers['If-None-Match'] = etag
+
+        def call():
+            return get().status in (200, 304)
+        return call
+    return make_worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="压测正在运行的服务，例如 http://localhost:7860")
+    parser.add_argument("--data-dir", help="进程内模式使用已有的牌组目录，默认生成合成牌组")
+    parser.add_argument("--cards", type=int, default=5000, help="合成塔罗牌数量")
+    parser.add_argument("--activities", type=int, default=500, help="合成宜/忌池各自的条目数")
+    parser.add_argument("--seconds", type=float, default=3.0, help="每个场景的运行时长")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发请求的线程数")
+    parser.add_argument("--path", action="append", help="要测试的路径，可重复指定，默认为 /health /tarot /fortune")
+    parser.add_argument("--no-alloc", action="store_true", help="跳过 tracemalloc 分配统计")
+    args = parser.parse_args()
+    paths = args.path or PATHS
+
+    if args.url:
+        print_header(f"{args.url}（并发 {args.concurrency}）")
+        for name, path, headers, revalidate in scenarios(paths):
+            result = run_threads(name, http_worker(args.url, path, headers, revalidate), args.concurrency, args.seconds)
+            print(result.row())
+        return
+
+    workdir = tempfile.mkdtemp(prefix="isha-bench-web-")
+    try:
+        data_dir = args.data_dir
+        if data_dir is None:
+            data_dir = os.path.join(workdir, 'data')
+            write_decks(data_dir, cards=args.cards, activities=args.activities)
+        from web.app import app, register_routes
+        register_routes(FakeBot(data_dir))
+
+        print_header(f"进程内 Flask（并发 {args.concurrency}，牌组 {data_dir}）")
+        for name, path, headers, revalidate in scenarios(paths):
+            make_worker = in_process_worker(app, path, headers, revalidate)
+            result = run_threads(name, make_worker, args.concurrency, args.seconds)
+            if not args.no_alloc:
+                measure_allocations(result, make_worker(), calls=50)
+            print(result.row())
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
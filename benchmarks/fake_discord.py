@@ -0,0 +1,94 @@
+"""不连接 Discord 的假交互对象，只实现 cogs 实际用到的属性与方法。"""
+import asyncio
+import itertools
+from datetime import datetime, timezone
+
+import discord
+
+_ids = itertools.count(10 ** 17)
+
+
+class FakePermissions:
+    def __init__(self, administrator=False):
+        self.administrator = administrator
+
+
+class FakeUser:
+    def __init__(self, user_id=None, name="bench-user", administrator=False):
+        self.id = user_id or next(_ids)
+        self.name = name
+        self.mention = f"<@{self.id}>"
+        self.guild_permissions = FakePermissions(administrator)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeResponse:
+    """记录发出的响应；`latency` 秒模拟一次 Discord API 往返。"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = None
+        self.deferred = False
+
+    def is_done(self):
+        return self.sent is not None or self.deferred
+
+    async def _round_trip(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send_message(self, content=None, **kwargs):
+        if self.is_done():
+            raise discord.InteractionResponded(None)
+        await self._round_trip()
+        self.sent = {'content': content, **kwargs}
+
+    async def defer(self, **kwargs):
+        if self.is_done():
+            raise discord.InteractionResponded(None)
+        await self._round_trip()
+        self.deferred = True
+
+
+class FakeFollowup:
+    def __init__(self, response):
+        self.response = response
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        await self.response._round_trip()
+        self.messages.append({'content': content, **kwargs})
+
+
+class FakeInteraction:
+    """一次斜杠指令或自动补全交互。"""
+
+    def __init__(self, command, guild_id=None, user=None, latency=0.0,
+                 interaction_type=discord.InteractionType.application_command):
+        self.id = next(_ids)
+        self.guild_id = guild_id
+        self.user = user or FakeUser()
+        self.created_at = datetime.now(timezone.utc)
+        self.data = {'name': command}
+        self.type = interaction_type
+        self.response = FakeResponse(latency)
+        self.followup = FakeFollowup(self.response)
+
+    def failed(self):
+        """指令是否以错误提示结束（cogs 出错时会发送 ephemeral 的道歉消息）。"""
+        sent = self.response.sent or {}
+        return bool(sent.get('ephemeral')) and 'embed' not in sent and 'embeds' not in sent
+
+
+class FakeBot:
+    """cogs 构造时需要的最小机器人对象。"""
+
+    def __init__(self, data_dir, guilds=()):
+        self.data_dir = data_dir
+        self.user = FakeUser(name="isha-bench")
+        self.guilds = list(guilds)
+
+    def is_ready(self):
+        return True
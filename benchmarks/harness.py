@@ -0,0 +1,144 @@
+"""基准测试共用的计时、并发驱动与分配统计。"""
+import asyncio
+import threading
+import time
+import tracemalloc
+
+
+def percentile(sorted_samples, q):
+    """已排序样本的分位数（最近秩法），q 取 0~100。"""
+    if not sorted_samples:
+        return float('nan')
+    rank = max(0, min(len(sorted_samples) - 1, int(round(q / 100 * len(sorted_samples) + 0.5)) - 1))
+    return sorted_samples[rank]
+
+
+class Result:
+    """一个场景的延迟样本与总耗时。"""
+
+    def __init__(self, name, samples, elapsed, errors=0):
+        self.name = name
+        self.samples = sorted(samples)
+        self.elapsed = elapsed
+        self.errors = errors
+        self.alloc_bytes = None
+        self.alloc_blocks = None
+
+    @property
+    def throughput(self):
+        return len(self.samples) / self.elapsed if self.elapsed else 0.0
+
+    def row(self):
+        ms = lambda seconds: seconds * 1000
+        line = (f"{self.name:<34} {len(self.samples):>8} 次 {self.throughput:>10,.0f} 次/秒  "
+                f"p50 {ms(percentile(self.samples, 50)):7.3f}ms  p99 {ms(percentile(self.samples, 99)):7.3f}ms  "
+                f"max {ms(self.samples[-1] if self.samples else 0):7.3f}ms")
+        if self.alloc_bytes is not None:
+            line += f"  峰值分配 {self.alloc_bytes / 1024:7.1f}KiB/次  残留 {self.alloc_blocks:5.2f} 块/次"
+        if self.errors:
+            line += f"  错误 {self.errors}"
+        return line
+
+
+def print_header(title):
+    print(f"\n== {title} ==")
+
+
+async def run_async(name, make_call, concurrency, seconds):
+    """`concurrency` 个协程在 `seconds` 秒内循环执行 `make_call()` 返回的协程，记录每次的延迟。"""
+    samples = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                await make_call()
+            except Exception:
+                errors += 1
+                continue
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return Result(name, samples, time.perf_counter() - start, errors)
+
+
+def run_threads(name, make_worker, concurrency, seconds):
+    """`concurrency` 个线程在 `seconds` 秒内循环调用各自的 `make_worker()` 返回的函数。
+
+    被调用的函数返回 False 时计为错误。
+    """
+    samples = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        call = make_worker()
+        local, failed = [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = call()
+            except Exception:
+                ok = False
+            if ok is False:
+                failed += 1
+                continue
+            local.append(time.perf_counter() - start)
+        with lock:
+            samples.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return Result(name, samples, time.perf_counter() - start, errors[0])
+
+
+def _traced_blocks():
+    return sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+
+def _record(result, peak_total, retained, calls):
+    result.alloc_bytes = peak_total / calls
+    result.alloc_blocks = retained / calls
+    return result
+
+def measure_allocations(result, call, calls=200):
+    """单线程串行执行 `calls` 次，记录每次调用的峰值分配字节数，以及调用后残留的内存块数。
+
+    tracemalloc 会显著拖慢执行，因此与延迟测量分开进行。残留块数持续大于 0 说明缓存在增长或有泄漏。
+    """
+    tracemalloc.start()
+    try:
+        start_blocks = _traced_blocks()
+        peak_total = 0
+        for _ in range(calls):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            call()
+            peak_total += tracemalloc.get_traced_memory()[1] - before
+        return _record(result, peak_total, _traced_blocks() - start_blocks, calls)
+    finally:
+        tracemalloc.stop()
+
+async def measure_allocations_async(result, make_call, calls=200):
+    """`measure_allocations` 的协程版本。"""
+    tracemalloc.start()
+    try:
+        start_blocks = _traced_blocks()
+        peak_total = 0
+        for _ in range(calls):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            await make_call()
+            peak_total += tracemalloc.get_traced_memory()[1] - before
+        return _record(result, peak_total, _traced_blocks() - start_blocks, calls)
+    finally:
+        tracemalloc.stop()
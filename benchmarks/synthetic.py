@@ -0,0 +1,86 @@
+"""生成大规模合成牌组，用于暴露读取、编译与 embed 构建的扩展性问题。
+
+在仓库根目录运行: python -m benchmarks.synthetic --out /tmp/decks [--cards 5000] [--activities 500]
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.data_manager import _write_json_atomic
+
+STAR_SHAPES = ('heart', 'coin', 'star', 'thorn', 'skull')
+WORDS = ('启程', '潜力', '直觉', '平衡', '转变', '迷茫', '收获', '等待', '勇气', '沉思', '诱惑', '希望', '束缚', '新生')
+
+
+def _text(rng, words):
+    return '，'.join(rng.choice(WORDS) for _ in range(words)) + '。'
+
+
+def make_tarot_deck(cards=5000, seed=0, with_images=True):
+    """生成 `cards` 张牌，解读长度与真实牌组相近，部分牌带图片地址。"""
+    rng = random.Random(seed)
+    deck = []
+    for i in range(cards):
+        card = {
+            'id': i,
+            'name': f"合成牌 {i:05d} (Synthetic {i})",
+            'description': {'upright': _text(rng, rng.randint(3, 40)), 'reversed': _text(rng, rng.randint(3, 40))},
+        }
+        if with_images and i % 3 == 0:
+            card['image'] = f"https://example.invalid/cards/{i}.png"
+        deck.append(card)
+    return deck
+
+
+def make_fortune_deck(levels=7, activities=500, domains=12, seed=0):
+    """生成 `levels` 个等级、宜忌各 `activities` 条、`domains` 个领域的运势牌组。"""
+    rng = random.Random(seed)
+    level_list = []
+    for i in range(levels):
+        stars = max(1, 7 - i * 7 // max(levels, 1))
+        level_list.append({
+            'id': i + 1, 'level_name': f"等级{i + 1}", 'stars': stars,
+            'star_shape': rng.choice(STAR_SHAPES), 'image': f"https://example.invalid/levels/{i + 1}.png",
+            'good_events': rng.randint(1, 4), 'bad_events': rng.randint(1, 4),
+        })
+    pools = {
+        pool: [{'name': f"{pool}-{j}", 'description': _text(rng, rng.randint(2, 12))} for j in range(activities)]
+        for pool in ('good', 'bad')
+    }
+    domain_list = [
+        {'name': f"领域{d}", 'fortunes': {level['level_name']: _text(rng, rng.randint(3, 15)) for level in level_list}}
+        for d in range(domains)
+    ]
+    connectors = {key: [_text(rng, 4) for _ in range(5)] for key in ('intro', 'outro_good', 'outro_neutral', 'outro_bad')}
+    return {'levels': level_list, 'activities': pools, 'domains': domain_list, 'connectors': connectors}
+
+
+def write_decks(data_dir, cards=5000, activities=500, levels=7, domains=12, seed=0):
+    """在 `data_dir` 写入 tarot.json 与 fortune.json，返回两个文件路径。"""
+    os.makedirs(data_dir, exist_ok=True)
+    tarot_file = os.path.join(data_dir, 'tarot.json')
+    fortune_file = os.path.join(data_dir, 'fortune.json')
+    _write_json_atomic(tarot_file, make_tarot_deck(cards, seed))
+    _write_json_atomic(fortune_file, make_fortune_deck(levels, activities, domains, seed))
+    return tarot_file, fortune_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", required=True, help="输出目录（可作为 HF_DISK_PATH 使用）")
+    parser.add_argument("--cards", type=int, default=5000, help="塔罗牌数量")
+    parser.add_argument("--activities", type=int, default=500, help="宜/忌池各自的条目数")
+    parser.add_argument("--levels", type=int, default=7, help="运势等级数量")
+    parser.add_argument("--domains", type=int, default=12, help="领域数量")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for path in write_decks(args.out, args.cards, args.activities, args.levels, args.domains, args.seed):
+        print(f"{path}: {os.path.getsize(path) / 1024:,.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
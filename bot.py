@@ -1,22 +1,85 @@
 import os
 import discord
+from discord import app_commands
 from discord.ext import commands
 import asyncio
+import contextlib
+import math
+import signal
 import threading
+import time
 from dotenv import load_dotenv
 
-from utils.logger import logger
+from utils.logger import logger, flush_logs
+from utils.data_manager import deck_store, deck_writer
+from utils.renderer import render_service
+from utils.draw_log import draw_log
+from utils.metrics import (registry, command_duration, interaction_errors, sample_event_loop_lag,
+                           startup_phase, startup_phase_duration)
+from utils.command_sync import CommandSyncer, parse_guild_ids, summarize
+from utils.cluster import ClusterSupervisor, WorkerChannel, apply_snapshot, worker_listen
+from utils.overlays import route_updates
 from web.app import register_routes
 
 # 加载环境变量
 load_dotenv()
 
+# 统计从进程启动到机器人就绪的总耗时
+PROCESS_STARTED = time.perf_counter()
+
+def _command_name(interaction):
+    return (interaction.data or {}).get('name', 'unknown')
+
+class TrackedCommandTree(app_commands.CommandTree):
+    """记录正在处理的指令数量（以便关闭时等待它们完成），并统计每个指令的耗时。
+
+    只使用公开的钩子：`interaction_check` 开始计时，`app_command_completion` 事件或
+    `on_error` 结束计时。自动补全没有完成钩子，耗时由各补全回调自行记录。
+    """
+
+    def __init__(self, client):
+        super().__init__(client)
+        # 交互 ID -> 开始处理的时间
+        self._started = {}
+
+    @property
+    def in_flight(self):
+        return len(self._started)
+
+    async def interaction_check(self, interaction):
+        if interaction.type == discord.InteractionType.application_command:
+            self._started[interaction.id] = time.perf_counter()
+        return True
+
+    def finish(self, interaction):
+        """结束一个指令的计时（成功或出错时各调用一次）。"""
+        started = self._started.pop(interaction.id, None)
+        if started is not None:
+            command_duration.observe(time.perf_counter() - started, command=_command_name(interaction))
+
+    async def on_error(self, interaction, error):
+        self.finish(interaction)
+        interaction_errors.inc(command=_command_name(interaction))
+        await super().on_error(interaction, error)
+
+    async def wait_idle(self, timeout):
+        """等待所有进行中的交互处理完毕，超时返回 False。"""
+        deadline = time.monotonic() + timeout
+        while self.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return self.in_flight == 0
+
 class TarotBot(commands.Bot):
-    def __init__(self):
+    # 是否由本进程负责预渲染牌面（集群工作进程交给监督进程）
+    render_locally = True
+    # 是否由本进程负责同步指令（集群模式下只由持有分片 0 的工作进程同步）
+    sync_commands = True
+
+    def __init__(self, **options):
         intents = discord.Intents.default()
         intents.message_content = True
         intents.guilds = True
-        super().__init__(command_prefix="/", intents=intents)
+        super().__init__(command_prefix="/", intents=intents, tree_cls=TrackedCommandTree, **options)
         
         self.data_dir = os.getenv('HF_DISK_PATH', 'data')
         os.makedirs(self.data_dir, exist_ok=True)
@@ -24,42 +87,165 @@ class TarotBot(commands.Bot):
         # 确保上传文件夹存在
         os.makedirs('static/uploads', exist_ok=True)
 
+        self._lag_task = None
+        self._ready_reported = False
+        # 尚未连接网关时 latency 为 inf/nan，此时不导出
+        registry.gauge('tarot_gateway_latency_seconds', '网关心跳延迟 (bot.latency)',
+                       callback=lambda: self.latency if math.isfinite(self.latency) else None)
+
     async def setup_hook(self):
-        # 加载所有 cogs
-        for filename in os.listdir('./cogs'):
-            if filename.endswith('.py'):
-                try:
-                    await self.load_extension(f'cogs.{filename[:-3]}')
-                    logger.info(f"成功加载 Cog: {filename}")
-                except Exception as e:
-                    logger.error(f"加载 Cog {filename} 失败: {e}")
-
-        # 同步指令
-        try:
-            guild_ids_str = os.getenv("DISCORD_GUILD_ID")
-            if guild_ids_str:
-                guild_ids = [int(gid.strip()) for gid in guild_ids_str.split(',') if gid.strip()]
-                for gid in guild_ids:
+        # 采样事件循环延迟，阻塞事件循环的同步调用会直接体现在这里
+        self._lag_task = asyncio.create_task(sample_event_loop_lag(), name='event-loop-lag')
+
+        # 启动时加载所有 cogs：指令必须在同步前注册到指令树，因此 cogs 不能按需加载；
+        # cog 的构造只注册指令，牌组在首次使用时才读取，这一阶段的耗时记录在 startup_phase 中
+        with startup_phase('cogs'):
+            for filename in sorted(os.listdir('./cogs')):
+                if filename.endswith('.py'):
                     try:
-                        guild = discord.Object(id=gid)
-                        self.tree.copy_global_to(guild=guild)
-                        await self.tree.sync(guild=guild)
-                        logger.info(f"已将指令同步到服务器: {gid}")
+                        await self.load_extension(f'cogs.{filename[:-3]}')
+                        logger.info("成功加载 Cog: %s", filename)
                     except Exception as e:
-                        logger.error(f"无法将指令同步到服务器 {gid}: {e}")
-            else:
-                await self.tree.sync()
-                logger.info("已全局同步指令")
-        except Exception as e:
-            logger.error(f"指令同步期间出错: {e}")
+                        logger.error("加载 Cog %s 失败: %s", filename, e)
+
+        # 在后台进程池中预渲染所有牌面，牌组变更时自动重新渲染
+        if self.render_locally and os.getenv('RENDER_ENABLED', '1') == '1':
+            with startup_phase('render'):
+                render_service.watch(
+                    tarot_file=os.path.join(self.data_dir, 'tarot.json'),
+                    fortune_file=os.path.join(self.data_dir, 'fortune.json'),
+                )
+
+        # 同步指令：指令树的哈希与上次同步时相同则跳过，多个服务器并发同步
+        if self.sync_commands:
+            with startup_phase('command_sync'):
+                guild_ids = parse_guild_ids(os.getenv("DISCORD_GUILD_ID"))
+                for gid in guild_ids:
+                    self.tree.copy_global_to(guild=discord.Object(id=gid))
+                results = await CommandSyncer(self.tree, self.data_dir).sync(guild_ids)
+                logger.info("指令同步完成: %s", summarize(results))
+
+    async def on_app_command_completion(self, interaction, command):
+        self.tree.finish(interaction)
 
     async def on_ready(self):
-        logger.info(f"机器人已准备就绪！已登录为 {self.user}")
-        logger.info(f"机器人ID: {self.user.id}")
-        logger.info(f"已连接到 {len(self.guilds)} 个服务器")
+        if not self._ready_reported:
+            self._ready_reported = True
+            elapsed = time.perf_counter() - PROCESS_STARTED
+            startup_phase_duration.set(elapsed, phase='ready')
+            logger.info("从启动到就绪共耗时 %.3fs", elapsed)
+        logger.info("机器人已准备就绪！已登录为 %s", self.user)
+        logger.info("机器人ID: %s", self.user.id)
+        logger.info("已连接到 %s 个服务器", len(self.guilds))
+
+    async def close(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        render_service.shutdown()
+        await super().close()
 
     async def on_error(self, event, *args, **kwargs):
-        logger.error(f"在 {event} 中发生错误: {args} {kwargs}")
+        logger.error("在 %s 中发生错误: %s %s", event, args, kwargs)
+
+class ShardedTarotBot(TarotBot, commands.AutoShardedBot):
+    """集群模式的工作进程机器人，只连接分配给它的分片。"""
+    render_locally = False
+
+    def __init__(self, cluster_conn=None, **options):
+        super().__init__(**options)
+        self.cluster_conn = cluster_conn
+
+    @property
+    def sync_commands(self):
+        # 指令是应用级别的，各工作进程内容相同，只需同步一次
+        return 0 in (self.shard_ids or [0])
+
+    async def on_ready(self):
+        await super().on_ready()
+        if self.cluster_conn is not None:
+            self.cluster_conn.send(('ready', list(self.shard_ids or [])))
+
+class ClusterStatus:
+    """监督进程中供网页后台使用的状态对象（监督进程本身不连接网关）。"""
+
+    def __init__(self, supervisor, data_dir):
+        self.supervisor = supervisor
+        self.data_dir = data_dir
+
+    def is_ready(self):
+        return self.supervisor.is_ready()
+
+    def cluster_status(self):
+        return self.supervisor.status()
+
+def run_cluster_worker(index, shard_ids, shard_count, conn, fake_gateway):
+    """集群工作进程入口：牌组只从监督进程发布的快照加载。"""
+    data_dir = os.getenv('HF_DISK_PATH', 'data')
+    # 牌组文件由监督进程负责，工作进程不再检查 mtime，修改也交给监督进程执行
+    deck_store.check_interval = float('inf')
+    channel = WorkerChannel(conn)
+    route_updates(channel.submit_update)
+    # 每个工作进程写自己的抽取日志，网页后台汇总各进程的统计快照
+    draw_log.configure(name=f"worker{index}")
+    channel.send(('reloaded', apply_snapshot(data_dir)))
+    render_service.load_manifest()
+
+    if fake_gateway:
+        # 本地假网关：不连接 Discord，只回报分片分配并响应快照广播，用于验证集群行为
+        stopped = threading.Event()
+        worker_listen(channel, data_dir, stopped.set, render_service.load_manifest)
+        channel.send(('ready', shard_ids))
+        stopped.wait()
+        return
+
+    bot = ShardedTarotBot(cluster_conn=channel, shard_ids=shard_ids, shard_count=shard_count)
+
+    def stop():
+        try:
+            asyncio.run_coroutine_threadsafe(bot.close(), bot.loop)
+        except AttributeError:
+            # 事件循环尚未启动
+            os._exit(0)
+
+    worker_listen(channel, data_dir, stop, render_service.load_manifest)
+    try:
+        run_bot(bot)
+    finally:
+        # multiprocessing 子进程退出时不执行 atexit，需要手动写出剩余的抽取记录和日志
+        draw_log.close()
+        flush_logs()
+
+def run_cluster():
+    """启动监督进程：运行网页后台与预渲染，并拉起 CLUSTER_WORKERS 个分片工作进程。"""
+    data_dir = os.getenv('HF_DISK_PATH', 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    workers = int(os.getenv('CLUSTER_WORKERS', 2))
+    shard_count = int(os.getenv('CLUSTER_SHARDS', workers))
+    fake_gateway = os.getenv('CLUSTER_FAKE_GATEWAY', '0') == '1'
+
+    supervisor = ClusterSupervisor(run_cluster_worker, workers, shard_count, data_dir, fake_gateway)
+    if os.getenv('RENDER_ENABLED', '1') == '1':
+        render_service.add_listener(lambda: supervisor.broadcast(('renders',)))
+        render_service.watch(
+            tarot_file=os.path.join(data_dir, 'tarot.json'),
+            fortune_file=os.path.join(data_dir, 'fortune.json'),
+        )
+
+    flask_thread = threading.Thread(target=run_flask, args=(ClusterStatus(supervisor, data_dir),), daemon=True)
+    flask_thread.start()
+
+    signal.signal(signal.SIGTERM, lambda *args: supervisor.request_stop())
+    supervisor.start()
+    logger.info("集群已启动: %s 个工作进程, %s 个分片%s", workers, shard_count, ' (假网关)' if fake_gateway else '')
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+        deck_writer.flush()
+        render_service.shutdown()
+        logger.info("集群已关闭")
 
 def run_flask(bot):
     try:
@@ -68,10 +254,10 @@ def run_flask(bot):
         # 使用 waitress 或 gunicorn 等生产服务器会更好
         from waitress import serve
         port = int(os.getenv('FLASK_PORT', 7860))
-        logger.info(f"在端口 {port} 上启动 Flask 服务器")
+        logger.info("在端口 %s 上启动 Flask 服务器", port)
         serve(flask_app, host='0.0.0.0', port=port)
     except Exception as e:
-        logger.error(f"启动 Flask 时出错: {e}")
+        logger.error("启动 Flask 时出错: %s", e)
 
 def run_bot(bot):
     TOKEN = os.getenv("DISCORD_TOKEN")
@@ -81,18 +267,92 @@ def run_bot(bot):
     
     logger.info("正在启动 Discord 机器人...")
     try:
-        bot.run(TOKEN)
+        # discord.py 的日志经由根记录器进入日志队列，不再额外挂同步的处理器
+        bot.run(TOKEN, log_handler=None)
     except Exception as e:
-        logger.error(f"运行机器人时出错: {e}")
+        logger.error("运行机器人时出错: %s", e)
+
+async def run_integrated(bot):
+    """在机器人的事件循环上用 ASGI 服务器提供网页后台。
+
+    Flask 应用通过 a2wsgi 在固定大小的线程池中执行，不会阻塞网关；
+    关闭顺序为：停止网页后台 -> 等待进行中的交互 -> 写出待保存的牌组 -> 断开网关。
+    """
+    import uvicorn
+    from a2wsgi import WSGIMiddleware
+
+    TOKEN = os.getenv("DISCORD_TOKEN")
+    if not TOKEN:
+        logger.error("未设置 DISCORD_TOKEN 环境变量！")
+        return
+
+    class EmbeddedServer(uvicorn.Server):
+        # 信号由本函数统一处理，不让 uvicorn 接管并在退出时重新抛出
+        @contextlib.contextmanager
+        def capture_signals(self):
+            yield
+
+    port = int(os.getenv('FLASK_PORT', 7860))
+    workers = int(os.getenv('WEB_WORKERS', 4))
+    config = uvicorn.Config(
+        WSGIMiddleware(register_routes(bot), workers=workers),
+        host='0.0.0.0', port=port, lifespan='off', log_config=None, access_log=False,
+    )
+    server = EmbeddedServer(config)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    async with bot:
+        logger.info("在端口 %s 上启动网页后台 (集成模式, %s 个工作线程)", port, workers)
+        web_task = asyncio.create_task(server.serve(), name='admin-web')
+        bot_task = asyncio.create_task(bot.start(TOKEN), name='discord-bot')
+        stop_task = asyncio.create_task(stop.wait(), name='shutdown-signal')
+        await asyncio.wait({web_task, bot_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        logger.info("正在关闭应用程序...")
+
+        server.should_exit = True
+        with contextlib.suppress(Exception):
+            await asyncio.wait_for(web_task, timeout=10)
+
+        drain_timeout = float(os.getenv('SHUTDOWN_DRAIN_SECONDS', 10))
+        if not await bot.tree.wait_idle(drain_timeout):
+            logger.warning("仍有 %s 个交互未完成，强制关闭", bot.tree.in_flight)
+
+        await asyncio.to_thread(deck_writer.flush)
+        await asyncio.to_thread(draw_log.close)
+        await bot.close()
+        stop_task.cancel()
+        if bot_task.done() and not bot_task.cancelled() and bot_task.exception():
+            logger.error("运行机器人时出错: %s", bot_task.exception())
+        else:
+            bot_task.cancel()
+    logger.info("应用程序已关闭")
 
 if __name__ == "__main__":
     logger.info("正在启动应用程序...")
-    
-    bot_instance = TarotBot()
-    
-    flask_thread = threading.Thread(target=run_flask, args=(bot_instance,))
-    flask_thread.daemon = True
-    flask_thread.start()
-    logger.info("Flask 服务器已在后台启动")
-    
-    run_bot(bot_instance)
+
+    run_mode = os.getenv('RUN_MODE', 'threaded').lower()
+    # RUN_MODE=cluster: 多进程分片，由本进程担任监督进程
+    if run_mode == 'cluster':
+        run_cluster()
+    # RUN_MODE=integrated: 网页后台与机器人共享同一个事件循环
+    elif run_mode == 'integrated':
+        bot_instance = TarotBot()
+        try:
+            asyncio.run(run_integrated(bot_instance))
+        except KeyboardInterrupt:
+            pass
+    else:
+        bot_instance = TarotBot()
+        flask_thread = threading.Thread(target=run_flask, args=(bot_instance,))
+        flask_thread.daemon = True
+        flask_thread.start()
+        logger.info("Flask 服务器已在后台启动")
+
+        run_bot(bot_instance)
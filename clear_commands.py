@@ -4,6 +4,7 @@ from discord.ext import commands
 from dotenv import load_dotenv
 import asyncio
 import logging
+from utils.command_sync import CommandSyncer, parse_guild_ids
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -29,33 +30,23 @@ class ClearBot(commands.Bot):
         super().__init__(command_prefix="!clear", intents=discord.Intents.default())
 
     async def on_ready(self):
-        logging.info(f'以 {self.user} (ID: {self.user.id}) 的身份登录')
+        logging.info("以 %s (ID: %s) 的身份登录", self.user, self.user.id)
         logging.info('------')
 
-        if GUILD_IDS_TO_CLEAR:
-            guild_id_list = [int(gid.strip()) for gid in GUILD_IDS_TO_CLEAR.split(',') if gid.strip()]
-            for guild_id in guild_id_list:
-                try:
-                    logging.info(f"正在尝试为服务器 {guild_id} 清除应用指令...")
-                    guild = discord.Object(id=guild_id)
-                    # 清空指定服务器的指令
-                    self.tree.clear_commands(guild=guild)
-                    # 同步空列表到服务器，完成清除
-                    await self.tree.sync(guild=guild)
-                    logging.info(f"成功为服务器 {guild_id} 清除了所有应用指令。")
-                except Exception as e:
-                    logging.error(f"为服务器 {guild_id} 清除指令失败: {e}")
+        # 与机器人启动时使用同一套同步逻辑：并发清除、限流时退避重试，并更新同步记录，
+        # 这样机器人下次启动时会发现指令已变化而重新同步
+        guild_id_list = parse_guild_ids(GUILD_IDS_TO_CLEAR)
+        if guild_id_list:
+            logging.info("正在尝试为服务器 %s 清除应用指令...", ', '.join(map(str, guild_id_list)))
         else:
             logging.warning("未指定服务器ID。正在尝试清除所有“全局”应用指令...")
             logging.warning("警告: 全局指令的更新可能需要长达一小时才能在所有服务器上生效。")
-            try:
-                # 清空全局指令
-                self.tree.clear_commands(guild=None)
-                # 同步空列表到全局，完成清除
-                await self.tree.sync(guild=None)
-                logging.info("成功清除了所有全局应用指令。")
-            except Exception as e:
-                logging.error(f"清除全局指令失败: {e}")
+        results = await CommandSyncer(self.tree).clear(guild_id_list)
+        for scope, result in results.items():
+            if result == 'synced':
+                logging.info("成功清除了 %s 的所有应用指令。", scope)
+            else:
+                logging.error("清除 %s 的指令失败。", scope)
 
         logging.info("------")
         logging.info("任务完成。您可以随时使用 Ctrl+C 停止此脚本。")
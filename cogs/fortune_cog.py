@@ -1,95 +1,79 @@
+import asyncio
+import functools
 import discord
 from discord import app_commands
 from discord.ext import commands
-import random
 import os
-from utils.logger import logger, op_logger
-from utils.data_manager import load_json_data, save_json_data
+from utils.logger import logger, log_event
+from utils.replies import send_reply
+from utils.data_manager import record_change
+from utils.overlays import guild_decks
+from utils.fortune_engine import compile_fortune, DailyFortuneCache
+from utils.autocomplete import build_fortune_level_index
+from utils.image_ingest import resolve_image, replace_entry_image
+from utils.renderer import render_service, fortune_variant, public_url
+from utils.metrics import autocomplete_duration, command_phase_duration, observe_response
+from utils.draw_log import draw_log
+from utils.rate_limit import draw_limiter
 
 class FortuneCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.fortune_file = os.path.join(self.bot.data_dir, 'fortune.json')
+        # 各服务器在基础牌组之上的覆盖层
+        self.decks = guild_decks(self.fortune_file, 'fortune')
+        # FORTUNE_MODE=daily 时每位用户每天的运势固定，重复抽取直接命中缓存
+        self.daily_mode = os.getenv('FORTUNE_MODE', 'random').lower() == 'daily'
+        self.daily_cache = DailyFortuneCache(
+            maxsize=int(os.getenv('FORTUNE_DAILY_CACHE_SIZE', 10000)),
+            utc_offset_hours=float(os.getenv('FORTUNE_UTC_OFFSET', 8)),
+        )
+
+    @staticmethod
+    def _rendered_image(level):
+        """返回该等级图片的完整 URL，优先使用预渲染背景。"""
+        rendered = render_service.lookup(level.image, fortune_variant(level.name, level.stars, level.star_shape))
+        image = rendered or level.image
+        return public_url(image) if image else None
 
     @app_commands.command(name="运势", description="抽一张今日运势牌")
     async def fortune(self, interaction: discord.Interaction):
+        # 限流在读取牌组之前进行，被拒绝的调用几乎不产生开销
+        if await draw_limiter.reject(interaction, '运势'):
+            return
         try:
-            fortune_data = load_json_data(self.fortune_file)
-            if not all(k in fortune_data for k in ["levels", "activities", "domains", "connectors"]):
+            with command_phase_duration.time(command='运势', phase='load'):
+                model = self.decks.get_compiled(interaction.guild_id, 'fortune_model', compile_fortune)
+            if model is None:
                 await interaction.response.send_message("抱歉，运势数据结构不正确，请检查 `fortune.json`。")
                 return
 
-            # 1. 抽取运势等级
-            chosen_level = random.choice(fortune_data["levels"])
-            level_name = chosen_level["level_name"]
-            stars = chosen_level.get("stars", 3)
-
-            # 2. 生成宜忌列表
-            activities = fortune_data.get("activities", {})
-            good_activities_pool = activities.get("good", [])
-            bad_activities_pool = activities.get("bad", [])
-
-            num_good = chosen_level.get("good_events", 2)
-            num_bad = chosen_level.get("bad_events", 2)
-
-            good_events = random.sample(good_activities_pool, min(num_good, len(good_activities_pool)))
-            bad_events = random.sample(bad_activities_pool, min(num_bad, len(bad_activities_pool)))
-
-            # 3. 生成领域解读
-            domain_fortunes = []
-            for domain in fortune_data.get("domains", []):
-                domain_name = domain.get("name")
-                fortune_text = domain.get("fortunes", {}).get(level_name)
-                if domain_name and fortune_text:
-                    domain_fortunes.append(f"**{domain_name}**: {fortune_text}")
-
-            # 4. 组装 Embed 消息
-            luck_type = "neutral"
-            if stars >= 5: luck_type = "good"
-            elif stars <= 2: luck_type = "bad"
-            
-            color = discord.Color.light_grey()
-            if luck_type == "good": color = discord.Color.gold()
-            elif luck_type == "bad": color = discord.Color.dark_purple()
-
-            star_icons = {'heart': '❤️', 'coin': '💰', 'star': '✨', 'thorn': '🥀', 'skull': '💀'}
-            star_symbol = star_icons.get(chosen_level.get("star_shape", "star"), '✨')
-            stars_display = star_symbol * stars + '🖤' * (7 - stars)
-
-            embed = discord.Embed(
-                title=f"今日运势 - {level_name}",
-                description=f"喵~ {interaction.user.mention}，这是你今天的运势指引！",
-                color=color
-            )
-            
-            embed.add_field(name="幸运等级", value=f"**{level_name}**", inline=True)
-            embed.add_field(name="幸运星", value=stars_display, inline=True)
-
-            if good_events:
-                good_events_text = "\n".join([f"**{e['name']}**: {e['description']}" for e in good_events])
-                embed.add_field(name="今日宜", value=good_events_text, inline=False)
-
-            if bad_events:
-                bad_events_text = "\n".join([f"**{e['name']}**: {e['description']}" for e in bad_events])
-                embed.add_field(name="今日忌", value=bad_events_text, inline=False)
-
-            if domain_fortunes:
-                embed.add_field(name="各领域运势", value="\n".join(domain_fortunes), inline=False)
-
-            # 添加结尾祝福语
-            connectors = fortune_data.get("connectors", {})
-            outro_options = connectors.get(f"outro_{luck_type}", [""])
-            outro = random.choice(outro_options) if outro_options else ""
-            embed.set_footer(text=outro)
-
-            image_url = chosen_level.get("image")
-            if image_url:
-                embed.set_image(url=image_url)
-
-            await interaction.response.send_message(embed=embed)
+            drawn = []
+
+            def record(draw):
+                # 只在内存中追加，落盘由后台线程批量完成
+                draw_log.record('fortune', interaction.guild_id, interaction.user.id, draw.level.name)
+                drawn.append(draw.level.name)
+
+            with command_phase_duration.time(command='运势', phase='build'):
+                if self.daily_mode:
+                    embed_data = self.daily_cache.get_or_render(model, interaction.user.id, interaction.guild_id,
+                                                                interaction.user.mention, self._rendered_image,
+                                                                on_draw=record)
+                else:
+                    draw = model.draw()
+                    record(draw)
+                    embed_data = model.render(draw, interaction.user.mention, self._rendered_image)
+                embed = discord.Embed.from_dict(embed_data)
+            with command_phase_duration.time(command='运势', phase='respond'):
+                await interaction.response.send_message(embed=embed)
+            latency = observe_response('运势', interaction.created_at)
+            # daily 模式命中缓存时没有新的抽取
+            log_event('draw', command='运势', guild_id=interaction.guild_id, user_id=interaction.user.id,
+                      result=drawn[0] if drawn else None, cached=not drawn, latency_ms=round(latency * 1000, 1))
         except Exception as e:
-            logger.error(f"Error in fortune command: {e}")
-            await interaction.response.send_message("抱歉，出现了一些问题，请稍后再试。", ephemeral=True)
+            logger.error("Error in fortune command: %s", e)
+            await send_reply(interaction, "抱歉，出现了一些问题，请稍后再试。", ephemeral=True)
 
     @app_commands.command(name="更新运势图片", description="更新指定运势等级的背景图片")
     @app_commands.rename(level_id="运势等级", url="链接")
@@ -99,37 +83,38 @@ class FortuneCog(commands.Cog):
             await interaction.response.send_message("抱歉，只有服务器管理员才能使用此命令。", ephemeral=True)
             return
 
+        # 镜像远程图片可能超过交互的 3 秒时限，先延迟响应
+        await interaction.response.defer(ephemeral=True)
+        observe_response('更新运势图片', interaction.created_at)
         try:
-            fortune_data = load_json_data(self.fortune_file)
-            level_to_update = next((l for l in fortune_data['levels'] if l['id'] == level_id), None)
+            fields = await asyncio.to_thread(resolve_image, url)
 
-            if not level_to_update:
-                await interaction.response.send_message(f"未找到ID为 {level_id} 的运势等级。", ephemeral=True)
-                return
+            apply_update = functools.partial(replace_entry_image, 'fortune', level_id, fields)
 
-            old_url = level_to_update.get("image", "")
-            level_to_update["image"] = url
-            save_json_data(self.fortune_file, fortune_data)
+            # 只修改本服务器的覆盖层，不影响其他服务器
+            updated = await self.decks.update_async(interaction.guild_id, apply_update)
+            if not updated:
+                await interaction.followup.send(f"未找到ID为 {level_id} 的运势等级。", ephemeral=True)
+                return
+            level_to_update, old_url = updated
 
-            log_message = f"User '{interaction.user}' (ID: {interaction.user.id}) updated image for Fortune Level (ID: {level_id}, Name: {level_to_update['level_name']}): from '{old_url}' to '{url}'"
-            op_logger.info(log_message)
+            await asyncio.to_thread(
+                record_change, self.fortune_file, level_id, level_to_update['level_name'], 'image', old_url, fields['image'],
+                source=url, actor=str(interaction.user), actor_id=interaction.user.id, guild_id=interaction.guild_id)
 
-            embed = discord.Embed(title="🖼️ 运势图片更新成功", description=f"已成功更新 **{level_to_update['level_name']}** 的图片。", color=discord.Color.green())
-            if url:
-                embed.set_image(url=url)
-            await interaction.response.send_message(embed=embed, ephemeral=True)
+            embed = discord.Embed(title="🖼️ 运势图片更新成功", description=f"已成功更新本服务器 **{level_to_update['level_name']}** 的图片。", color=discord.Color.green())
+            if fields['image']:
+                embed.set_image(url=public_url(fields['image']))
+            await interaction.followup.send(embed=embed, ephemeral=True)
         except Exception as e:
-            logger.error(f"Error in update_fortune_image command: {e}")
-            await interaction.response.send_message("更新过程中出现错误，请检查日志。", ephemeral=True)
+            logger.error("Error in update_fortune_image command: %s", e)
+            await interaction.followup.send("更新过程中出现错误，请检查日志。", ephemeral=True)
 
     @update_fortune_image.autocomplete('level_id')
     async def fortune_level_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[int]]:
-        fortune_data = load_json_data(self.fortune_file)
-        choices = [
-            app_commands.Choice(name=f"({level.get('stars', 'N/A')}★) {level['level_name']}", value=level['id'])
-            for level in fortune_data.get('levels', []) if current.lower() in level.get('level_name', '').lower()
-        ]
-        return choices[:25]
+        with autocomplete_duration.time(command=interaction.command.name):
+            index = self.decks.get_compiled(interaction.guild_id, 'autocomplete', build_fortune_level_index)
+            return index.search(current)
 
 async def setup(bot):
     await bot.add_cog(FortuneCog(bot))
@@ -0,0 +1,50 @@
+import asyncio
+import discord
+from discord import app_commands
+from discord.ext import commands
+from utils.logger import logger
+from utils.replies import send_reply
+from utils.draw_log import draw_log
+
+KIND_TITLES = {'fortune': '运势等级分布', 'tarot': '最常抽到的塔罗牌'}
+
+def format_distribution(kind_summary, limit):
+    lines = [
+        f"**{name}**: {count} 次 ({share:.1%})"
+        for name, count, share in kind_summary["top"][:limit]
+    ]
+    return "\n".join(lines) or "暂无记录"
+
+class StatsCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @app_commands.command(name="统计", description="查看本服务器的抽取统计和你的连续抽取天数")
+    async def stats(self, interaction: discord.Interaction):
+        try:
+            # 统计由后台线程增量维护，这里只读取汇总；首次读取可能需要加载快照，放到线程池中执行
+            summary = await asyncio.to_thread(draw_log.summary, interaction.guild_id, interaction.user.id)
+
+            embed = discord.Embed(
+                title="📊 抽取统计",
+                description=f"本服务器共记录了 **{summary['total']}** 次抽取。",
+                color=discord.Color.blue()
+            )
+            for kind, limit in (('fortune', 10), ('tarot', 5)):
+                if kind in summary["kinds"]:
+                    embed.add_field(name=KIND_TITLES[kind], value=format_distribution(summary["kinds"][kind], limit), inline=False)
+
+            user = summary.get("user")
+            if user:
+                embed.add_field(
+                    name="你的记录",
+                    value=f"连续抽取 **{user['streak']}** 天（最长 {user['best']} 天），累计 {user['total']} 次",
+                    inline=False
+                )
+            await interaction.response.send_message(embed=embed)
+        except Exception as e:
+            logger.error("Error in stats command: %s", e)
+            await send_reply(interaction, "抱歉，出现了一些问题，请稍后再试。", ephemeral=True)
+
+async def setup(bot):
+    await bot.add_cog(StatsCog(bot))
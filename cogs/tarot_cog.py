@@ -1,50 +1,128 @@
+import asyncio
+import functools
 import discord
 from discord import app_commands
 from discord.ext import commands
 import random
 import os
-from utils.logger import logger, op_logger
-from utils.data_manager import load_json_data, save_json_data
+from utils.logger import logger, log_event
+from utils.replies import send_reply
+from utils.data_manager import record_change
+from utils.overlays import guild_decks
+from utils.autocomplete import build_tarot_index
+from utils.tarot_engine import compile_tarot
+from utils.image_ingest import resolve_image, replace_entry_image
+from utils.renderer import render_service, public_url
+from utils.metrics import autocomplete_duration, command_phase_duration, observe_response
+from utils.spreads import SPREADS, ORIENTATIONS, ORIENTATION_TEXT, draw_spread
+from utils.draw_log import draw_log
+from utils.rate_limit import draw_limiter
+
+# Discord 限制一条消息中所有 embed 的文字总长不超过 6000 个字符
+MAX_MESSAGE_EMBED_CHARS = 6000
 
 class TarotCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.tarot_file = os.path.join(self.bot.data_dir, 'tarot.json')
+        # 各服务器在基础牌组之上的覆盖层
+        self.decks = guild_decks(self.tarot_file, 'tarot')
 
     @app_commands.command(name="塔罗", description="抽一张塔罗牌")
     async def tarot(self, interaction: discord.Interaction):
+        # 限流在读取牌组之前进行，被拒绝的调用几乎不产生开销
+        if await draw_limiter.reject(interaction, '塔罗'):
+            return
         try:
-            tarot_cards = load_json_data(self.tarot_file)
+            with command_phase_duration.time(command='塔罗', phase='load'):
+                # 牌组在加载时已校验并编译，抽取时不再检查字段
+                tarot_cards = self.decks.get_compiled(interaction.guild_id, 'tarot_deck', compile_tarot)
             if not tarot_cards:
                 await interaction.response.send_message("抱歉，塔罗牌数据正在维护中，请稍后再试。")
                 return
                 
-            chosen_card = random.choice(tarot_cards)
-            orientation = random.choice(['upright', 'reversed'])
+            with command_phase_duration.time(command='塔罗', phase='build'):
+                chosen_card = tarot_cards.draw()
+                orientation = random.choice(ORIENTATIONS)
             
-            orientation_text = "正位" if orientation == 'upright' else "逆位"
-            description = chosen_card['description'][orientation]
-            card_name_with_orientation = f"{chosen_card['name']} ({orientation_text})"
+                description = chosen_card.description(orientation)
+                card_name_with_orientation = f"{chosen_card.name} ({ORIENTATION_TEXT[orientation]})"
 
-            embed = discord.Embed(
-                title=f"你抽到了... {card_name_with_orientation}",
-                description=f"**牌面解读:**\n{description}",
-                color=discord.Color.purple()
-            )
+                embed = discord.Embed(
+                    title=f"你抽到了... {card_name_with_orientation}",
+                    description=f"**牌面解读:**\n{description}",
+                    color=discord.Color.purple()
+                )
             
-            image_url = chosen_card.get("image")
-            if image_url:
-                if not image_url.startswith('http'):
-                     base_url = os.getenv("BASE_URL", "http://localhost:7860")
-                     image_url = f"{base_url}/{image_url}"
-                embed.set_image(url=image_url)
+                image_url = chosen_card.image
+                if image_url:
+                    # 优先使用预渲染的图片（逆位已旋转），尚未渲染完成时回退到原图
+                    image_url = render_service.lookup(image_url, orientation) or image_url
+                    embed.set_image(url=public_url(image_url))
                 
-            embed.set_footer(text=f"由 {self.bot.user.name} 提供给 {interaction.user.name}")
+                embed.set_footer(text=f"由 {self.bot.user.name} 提供给 {interaction.user.name}")
+
+            with command_phase_duration.time(command='塔罗', phase='respond'):
+                await interaction.response.send_message(embed=embed)
+            latency = observe_response('塔罗', interaction.created_at)
+            draw_log.record('tarot', interaction.guild_id, interaction.user.id, chosen_card.name, orientation)
+            log_event('draw', command='塔罗', guild_id=interaction.guild_id, user_id=interaction.user.id,
+                      result=chosen_card.name, orientation=orientation, latency_ms=round(latency * 1000, 1))
+        except Exception as e:
+            logger.error("Error in tarot command: %s", e)
+            await send_reply(interaction, "抱歉，出现了一些问题，请稍后再试。", ephemeral=True)
+
+    @app_commands.command(name="塔罗牌阵", description="一次抽取一个完整的塔罗牌阵")
+    @app_commands.rename(spread_key="牌阵")
+    @app_commands.describe(spread_key="请选择牌阵")
+    @app_commands.choices(spread_key=[
+        app_commands.Choice(name=f"{spread.name} ({len(spread)} 张) - {spread.description}", value=key)
+        for key, spread in SPREADS.items()
+    ])
+    async def tarot_spread(self, interaction: discord.Interaction, spread_key: str):
+        if await draw_limiter.reject(interaction, '塔罗牌阵'):
+            return
+        try:
+            spread = SPREADS[spread_key]
+            with command_phase_duration.time(command='塔罗牌阵', phase='load'):
+                tarot_cards = self.decks.get_compiled(interaction.guild_id, 'tarot_deck', compile_tarot)
+            if not tarot_cards or tarot_cards.drawable < len(spread):
+                await interaction.response.send_message("抱歉，塔罗牌数据正在维护中，请稍后再试。")
+                return
 
-            await interaction.response.send_message(embed=embed)
+            with command_phase_duration.time(command='塔罗牌阵', phase='build'):
+                # 平均分配描述长度，保证整条消息不超过 embed 总长限制
+                description_limit = MAX_MESSAGE_EMBED_CHARS // len(spread) - 150
+                embeds = []
+                drawn = draw_spread(tarot_cards, spread)
+                for i, (position, card, orientation) in enumerate(drawn, start=1):
+                    description = card.description(orientation)
+                    if len(description) > description_limit:
+                        description = description[:description_limit - 1] + "…"
+                    embed = discord.Embed(
+                        title=f"{i}. {position} — {card.name} ({ORIENTATION_TEXT[orientation]})",
+                        description=description,
+                        color=discord.Color.purple()
+                    )
+                    image_url = card.image
+                    if image_url:
+                        image_url = render_service.lookup(image_url, orientation) or image_url
+                        embed.set_thumbnail(url=public_url(image_url))
+                    embeds.append(embed)
+                embeds[-1].set_footer(text=f"由 {self.bot.user.name} 提供给 {interaction.user.name}")
+
+            # 整个牌阵在同一条消息中发出，只占用一次响应
+            with command_phase_duration.time(command='塔罗牌阵', phase='respond'):
+                await interaction.response.send_message(
+                    content=f"{interaction.user.mention} 的 **{spread.name}** 牌阵：{spread.description}", embeds=embeds)
+            latency = observe_response('塔罗牌阵', interaction.created_at)
+            for _, card, orientation in drawn:
+                draw_log.record('tarot', interaction.guild_id, interaction.user.id, card.name, orientation)
+            log_event('draw', command='塔罗牌阵', guild_id=interaction.guild_id, user_id=interaction.user.id,
+                      result=spread.key, latency_ms=round(latency * 1000, 1))
         except Exception as e:
-            logger.error(f"Error in tarot command: {e}")
-            await interaction.response.send_message("抱歉，出现了一些问题，请稍后再试。", ephemeral=True)
+            logger.error("Error in tarot_spread command: %s", e)
+            await send_reply(interaction, "抱歉，出现了一些问题，请稍后再试。", ephemeral=True)
 
     @app_commands.command(name="更新塔罗图片", description="更新指定塔罗牌的卡面图片")
     @app_commands.rename(card_id="塔罗牌", url="链接")
@@ -54,37 +132,38 @@ class TarotCog(commands.Cog):
             await interaction.response.send_message("抱歉，只有服务器管理员才能使用此命令。", ephemeral=True)
             return
         
+        # 镜像远程图片可能超过交互的 3 秒时限，先延迟响应
+        await interaction.response.defer(ephemeral=True)
+        observe_response('更新塔罗图片', interaction.created_at)
         try:
-            tarot_cards = load_json_data(self.tarot_file)
-            card_to_update = next((c for c in tarot_cards if c['id'] == card_id), None)
+            fields = await asyncio.to_thread(resolve_image, url)
 
-            if not card_to_update:
-                await interaction.response.send_message(f"未找到ID为 {card_id} 的塔罗牌。", ephemeral=True)
-                return
+            apply_update = functools.partial(replace_entry_image, 'tarot', card_id, fields)
 
-            old_url = card_to_update.get("image", "")
-            card_to_update["image"] = url
-            save_json_data(self.tarot_file, tarot_cards)
+            # 只修改本服务器的覆盖层，不影响其他服务器
+            updated = await self.decks.update_async(interaction.guild_id, apply_update)
+            if not updated:
+                await interaction.followup.send(f"未找到ID为 {card_id} 的塔罗牌。", ephemeral=True)
+                return
+            card_to_update, old_url = updated
 
-            log_message = f"User '{interaction.user}' (ID: {interaction.user.id}) updated image for Tarot (ID: {card_id}, Name: {card_to_update['name']}): from '{old_url}' to '{url}'"
-            op_logger.info(log_message)
+            await asyncio.to_thread(
+                record_change, self.tarot_file, card_id, card_to_update['name'], 'image', old_url, fields['image'],
+                source=url, actor=str(interaction.user), actor_id=interaction.user.id, guild_id=interaction.guild_id)
 
-            embed = discord.Embed(title="🖼️ 塔罗牌图片更新成功", description=f"已成功更新 **{card_to_update['name']}** 的图片。", color=discord.Color.green())
-            if url:
-                embed.set_image(url=url)
-            await interaction.response.send_message(embed=embed, ephemeral=True)
+            embed = discord.Embed(title="🖼️ 塔罗牌图片更新成功", description=f"已成功更新本服务器 **{card_to_update['name']}** 的图片。", color=discord.Color.green())
+            if fields['image']:
+                embed.set_image(url=public_url(fields['image']))
+            await interaction.followup.send(embed=embed, ephemeral=True)
         except Exception as e:
-            logger.error(f"Error in update_tarot_image command: {e}")
-            await interaction.response.send_message("更新过程中出现错误，请检查日志。", ephemeral=True)
+            logger.error("Error in update_tarot_image command: %s", e)
+            await interaction.followup.send("更新过程中出现错误，请检查日志。", ephemeral=True)
 
     @update_tarot_image.autocomplete('card_id')
     async def tarot_card_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[int]]:
-        tarot_cards = load_json_data(self.tarot_file)
-        choices = [
-            app_commands.Choice(name=card['name'], value=card['id'])
-            for card in tarot_cards if current.lower() in card['name'].lower()
-        ]
-        return choices[:25]
+        with autocomplete_duration.time(command=interaction.command.name):
+            index = self.decks.get_compiled(interaction.guild_id, 'autocomplete', build_tarot_index)
+            return index.search(current)
 
 async def setup(bot):
     await bot.add_cog(TarotCog(bot))
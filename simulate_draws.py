@@ -0,0 +1,122 @@
+"""离线模拟抽取：按当前牌组（含服务器覆盖）的权重抽取大量次数，核对实际分布与设定的概率是否一致。
+
+在仓库根目录运行:
+    python simulate_draws.py                               # 运势等级与塔罗牌各抽 100 万次
+    python simulate_draws.py --deck fortune --draws 5000000 --guild 123456789
+    python simulate_draws.py --deck tarot --spread celtic_cross
+"""
+import argparse
+import logging
+import math
+import os
+import random
+import time
+
+from utils.fortune_engine import compile_fortune
+from utils.overlays import guild_decks
+from utils.spreads import SPREADS, draw_spread
+from utils.tarot_engine import compile_tarot
+
+
+def chi_square_p_value(statistic, dof):
+    """卡方检验的右尾概率（Wilson–Hilferty 正态近似，自由度较大时足够准确）。"""
+    if dof <= 0:
+        return 1.0
+    z = ((statistic / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def report(title, names, weights, counts, draws, top):
+    """打印期望与实际比例；条目过多时只列出偏差最大的 `top` 个。"""
+    total_weight = sum(weights)
+    rows = []
+    statistic = 0.0
+    for name, weight, count in zip(names, weights, counts):
+        expected = draws * weight / total_weight
+        if expected == 0:
+            if count:
+                raise AssertionError(f"权重为 0 的条目被抽中了 {count} 次: {name}")
+            continue
+        statistic += (count - expected) ** 2 / expected
+        z = (count - expected) / math.sqrt(expected * (1 - weight / total_weight) or 1)
+        rows.append((name, weight, expected / draws, count / draws, z))
+    dof = len(rows) - 1
+    p_value = chi_square_p_value(statistic, dof)
+
+    print(f"\n== {title}（{draws:,} 次）==")
+    print(f"{'条目':<28} {'权重':>8} {'期望':>9} {'实际':>9} {'偏差(σ)':>8}")
+    shown = rows if len(rows) <= top else sorted(rows, key=lambda row: -abs(row[4]))[:top]
+    for name, weight, expected, observed, z in shown:
+        print(f"{name[:28]:<28} {weight:>8g} {expected:>9.4%} {observed:>9.4%} {z:>+8.2f}")
+    if len(shown) < len(rows):
+        print(f"…… 另有 {len(rows) - len(shown)} 个条目（只列出偏差最大的 {top} 个）")
+    verdict = "符合设定的分布" if p_value >= 0.001 else "与设定的分布显著不符"
+    print(f"卡方 = {statistic:.1f}，自由度 {dof}，p ≈ {p_value:.3f}：{verdict}")
+    return p_value
+
+
+def simulate_fortune(decks, guild_id, draws, rng, top):
+    model = decks.get_compiled(guild_id, 'fortune_model', compile_fortune)
+    if model is None:
+        raise SystemExit("运势牌组结构不正确，无法模拟")
+    counts = [0] * len(model.levels)
+    sample = model.level_table.sample
+    started = time.perf_counter()
+    for _ in range(draws):
+        counts[sample(rng)] += 1
+    elapsed = time.perf_counter() - started
+    print(f"\n运势等级抽取耗时 {elapsed:.2f}s（{elapsed / draws * 1e9:.0f}ns/次）")
+    return report("运势等级", [level.name for level in model.levels], [level.weight for level in model.levels],
+                  counts, draws, top)
+
+
+def simulate_tarot(decks, guild_id, draws, rng, top, spread_key=None):
+    deck = decks.get_compiled(guild_id, 'tarot_deck', compile_tarot)
+    if not deck:
+        raise SystemExit("塔罗牌组为空或结构不正确，无法模拟")
+    index_of = {id(card): i for i, card in enumerate(deck)}
+    counts = [0] * len(deck)
+    started = time.perf_counter()
+    if spread_key is None:
+        sample = deck.table.sample
+        for _ in range(draws):
+            counts[sample(rng)] += 1
+        title = "塔罗牌（单张）"
+    else:
+        # 牌阵为不放回抽取，后面各位置的频率不再与权重成正比；第一张仍按权重抽取，用它做分布检验，
+        # 其余位置只检查同一牌阵中没有重复的牌
+        spread = SPREADS[spread_key]
+        for _ in range(draws):
+            drawn = draw_spread(deck, spread, rng)
+            if len({id(card) for _, card, _ in drawn}) != len(drawn):
+                raise AssertionError("同一牌阵中抽到了重复的牌")
+            counts[index_of[id(drawn[0][1])]] += 1
+        title = f"塔罗牌（{spread.name} 第一张）"
+    elapsed = time.perf_counter() - started
+    print(f"\n塔罗牌抽取耗时 {elapsed:.2f}s")
+    return report(title, [card.name for card in deck], [card.weight for card in deck], counts, draws, top)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", default=os.getenv("HF_DISK_PATH", "data"), help="牌组目录，默认为 HF_DISK_PATH 或 data")
+    parser.add_argument("--deck", choices=("fortune", "tarot", "all"), default="all")
+    parser.add_argument("--guild", type=int, help="使用该服务器的覆盖后的牌组")
+    parser.add_argument("--draws", type=int, default=1_000_000, help="抽取次数")
+    parser.add_argument("--spread", choices=tuple(SPREADS), help="按牌阵不放回抽取塔罗牌")
+    parser.add_argument("--seed", type=int, help="随机种子，便于复现")
+    parser.add_argument("--top", type=int, default=30, help="条目较多时列出的行数")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    if args.deck in ("fortune", "all"):
+        decks = guild_decks(os.path.join(args.data_dir, 'fortune.json'), 'fortune')
+        simulate_fortune(decks, args.guild, args.draws, rng, args.top)
+    if args.deck in ("tarot", "all"):
+        decks = guild_decks(os.path.join(args.data_dir, 'tarot.json'), 'tarot')
+        simulate_tarot(decks, args.guild, args.draws, rng, args.top, args.spread)
+
+
+if __name__ == "__main__":
+    main()
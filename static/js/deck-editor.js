@@ -0,0 +1,100 @@
+// 按字段保存：带 data-path 的输入在页面加载时记录原值，提交时只把改动的字段组成 JSON Patch 发送，
+// 并携带页面加载时的 ETag（If-Match），牌组在此期间被其他管理员修改时服务器返回 412。
+(function () {
+    function showStatus(message, isError) {
+        let box = document.getElementById('deck-editor-status');
+        if (!box) {
+            box = document.createElement('div');
+            box.id = 'deck-editor-status';
+            box.style.cssText = 'position:fixed;right:20px;bottom:20px;padding:12px 18px;border-radius:8px;color:#fff;z-index:1000;box-shadow:0 2px 10px rgba(0,0,0,0.2);';
+            document.body.appendChild(box);
+        }
+        box.style.background = isError ? '#c0392b' : '#27ae60';
+        box.textContent = message;
+        clearTimeout(box.hideTimer);
+        box.hideTimer = setTimeout(function () { box.remove(); }, 4000);
+    }
+
+    function readValue(el) {
+        if (el.dataset.type === 'int') {
+            return parseInt(el.value, 10);
+        }
+        if (el.dataset.type === 'number') {
+            // 留空时恢复默认值（服务器端会删除等于默认值的字段），非法输入交给服务器端校验报告
+            return el.value === '' ? 1 : Number(el.value);
+        }
+        if (el.dataset.type === 'csv') {
+            // 与服务器端一致：去掉每项首尾空白并丢弃空项
+            return el.value.split(',').map(function (item) { return item.trim(); }).filter(Boolean);
+        }
+        return el.value;
+    }
+
+    async function checkResponse(response) {
+        if (response.ok) {
+            return true;
+        }
+        let message = '保存失败 (' + response.status + ')';
+        try {
+            message = (await response.json()).error || message;
+        } catch (e) {}
+        if (response.status === 412) {
+            message = '内容已被其他管理员修改，请刷新页面后重试。';
+        }
+        showStatus(message, true);
+        return false;
+    }
+
+    document.querySelectorAll('form[data-patch-url]').forEach(function (form) {
+        const fields = Array.from(form.querySelectorAll('[data-path]'));
+        fields.forEach(function (el) { el.dataset.original = el.value; });
+
+        form.addEventListener('submit', async function (event) {
+            // 删除等按钮仍走普通表单提交
+            if (event.submitter && event.submitter.dataset.plainSubmit !== undefined) {
+                return;
+            }
+            event.preventDefault();
+
+            const operations = fields
+                .filter(function (el) { return el.value !== el.dataset.original; })
+                .map(function (el) { return {op: el.dataset.op || 'replace', path: el.dataset.path, value: readValue(el)}; });
+            const uploads = Array.from(form.querySelectorAll('input[type=file][data-upload-url]'))
+                .filter(function (input) { return input.files.length; });
+            if (!operations.length && !uploads.length) {
+                showStatus('没有需要保存的修改');
+                return;
+            }
+
+            let etag = document.body.dataset.etag;
+            if (operations.length) {
+                const response = await fetch(form.dataset.patchUrl, {
+                    method: 'PATCH',
+                    headers: {'Content-Type': 'application/json-patch+json', 'If-Match': etag},
+                    body: JSON.stringify(operations)
+                });
+                if (!await checkResponse(response)) {
+                    return;
+                }
+                etag = response.headers.get('ETag');
+                fields.forEach(function (el) { el.dataset.original = el.value; });
+            }
+            for (const input of uploads) {
+                const body = new FormData();
+                body.append('image', input.files[0]);
+                const response = await fetch(input.dataset.uploadUrl, {method: 'POST', headers: {'If-Match': etag}, body: body});
+                if (!await checkResponse(response)) {
+                    return;
+                }
+                etag = response.headers.get('ETag');
+            }
+            document.body.dataset.etag = etag;
+            if (uploads.length) {
+                // 刷新以显示新的图片地址
+                window.location.reload();
+                return;
+            }
+            showStatus('已保存 ' + operations.length + ' 处修改');
+        });
+    });
+})();
@@ -0,0 +1,27 @@
+from utils.deck_schema import check_fortune_deck, check_tarot_deck, format_issues
+
+
+def tarot_card(card_id, name="愚者"):
+    return {"id": card_id, "name": name, "description": {"upright": "正位", "reversed": "逆位"}}
+
+
+def fortune_deck(levels):
+    return {"levels": levels, "activities": {"good": [], "bad": []}, "domains": [], "connectors": {}}
+
+
+def test_unhashable_tarot_id_reports_field_path():
+    issues = check_tarot_deck([tarot_card([1]), tarot_card(2)])
+    assert [(issue.path, issue.message) for issue in issues] == [("/0/id", "应为整数")]
+
+
+def test_unhashable_level_name_reports_field_path():
+    issues = check_fortune_deck(fortune_deck([
+        {"id": 1, "level_name": {"name": "大吉"}},
+        {"id": 2, "level_name": "小吉"},
+    ]))
+    assert [(issue.path, issue.message) for issue in issues] == [("/levels/0/level_name", "应为字符串")]
+
+
+def test_duplicate_ids_still_reported():
+    issues = check_tarot_deck([tarot_card(1), tarot_card(1, "魔术师")])
+    assert format_issues(issues) == "/1/id: 与前面的条目重复: 1"
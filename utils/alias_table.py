@@ -0,0 +1,87 @@
+"""按权重抽取的别名表（Vose 算法）：O(n) 构建，每次抽取 O(1)。"""
+import random
+
+
+class AliasTable:
+    """按权重抽取下标的别名表（只读）。
+
+    权重全部相等时不构建表，直接使用 `rng.randrange`，与未设置权重的旧牌组消耗的随机数完全一致，
+    因此每日运势等依赖固定种子的结果不会因为升级而改变。权重为 0 的条目永远不会被抽到。
+    """
+    __slots__ = ('weights', 'support', 'uniform', '_prob', '_alias')
+
+    def __init__(self, weights):
+        weights = tuple(float(w) for w in weights)
+        if not weights or any(w < 0 for w in weights):
+            raise ValueError("权重不能为空或为负数")
+        total = sum(weights)
+        if total <= 0:
+            raise ValueError("至少需要一个权重大于 0 的条目")
+        self.weights = weights
+        self.support = sum(1 for w in weights if w > 0)
+        self.uniform = self.support == len(weights) and min(weights) == max(weights)
+        self._prob = self._alias = None
+        if not self.uniform:
+            self._build(total)
+
+    def _build(self, total):
+        n = len(self.weights)
+        prob = [0.0] * n
+        alias = [0] * n
+        scaled = [w * n / total for w in self.weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            prob[less] = scaled[less]
+            alias[less] = more
+            # 较大的一项补足了 less 所在的格子，剩余部分按大小重新归类
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+        first_positive = next(i for i, w in enumerate(self.weights) if w > 0)
+        for i in large + small:
+            # 只剩浮点误差时格子归自己所有；零权重条目仍然指向有权重的条目
+            if self.weights[i] > 0:
+                prob[i] = 1.0
+            else:
+                prob[i], alias[i] = 0.0, first_positive
+        self._prob = tuple(prob)
+        self._alias = tuple(alias)
+
+    def __len__(self):
+        return len(self.weights)
+
+    def probability(self, index):
+        """返回下标被抽中的理论概率。"""
+        return self.weights[index] / sum(self.weights)
+
+    def sample(self, rng=random):
+        """按权重抽取一个下标。"""
+        if self.uniform:
+            return rng.randrange(len(self.weights))
+        i = rng.randrange(len(self._prob))
+        return i if rng.random() < self._prob[i] else self._alias[i]
+
+    def sample_distinct(self, count, rng=random):
+        """按权重不放回地抽取 `count` 个不同的下标（依次抽取，已抽中的条目不再参与）。
+
+        先用别名表抽取并丢弃重复项；权重高度集中导致重复过多时，改为在剩余条目中逐个按权重抽取。
+        """
+        if count > self.support:
+            raise ValueError(f"只有 {self.support} 个可抽取的条目，不足 {count} 个")
+        if self.uniform:
+            return rng.sample(range(len(self.weights)), count)
+        chosen = []
+        seen = set()
+        for _ in range(count * 8):
+            if len(chosen) == count:
+                return chosen
+            i = self.sample(rng)
+            if i not in seen:
+                seen.add(i)
+                chosen.append(i)
+        remaining = [i for i, w in enumerate(self.weights) if w > 0 and i not in seen]
+        while len(chosen) < count:
+            pick = rng.choices(range(len(remaining)), weights=[self.weights[i] for i in remaining])[0]
+            chosen.append(remaining.pop(pick))
+        return chosen
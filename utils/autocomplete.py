@@ -0,0 +1,119 @@
+import re
+from collections import OrderedDict, defaultdict
+from discord import app_commands
+
+# Discord 自动补全最多返回 25 个选项，选项名最长 100 个字符
+MAX_CHOICES = 25
+MAX_CHOICE_NAME = 100
+# 最长的索引片段长度；更长的查询取其所有 3-gram 求交集
+GRAM_SIZE = 3
+
+_BILINGUAL_NAME = re.compile(r'^(.*?)\s*[（(]\s*(.*?)\s*[)）]\s*$')
+
+# 排名层级：整体/中文/英文部分前缀 < 英文单词前缀 < 任意子串
+RANK_PREFIX, RANK_WORD_PREFIX, RANK_SUBSTRING = 0, 1, 2
+
+
+def split_name(name):
+    """把 `愚人 (The Fool)` 这类名称拆成 (整体, 中文部分, 英文部分)，均已转为小写。"""
+    lowered = name.lower().strip()
+    match = _BILINGUAL_NAME.match(lowered)
+    if not match:
+        return lowered, lowered, ""
+    return lowered, match.group(1), match.group(2)
+
+
+def _grams(text):
+    """返回文本中所有长度 1..GRAM_SIZE 的片段。"""
+    result = set()
+    for size in range(1, GRAM_SIZE + 1):
+        for i in range(len(text) - size + 1):
+            result.add(text[i:i + size])
+    return result
+
+
+class AutocompleteIndex:
+    """按牌组版本构建一次的自动补全索引。
+
+    名称预先转为小写并拆分中英文部分，建立 n-gram 倒排索引；每个条目的
+    `app_commands.Choice` 也预先构建好。查询结果按“前缀优先于子串”排序，
+    并在本版本内按查询字符串缓存，重复的按键直接返回同一个列表。
+    """
+
+    def __init__(self, entries, cache_size=512):
+        """`entries` 为 (搜索名称, 值, 显示名称) 的序列，顺序即同级结果的排序。"""
+        self._choices = []
+        self._prefixes = []
+        self._words = []
+        self._haystacks = []
+        self._grams = defaultdict(set)
+        for position, (search_name, value, display_name) in enumerate(entries):
+            full, chinese, english = split_name(search_name)
+            self._choices.append(app_commands.Choice(name=display_name[:MAX_CHOICE_NAME], value=value))
+            self._prefixes.append(tuple(p for p in (full, chinese, english) if p))
+            self._words.append(tuple(english.split()))
+            self._haystacks.append(full)
+            for gram in _grams(full):
+                self._grams[gram].add(position)
+
+        self._default = self._choices[:MAX_CHOICES]
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def _candidates(self, query):
+        if len(query) <= GRAM_SIZE:
+            return self._grams.get(query, ())
+        postings = [self._grams.get(query[i:i + GRAM_SIZE]) for i in range(len(query) - GRAM_SIZE + 1)]
+        if not all(postings):
+            return ()
+        postings.sort(key=len)
+        return set.intersection(*postings)
+
+    def _rank(self, position, query):
+        if any(p.startswith(query) for p in self._prefixes[position]):
+            return RANK_PREFIX
+        if any(w.startswith(query) for w in self._words[position]):
+            return RANK_WORD_PREFIX
+        if query in self._haystacks[position]:
+            return RANK_SUBSTRING
+        return None
+
+    def search(self, current):
+        """返回最多 25 个按相关度排序的 `Choice`。"""
+        query = current.lower().strip()
+        if not query:
+            return self._default
+
+        cached = self._cache.get(query)
+        if cached is not None:
+            self._cache.move_to_end(query)
+            return cached
+
+        ranked = []
+        for position in self._candidates(query):
+            rank = self._rank(position, query)
+            if rank is not None:
+                ranked.append((rank, position))
+        ranked.sort()
+        result = [self._choices[position] for _, position in ranked[:MAX_CHOICES]]
+
+        self._cache[query] = result
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def __len__(self):
+        return len(self._choices)
+
+
+def build_tarot_index(tarot_cards):
+    """为塔罗牌选择器构建索引。"""
+    return AutocompleteIndex((card['name'], card['id'], card['name']) for card in tarot_cards)
+
+
+def build_fortune_level_index(fortune_data):
+    """为运势等级选择器构建索引，显示名称带星级。"""
+    return AutocompleteIndex(
+        (level.get('level_name', ''), level['id'], f"({level.get('stars', 'N/A')}★) {level.get('level_name', '')}")
+        for level in fortune_data.get('levels', [])
+    )
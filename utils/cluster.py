@@ -0,0 +1,328 @@
+import concurrent.futures
+import itertools
+import json
+import mmap
+import multiprocessing
+import multiprocessing.connection
+import os
+import struct
+import threading
+import time
+from .logger import logger
+from .data_manager import deck_store, validate_tarot_deck, validate_fortune_deck, validate_overrides
+from .overlays import guild_decks
+
+SNAPSHOT_FILE = '.deck_snapshot'
+SNAPSHOT_MAGIC = b'DKS1'
+# 魔数、快照版本、负载长度
+_HEADER = struct.Struct('<4sQI')
+# 文件名 -> (默认数据, 校验函数, 文件是否可以不存在)
+DECK_VALIDATORS = {
+    'tarot.json': (None, validate_tarot_deck, False),
+    'fortune.json': ({}, validate_fortune_deck, False),
+    # 服务器覆盖层随基础牌组一起进入快照
+    'tarot_overrides.json': ({}, validate_overrides, True),
+    'fortune_overrides.json': ({}, validate_overrides, True),
+}
+
+
+def shard_ranges(shard_count, workers):
+    """把 0..shard_count-1 划分为 `workers` 段连续区间。"""
+    workers = max(1, min(workers, shard_count))
+    base, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for i in range(workers):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+def shard_for_guild(guild_id, shard_count):
+    """Discord 的分片路由规则。"""
+    return (guild_id >> 22) % shard_count
+
+
+def write_snapshot(path, version, decks):
+    """把所有牌组写成一个只读快照文件（原子替换）。"""
+    payload = json.dumps(decks, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, version, len(payload)))
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+def read_snapshot(path):
+    """以内存映射方式读取快照，返回 (版本, {文件名: 数据})。"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        magic, version, length = _HEADER.unpack_from(view, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} 不是有效的牌组快照")
+        return version, json.loads(view[_HEADER.size:_HEADER.size + length])
+
+def apply_snapshot(data_dir):
+    """把快照中的牌组放入本进程的 deck_store，返回快照版本。"""
+    version, decks = read_snapshot(os.path.join(data_dir, SNAPSHOT_FILE))
+    for name, data in decks.items():
+        deck_store.put(os.path.join(data_dir, name), data)
+    return version
+
+
+class WorkerChannel:
+    """工作进程一侧的管道：发送加锁（监听线程与事件循环都会发送），并把牌组修改转交给监督进程。
+
+    工作进程的牌组来自快照，可能已经过期，因此修改不在本地执行：`submit_update` 把 mutator
+    发给监督进程，由它在持有牌组写锁时基于最新数据执行并写盘，结果通过 ('updated', ...) 返回。
+    mutator 需要能被 pickle（模块级函数或其 `functools.partial`）。
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._ids = itertools.count(1)
+
+    def send(self, message):
+        with self._send_lock:
+            self._conn.send(message)
+
+    def recv(self):
+        return self._conn.recv()
+
+    def submit_update(self, name, kind, guild_id, mutator):
+        """请求监督进程修改牌组 `name`，返回 `concurrent.futures.Future`，结果与 `GuildDecks.update` 相同。"""
+        future = concurrent.futures.Future()
+        request_id = next(self._ids)
+        self._pending[request_id] = future
+        try:
+            self.send(('update', request_id, name, kind, guild_id, mutator))
+        except Exception:
+            self._pending.pop(request_id, None)
+            raise
+        return future
+
+    def resolve(self, request_id, result, error):
+        future = self._pending.pop(request_id, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def fail_pending(self, error):
+        """管道断开时让所有等待中的修改失败，而不是永远挂起。"""
+        for request_id in list(self._pending):
+            self.resolve(request_id, None, error)
+
+
+def worker_listen(channel, data_dir, on_stop, on_renders=None):
+    """在工作进程的后台线程中处理监督进程的消息。
+
+    - ('reload', version): 重新映射快照并替换本进程的牌组，随后回报 ('reloaded', version)
+    - ('updated', request_id, result, error): `submit_update` 的执行结果
+    - ('renders',): 预渲染清单已更新
+    - ('stop',): 调用 `on_stop` 并退出
+    """
+    def loop():
+        while True:
+            try:
+                message = channel.recv()
+            except (EOFError, OSError):
+                channel.fail_pending(ConnectionError("与监督进程的连接已断开"))
+                on_stop()
+                return
+            kind = message[0]
+            if kind == 'reload':
+                try:
+                    channel.send(('reloaded', apply_snapshot(data_dir)))
+                except Exception as e:
+                    logger.error("加载牌组快照失败: %s", e)
+            elif kind == 'updated':
+                channel.resolve(*message[1:])
+            elif kind == 'renders' and on_renders:
+                on_renders()
+            elif kind == 'stop':
+                channel.fail_pending(ConnectionError("工作进程正在关闭"))
+                on_stop()
+                return
+
+    thread = threading.Thread(target=loop, name='cluster-listener', daemon=True)
+    thread.start()
+    return thread
+
+
+class _Worker:
+    __slots__ = ('index', 'shard_ids', 'process', 'conn', 'ready', 'snapshot_version')
+
+    def __init__(self, index, shard_ids):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.process = None
+        self.conn = None
+        self.ready = False
+        self.snapshot_version = 0
+
+
+class ClusterSupervisor:
+    """多进程分片集群的监督进程。
+
+    监督进程是牌组文件唯一的读写者：它通过 deck_store 发现变更（网页后台编辑或
+    外部修改），把所有牌组写成内存映射快照并向每个工作进程广播 reload；工作进程
+    只从快照加载，从不直接解析或写入牌组文件，指令中的修改经管道交给监督进程执行
+    （见 `WorkerChannel`），与网页后台的编辑在同一把写锁下串行。工作进程异常退出时
+    会按原分片重新拉起。
+    """
+
+    def __init__(self, worker_target, workers, shard_count, data_dir, fake_gateway=False, poll_interval=2.0):
+        self.worker_target = worker_target
+        self.shard_count = shard_count
+        self.data_dir = data_dir
+        self.fake_gateway = fake_gateway
+        self.poll_interval = poll_interval
+        self.snapshot_version = 0
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = [_Worker(i, ids) for i, ids in enumerate(shard_ranges(shard_count, workers))]
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stopping = threading.Event()
+
+    # --- 快照与广播 ---
+
+    def _deck_paths(self):
+        return {name: os.path.join(self.data_dir, name) for name in DECK_VALIDATORS}
+
+    def _on_deck_change(self, path, version):
+        if path in {os.path.abspath(p) for p in self._deck_paths().values()}:
+            self._dirty.set()
+
+    def publish(self):
+        """写出新快照并通知所有工作进程。"""
+        with self._lock:
+            decks = {}
+            for name, path in self._deck_paths().items():
+                default_data, validator, optional = DECK_VALIDATORS[name]
+                decks[name] = deck_store.get(path, default_data, validator, optional)
+            self.snapshot_version += 1
+            write_snapshot(os.path.join(self.data_dir, SNAPSHOT_FILE), self.snapshot_version, decks)
+            logger.info("已发布牌组快照 v%s", self.snapshot_version)
+        self.broadcast(('reload', self.snapshot_version))
+
+    def broadcast(self, message):
+        for worker in self._workers:
+            if worker.conn is not None:
+                try:
+                    worker.conn.send(message)
+                except (OSError, ValueError):
+                    pass
+
+    # --- 进程管理 ---
+
+    def _spawn(self, worker):
+        parent_conn, child_conn = self._context.Pipe()
+        worker.process = self._context.Process(
+            target=self.worker_target,
+            args=(worker.index, worker.shard_ids, self.shard_count, child_conn, self.fake_gateway),
+            name=f"shard-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.conn = parent_conn
+        worker.ready = False
+        worker.process.start()
+        child_conn.close()
+        logger.info("已启动工作进程 %s (PID %s)，分片 %s", worker.index, worker.process.pid, worker.shard_ids)
+
+    def _drain_messages(self, worker):
+        try:
+            while worker.conn.poll():
+                try:
+                    message = worker.conn.recv()
+                except (EOFError, OSError):
+                    raise
+                except Exception as e:
+                    # 消息已完整读出，只是无法反序列化（例如 mutator 引用了不存在的函数）
+                    logger.error("无法解析工作进程 %s 的消息: %s", worker.index, e)
+                    continue
+                if message[0] == 'ready':
+                    worker.ready = True
+                    logger.info("工作进程 %s 已就绪，分片 %s", worker.index, message[1])
+                elif message[0] == 'reloaded':
+                    worker.snapshot_version = message[1]
+                elif message[0] == 'update':
+                    self._apply_update(worker, *message[1:])
+        except (EOFError, OSError):
+            pass
+
+    def _apply_update(self, worker, request_id, name, kind, guild_id, mutator):
+        """执行工作进程请求的牌组修改并回报结果；写入触发的变更通知会在下一轮发布新快照。"""
+        if name not in DECK_VALIDATORS:
+            result, error = None, ValueError(f"未知的牌组: {name}")
+        else:
+            try:
+                result, error = guild_decks(os.path.join(self.data_dir, name), kind).update(guild_id, mutator), None
+            except Exception as e:
+                logger.warning("工作进程 %s 请求的牌组修改失败: %s", worker.index, e)
+                result, error = None, e
+        try:
+            worker.conn.send(('updated', request_id, result, error))
+        except (OSError, ValueError):
+            pass
+        except Exception as e:
+            # 结果或异常无法序列化（序列化先于写入管道，不会留下半条消息）
+            worker.conn.send(('updated', request_id, None, RuntimeError(f"无法回传牌组修改结果: {e}")))
+
+    def is_ready(self):
+        return all(worker.ready for worker in self._workers)
+
+    def status(self):
+        return [
+            {
+                "worker": w.index, "shards": w.shard_ids, "ready": w.ready,
+                "alive": bool(w.process and w.process.is_alive()), "snapshot_version": w.snapshot_version,
+            }
+            for w in self._workers
+        ]
+
+    def start(self):
+        deck_store.subscribe(self._on_deck_change)
+        self.publish()
+        # 首次加载触发的变更通知已包含在这次发布中
+        self._dirty.clear()
+        for worker in self._workers:
+            self._spawn(worker)
+
+    def run(self):
+        """监督循环：检测牌组变化、收集工作进程消息、重启异常退出的进程，直到 `stop`。"""
+        while not self._stopping.is_set():
+            # 触发 deck_store 检查文件 mtime，外部修改也会经由订阅回调标记为脏
+            for name, path in self._deck_paths().items():
+                default_data, validator, optional = DECK_VALIDATORS[name]
+                deck_store.get(path, default_data, validator, optional)
+            if self._dirty.is_set():
+                self._dirty.clear()
+                self.publish()
+
+            for worker in self._workers:
+                self._drain_messages(worker)
+                if not worker.process.is_alive() and not self._stopping.is_set():
+                    logger.warning("工作进程 %s 已退出 (代码 %s)，正在重启", worker.index, worker.process.exitcode)
+                    self._spawn(worker)
+            # 有工作进程发来消息（例如牌组修改请求）时立即处理，否则最多等待一个轮询间隔
+            multiprocessing.connection.wait(
+                [worker.conn for worker in self._workers if worker.conn is not None], self.poll_interval)
+
+    def request_stop(self):
+        """让 `run` 尽快返回（可在信号处理函数中调用）。"""
+        self._stopping.set()
+
+    def stop(self, timeout=15):
+        """通知所有工作进程关闭并等待退出。"""
+        self._stopping.set()
+        self.broadcast(('stop',))
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logger.warning("工作进程 %s 未能按时退出，强制终止", worker.index)
+                worker.process.terminate()
@@ -0,0 +1,140 @@
+"""应用指令同步：只在指令树变化时才调用 Discord 的批量覆盖接口。
+
+每个范围（全局或某个服务器）上次成功同步的指令哈希保存在 `<HF_DISK_PATH>/command_sync.json`，
+重启时指令没有变化就跳过同步。多个服务器并发同步，遇到限流或服务器错误时按 `retry_after`
+或指数退避重试。`clear_commands.py` 也通过这里清除指令并更新记录，下次启动时会重新同步。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import discord
+from .logger import logger
+from .data_manager import _write_json_atomic
+from .metrics import command_syncs
+
+STATE_FILE = 'command_sync.json'
+GLOBAL_SCOPE = 'global'
+MAX_BACKOFF = 60.0
+
+
+def parse_guild_ids(value):
+    """解析逗号分隔的服务器 ID 列表（DISCORD_GUILD_ID 的格式）。"""
+    return [int(gid.strip()) for gid in (value or '').split(',') if gid.strip()]
+
+
+async def command_payload(tree, guild=None):
+    """返回与 `CommandTree.sync` 实际发送的内容相同的指令列表。"""
+    commands = tree.get_commands(guild=guild)
+    translator = tree.translator
+    if translator:
+        return [await command.get_translated_payload(tree, translator) for command in commands]
+    return [command.to_dict(tree) for command in commands]
+
+def payload_hash(payload):
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class CommandSyncer:
+    """按范围比较指令哈希，只同步发生变化的范围。
+
+    `force=True`（或环境变量 `COMMAND_SYNC_FORCE=1`）时忽略记录，总是同步。
+    """
+
+    def __init__(self, tree, data_dir=None, concurrency=None, max_attempts=5, force=None):
+        self.tree = tree
+        self.state_path = os.path.join(data_dir or os.getenv('HF_DISK_PATH', 'data'), STATE_FILE)
+        self.concurrency = concurrency or int(os.getenv('COMMAND_SYNC_CONCURRENCY', 4))
+        self.max_attempts = max_attempts
+        self.force = force if force is not None else os.getenv('COMMAND_SYNC_FORCE', '0') == '1'
+        self._state = None
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        except (OSError, ValueError) as e:
+            logger.warning("读取指令同步记录失败，将重新同步所有指令: %s", e)
+            state = {}
+        # 换了机器人（application_id 不同）时旧记录全部作废
+        if state.get('application_id') != self.tree.client.application_id:
+            state = {'application_id': self.tree.client.application_id, 'scopes': {}}
+        state.setdefault('scopes', {})
+        return state
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        _write_json_atomic(self.state_path, self._state)
+
+    async def _sync_with_backoff(self, guild, scope):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await self.tree.sync(guild=guild)
+            except discord.RateLimited as e:
+                last = e
+                delay = e.retry_after
+            except discord.HTTPException as e:
+                # 只重试限流和 Discord 服务器错误；权限不足、指令无效等直接失败
+                if e.status != 429 and e.status < 500:
+                    raise
+                last = e
+                delay = min(MAX_BACKOFF, 2 ** attempt) * random.uniform(0.5, 1.0)
+            if attempt == self.max_attempts:
+                # 重试用尽时抛出最后一次的真实错误
+                raise last
+            logger.warning("同步 %s 的指令被限流或失败，%.1fs 后重试 (%s/%s)", scope, delay, attempt, self.max_attempts)
+            await asyncio.sleep(delay)
+
+    async def _sync_scope(self, guild, semaphore, force):
+        scope = GLOBAL_SCOPE if guild is None else str(guild.id)
+        try:
+            payload = await command_payload(self.tree, guild)
+            digest = payload_hash(payload)
+            recorded = self._state['scopes'].get(scope)
+            if not force and recorded and recorded.get('hash') == digest:
+                command_syncs.inc(result='skipped')
+                return scope, 'skipped'
+            async with semaphore:
+                await self._sync_with_backoff(guild, scope)
+            self._state['scopes'][scope] = {'hash': digest, 'commands': len(payload), 'synced_at': int(time.time())}
+            command_syncs.inc(result='synced')
+            logger.info("已同步 %s 的 %s 个指令", scope, len(payload))
+            return scope, 'synced'
+        except Exception as e:
+            command_syncs.inc(result='failed')
+            logger.error("无法同步 %s 的指令: %s", scope, e)
+            return scope, 'failed'
+
+    async def sync(self, guild_ids=(), force=None):
+        """同步各服务器（`guild_ids` 为空时同步全局）的指令，返回 {范围: synced/skipped/failed}。"""
+        if self._state is None:
+            self._state = self._load_state()
+        force = self.force if force is None else force
+        guilds = [discord.Object(id=gid) for gid in guild_ids] or [None]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = dict(await asyncio.gather(*(self._sync_scope(guild, semaphore, force) for guild in guilds)))
+        if 'synced' in results.values():
+            try:
+                await asyncio.to_thread(self._save_state)
+            except OSError as e:
+                logger.error("保存指令同步记录失败，下次启动时会重新同步: %s", e)
+        return results
+
+    async def clear(self, guild_ids=()):
+        """清除各服务器（`guild_ids` 为空时清除全局）的指令，并记录为空指令列表。"""
+        for gid in guild_ids or [None]:
+            self.tree.clear_commands(guild=discord.Object(id=gid) if gid is not None else None)
+        return await self.sync(guild_ids, force=True)
+
+
+def summarize(results):
+    """把同步结果汇总为一行日志文本。"""
+    counts = {}
+    for result in results.values():
+        counts[result] = counts.get(result, 0) + 1
+    return ', '.join(f"{result} {count}" for result, count in sorted(counts.items()))
@@ -1,5 +1,13 @@
+import atexit
+import copy
 import json
-from .logger import logger
+import logging
+import os
+import tempfile
+import threading
+import time
+from .logger import logger, op_logger
+from .deck_schema import DeckValidationError, check_tarot_deck, check_fortune_deck, format_issues
 
 def load_json_data(file_path, default_data=None):
     """从指定路径加载 JSON 数据。"""
@@ -7,14 +15,368 @@ def load_json_data(file_path, default_data=None):
         with open(file_path, 'r', encoding='utf-8') as f:
             return json.load(f)
     except (FileNotFoundError, json.JSONDecodeError) as e:
-        logger.warning(f"无法加载 {file_path}: {e}。将返回默认数据。")
+        logger.warning("无法加载 %s: %s。将返回默认数据。", file_path, e)
         return default_data if default_data is not None else []
 
-def save_json_data(file_path, data):
-    """将数据保存到指定的 JSON 文件。"""
+def _write_json_atomic(file_path, data):
+    """先写临时文件并 fsync，再原子替换目标文件，避免写到一半崩溃导致数据损坏。"""
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(file_path)}.", suffix=".tmp", dir=directory)
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
-        logger.info(f"数据已成功保存到 {file_path}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    # 同步目录项，确保 rename 本身也已落盘
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+def _write_lock(file_path):
+    """返回某个文件专属的可重入写锁，跨线程串行化同一文件的读改写。"""
+    path = os.path.abspath(file_path)
+    with _write_locks_guard:
+        lock = _write_locks.get(path)
+        if lock is None:
+            lock = _write_locks[path] = threading.RLock()
+        return lock
+
+def _save_locked(file_path, data):
+    """调用方需持有写锁。落盘、更新缓存，并丢弃该文件尚未写出的旧合并数据。"""
+    deck_store.backend.write(file_path, data)
+    deck_store.put(file_path, data)
+    deck_writer.discard(file_path)
+    logger.info("数据已成功保存到 %s", file_path)
+
+def save_json_data(file_path, data):
+    """将数据原子地保存到指定的 JSON 文件，成功时返回 True。"""
+    try:
+        with _write_lock(file_path):
+            _save_locked(file_path, data)
+        return True
     except Exception as e:
-        logger.error(f"保存数据到 {file_path} 时出错: {e}")
+        logger.error("保存数据到 %s 时出错: %s", file_path, e)
+        return False
+
+def update_deck(file_path, mutator, default_data=None, validator=None, coalesce=False, optional=False):
+    """在写锁内对牌组执行一次读-改-写。
+
+    `mutator` 接收牌组的深拷贝并原地修改，返回 None 表示无需保存。修改后的牌组未通过
+    `validator` 时抛出 `DeckValidationError`，不会保存。
+    `coalesce=True` 时交给 `deck_writer` 合并写入，否则立即落盘，写入失败会抛出异常。
+    返回 `mutator` 的返回值。
+    """
+    with _write_lock(file_path):
+        data = deck_store.get_copy(file_path, default_data, validator, optional)
+        result = mutator(data)
+        if result is None:
+            return None
+        error = validator(data) if validator else None
+        if error:
+            raise DeckValidationError(error)
+        if coalesce:
+            deck_writer.schedule(file_path, data)
+        else:
+            _save_locked(file_path, data)
+        return result
+
+
+class CoalescingWriter:
+    """合并短时间内的多次保存，只把最后一个版本写入磁盘。
+
+    `schedule` 会立即更新内存缓存，读者马上能看到新数据；真正的落盘在
+    `delay` 秒后由后台定时器完成，期间的后续编辑会覆盖待写入的数据。
+    """
+
+    def __init__(self, delay=1.0):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timers = {}
+        self.scheduled = 0
+        self.flushed = 0
+
+    def schedule(self, file_path, data):
+        path = os.path.abspath(file_path)
+        deck_store.put(path, data)
+        with self._lock:
+            self._pending[path] = data
+            self.scheduled += 1
+            if path not in self._timers:
+                timer = threading.Timer(self.delay, self._flush_path, args=(path,))
+                timer.daemon = True
+                self._timers[path] = timer
+                timer.start()
+
+    def _flush_path(self, path):
+        with _write_lock(path):
+            with self._lock:
+                self._timers.pop(path, None)
+                data = self._pending.pop(path, None)
+            if data is None:
+                return
+            try:
+                _save_locked(path, data)
+                self.flushed += 1
+            except Exception as e:
+                logger.error("合并写入 %s 时出错: %s", path, e)
+
+    def discard(self, file_path):
+        """取消某个文件的待写入数据（已被更新的版本直接覆盖时使用）。"""
+        path = os.path.abspath(file_path)
+        with self._lock:
+            self._pending.pop(path, None)
+            timer = self._timers.pop(path, None)
+        if timer is not None:
+            timer.cancel()
+
+    def flush(self):
+        """立即写出所有待保存的数据（关闭前调用）。"""
+        with self._lock:
+            timers = list(self._timers.items())
+        for path, timer in timers:
+            timer.cancel()
+            self._flush_path(path)
+
+    def pending(self):
+        with self._lock:
+            return list(self._pending)
+
+
+def validate_tarot_deck(data):
+    """检查塔罗牌数据结构，返回带字段路径的错误描述，结构正确时返回 None。"""
+    return format_issues(check_tarot_deck(data))
+
+def validate_fortune_deck(data):
+    """检查运势数据结构，返回带字段路径的错误描述，结构正确时返回 None。"""
+    return format_issues(check_fortune_deck(data))
+
+def validate_overrides(data):
+    """检查服务器覆盖数据结构，返回错误描述，结构正确时返回 None。"""
+    if not isinstance(data, dict) or not isinstance(data.get("guilds", {}), dict):
+        return "覆盖数据应为包含 guilds 对象的对象"
+    for guild_id, patch in data.get("guilds", {}).items():
+        if not str(guild_id).isdigit() or not isinstance(patch, dict):
+            return f"服务器 {guild_id} 的覆盖数据无效"
+    return None
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _file_signature(path):
+    """返回文件的 (mtime_ns, size)，文件不存在时返回 None。"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class JsonFileBackend:
+    """默认存储后端：每个牌组是一个 JSON 文件，以 mtime/大小作为变更签名。"""
+    name = 'json'
+
+    signature = staticmethod(_file_signature)
+    read = staticmethod(_read_json)
+    write = staticmethod(_write_json_atomic)
+
+
+def _default_backend():
+    """根据 STORAGE_BACKEND 选择存储后端。"""
+    if os.getenv('STORAGE_BACKEND', 'json').lower() == 'sqlite':
+        from .sqlite_store import SqliteBackend, default_db_path
+        return SqliteBackend(default_db_path())
+    return JsonFileBackend()
+
+
+def record_change(file_path, entry_key, entry_name, field, old_value, new_value,
+                  source=None, actor=None, actor_id=None, guild_id=None):
+    """记录一次条目编辑：SQLite 后端写入 history 表，JSON 后端写入操作日志。"""
+    backend = deck_store.backend
+    if hasattr(backend, 'record_history'):
+        try:
+            backend.record_history(file_path, entry_key, entry_name, field, old_value, new_value,
+                                   source, actor, actor_id, guild_id)
+            return
+        except Exception as e:
+            logger.error("写入编辑历史失败，改写操作日志: %s", e)
+    op_logger.info(
+        "User '%s' (ID: %s) updated %s of %s entry (ID: %s, Name: %s) in guild %s: from '%s' to '%s' (source: '%s')",
+        actor, actor_id, field, os.path.basename(file_path), entry_key, entry_name, guild_id, old_value, new_value, source
+    )
+
+
+class _DeckEntry:
+    __slots__ = ('data', 'signature', 'version', 'checked_at', 'compiled')
+
+    def __init__(self, data, signature, version, checked_at):
+        self.data = data
+        self.signature = signature
+        self.version = version
+        self.checked_at = checked_at
+        # 基于本版本数据构建的派生结构（编译后的模型、索引等），随版本一起失效
+        self.compiled = {}
+
+
+class DeckStore:
+    """线程安全的内存牌组缓存。
+
+    解析并校验后的数据常驻内存，只有当文件的 mtime/大小变化，或者进程内通过
+    `put` 写入新版本时才会重新加载。`get` 返回的是共享对象，调用方只能读取；
+    需要修改时请使用 `get_copy`。
+    """
+
+    def __init__(self, check_interval=0.5, backend=None):
+        # 两次检查签名之间的最短间隔（秒），避免每次交互都触发系统调用或查询
+        self.check_interval = check_interval
+        self.backend = backend or JsonFileBackend()
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._next_version = 1
+        self._listeners = []
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _bump_version(self):
+        version = self._next_version
+        self._next_version += 1
+        return version
+
+    def _store(self, path, data, signature, now):
+        """调用方需持有 self._lock。写入新版本并通知订阅者。"""
+        entry = self._entries[path] = _DeckEntry(data, signature, self._bump_version(), now)
+        for listener in self._listeners:
+            try:
+                listener(path, entry.version)
+            except Exception as e:
+                logger.error("牌组变更回调出错: %s", e)
+
+    def subscribe(self, listener):
+        """注册 `listener(path, version)`，每当某个牌组产生新版本时调用。
+
+        回调在持有缓存锁的线程中执行，必须快速返回（例如只安排一次后台任务）。
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def get(self, file_path, default_data=None, validator=None, optional=False):
+        """返回缓存的牌组数据，必要时从磁盘重新加载。
+
+        `optional=True` 表示文件不存在是正常状态（例如还没有任何服务器覆盖），只记录 DEBUG 日志。
+        """
+        path = os.path.abspath(file_path)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                if now - entry.checked_at < self.check_interval:
+                    self.hits += 1
+                    return entry.data
+                signature = self.backend.signature(path)
+                entry.checked_at = now
+                if signature == entry.signature:
+                    self.hits += 1
+                    return entry.data
+            else:
+                signature = self.backend.signature(path)
+
+            self.misses += 1
+            try:
+                data = self.backend.read(path)
+                error = validator(data) if validator else None
+            except FileNotFoundError as e:
+                logger.log(logging.DEBUG if optional else logging.WARNING, "无法加载 %s: %s。将返回默认数据。", path, e)
+                data = default_data if default_data is not None else []
+                error = None
+            except (OSError, ValueError) as e:
+                error = f"无法解析: {e}"
+            if error:
+                logger.error("牌组 %s 校验失败: %s", path, error)
+                if entry is not None:
+                    # 保留上一个有效版本，但记录新签名以免反复重试
+                    entry.signature = signature
+                    return entry.data
+                data = default_data if default_data is not None else []
+
+            if entry is not None:
+                self.reloads += 1
+                logger.info("检测到 %s 已变化，重新加载 (版本 %s -> %s)", path, entry.version, self._next_version)
+            self._store(path, data, signature, now)
+            return data
+
+    def get_compiled(self, file_path, key, builder, default_data=None, validator=None):
+        """返回由 `builder(data)` 构建的派生结构，每个牌组版本只构建一次。"""
+        path = os.path.abspath(file_path)
+        with self._lock:
+            data = self.get(path, default_data, validator)
+            entry = self._entries[path]
+            if key not in entry.compiled:
+                entry.compiled[key] = builder(data)
+            return entry.compiled[key]
+
+    def get_copy(self, file_path, default_data=None, validator=None, optional=False):
+        """返回牌组数据的深拷贝，供编辑使用。"""
+        return copy.deepcopy(self.get(file_path, default_data, validator, optional))
+
+    def version(self, file_path):
+        """返回当前缓存版本号，尚未加载时返回 0。"""
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(file_path))
+            return entry.version if entry else 0
+
+    def put(self, file_path, data):
+        """在进程内写入新数据后更新缓存，使其他读者立即看到新版本。
+
+        如果缓存中已经是同一个对象（例如合并写入最终落盘），只刷新文件签名，不增加版本号。
+        """
+        path = os.path.abspath(file_path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.data is data:
+                entry.signature = self.backend.signature(path)
+                entry.checked_at = time.monotonic()
+                return
+            self._store(path, data, self.backend.signature(path), time.monotonic())
+            self.reloads += 1
+
+    def invalidate(self, file_path=None):
+        """丢弃指定文件（或全部）的缓存。"""
+        with self._lock:
+            if file_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(file_path), None)
+
+    def stats(self):
+        """返回命中/未命中/重载计数以及各文件的当前版本。"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "versions": {path: entry.version for path, entry in self._entries.items()},
+            }
+
+
+# 进程级共享实例，cogs 与网页路由都从这里读取牌组
+deck_store = DeckStore(backend=_default_backend())
+# 网页后台的批量编辑通过它合并写入
+deck_writer = CoalescingWriter()
+atexit.register(deck_writer.flush)
@@ -0,0 +1,222 @@
+"""牌组的结构校验与规范化。
+
+牌组在加载或编辑时校验一次，每个问题都带有 JSON Pointer 形式的路径（例如 `/3/description/reversed`），
+便于在网页后台或日志中直接定位。校验通过的牌组由 `compile_tarot` / `compile_fortune` 编译为只读结构，
+抽取时不再检查字段。
+"""
+import math
+from collections.abc import Hashable
+
+MAX_STARS = 7
+# 未设置 weight 的条目按该权重参与抽取
+DEFAULT_WEIGHT = 1
+FORTUNE_SECTIONS = ('levels', 'activities', 'domains', 'connectors')
+ACTIVITY_POOLS = ('good', 'bad')
+# 报告中最多列出的问题数，其余只给出总数
+MAX_REPORTED_ISSUES = 5
+
+
+class DeckValidationError(ValueError):
+    """编辑后的牌组未通过校验，消息中包含出错字段的路径。"""
+
+
+class DeckIssue:
+    """一处校验问题：JSON Pointer 路径与说明。"""
+    __slots__ = ('path', 'message')
+
+    def __init__(self, path, message):
+        self.path = path
+        self.message = message
+
+    def __str__(self):
+        return f"{self.path or '/'}: {self.message}"
+
+
+def pointer(*tokens):
+    """把路径片段拼接为 JSON Pointer (RFC 6901)。"""
+    return ''.join('/' + str(token).replace('~', '~0').replace('/', '~1') for token in tokens)
+
+
+def format_issues(issues):
+    """把问题列表格式化为一行错误描述，没有问题时返回 None。"""
+    if not issues:
+        return None
+    text = '; '.join(str(issue) for issue in issues[:MAX_REPORTED_ISSUES])
+    if len(issues) > MAX_REPORTED_ISSUES:
+        text += f" 等共 {len(issues)} 处问题"
+    return text
+
+
+def clean_lines(values):
+    """去掉每项首尾的空白并丢弃空项，用于连接语这类逗号分隔的短句列表。"""
+    return [value.strip() for value in values if isinstance(value, str) and value.strip()]
+
+
+class _Checker:
+    def __init__(self):
+        self.issues = []
+
+    def error(self, path, message):
+        self.issues.append(DeckIssue(path, message))
+
+    def mapping(self, value, path):
+        if not isinstance(value, dict):
+            self.error(path, "应为对象")
+            return False
+        return True
+
+    def sequence(self, value, path):
+        if not isinstance(value, list):
+            self.error(path, "应为列表")
+            return False
+        return True
+
+    def text(self, entry, key, path, required=True):
+        """检查字符串字段；必填字段不能只有空白。"""
+        field_path = pointer(*path, key)
+        if key not in entry:
+            if required:
+                self.error(field_path, "缺少字段")
+            return
+        value = entry[key]
+        if value is None and not required:
+            return
+        if not isinstance(value, str):
+            self.error(field_path, "应为字符串")
+        elif required and not value.strip():
+            self.error(field_path, "不能为空")
+
+    def integer(self, entry, key, path, minimum=None, maximum=None, required=False):
+        field_path = pointer(*path, key)
+        if key not in entry:
+            if required:
+                self.error(field_path, "缺少字段")
+            return
+        value = entry[key]
+        # bool 是 int 的子类，但不是合法的数值
+        if not isinstance(value, int) or isinstance(value, bool):
+            self.error(field_path, "应为整数")
+        elif minimum is not None and value < minimum:
+            self.error(field_path, f"不能小于 {minimum}")
+        elif maximum is not None and value > maximum:
+            self.error(field_path, f"不能大于 {maximum}")
+
+    def weight(self, entry, path):
+        """可选的抽取权重：非负数，缺省为 `DEFAULT_WEIGHT`。"""
+        if 'weight' not in entry:
+            return
+        value = entry['weight']
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+            self.error(pointer(*path, 'weight'), "应为数字")
+        elif value < 0:
+            self.error(pointer(*path, 'weight'), "不能小于 0")
+
+    def total_weight(self, entries, path):
+        """所有条目的权重不能都为 0，否则无法抽取。"""
+        if entries and all(isinstance(e, dict) and e.get('weight', DEFAULT_WEIGHT) == 0 for e in entries):
+            self.error(path, "至少需要一个权重大于 0 的条目")
+
+    def unique_ids(self, entries, path, key='id'):
+        seen = set()
+        for i, entry in enumerate(entries):
+            if not isinstance(entry, dict) or key not in entry:
+                continue
+            value = entry[key]
+            # 列表、对象等类型错误已由字段检查报告，这里跳过以免无法放入集合
+            if not isinstance(value, Hashable):
+                continue
+            if value in seen:
+                self.error(pointer(*path, i, key), f"与前面的条目重复: {value}")
+            seen.add(value)
+
+
+def check_tarot_deck(data):
+    """检查塔罗牌组，返回问题列表（`DeckIssue`），结构正确时返回空列表。"""
+    checker = _Checker()
+    if not checker.sequence(data, ''):
+        return checker.issues
+    for i, card in enumerate(data):
+        if not checker.mapping(card, pointer(i)):
+            continue
+        checker.integer(card, 'id', (i,), minimum=0, required=True)
+        checker.text(card, 'name', (i,))
+        checker.text(card, 'image', (i,), required=False)
+        checker.weight(card, (i,))
+        description = card.get('description')
+        if 'description' not in card:
+            checker.error(pointer(i, 'description'), "缺少正逆位解读")
+        elif checker.mapping(description, pointer(i, 'description')):
+            checker.text(description, 'upright', (i, 'description'))
+            checker.text(description, 'reversed', (i, 'description'))
+    checker.unique_ids(data, ())
+    checker.total_weight(data, '')
+    return checker.issues
+
+
+def check_fortune_deck(data):
+    """检查运势牌组，返回问题列表（`DeckIssue`），结构正确时返回空列表。
+
+    连接语中的空项不算错误（编译时会被丢弃），以兼容旧版后台写入的数据。
+    """
+    checker = _Checker()
+    if not checker.mapping(data, ''):
+        return checker.issues
+    missing = [key for key in FORTUNE_SECTIONS if key not in data]
+    for key in missing:
+        checker.error(pointer(key), "缺少字段")
+    if missing:
+        return checker.issues
+
+    levels = data['levels']
+    if checker.sequence(levels, pointer('levels')):
+        if not levels:
+            checker.error(pointer('levels'), "运势等级列表为空")
+        for i, level in enumerate(levels):
+            path = ('levels', i)
+            if not checker.mapping(level, pointer(*path)):
+                continue
+            checker.integer(level, 'id', path, required=True)
+            checker.text(level, 'level_name', path)
+            checker.integer(level, 'stars', path, minimum=0, maximum=MAX_STARS)
+            checker.integer(level, 'good_events', path, minimum=0)
+            checker.integer(level, 'bad_events', path, minimum=0)
+            checker.text(level, 'star_shape', path, required=False)
+            checker.text(level, 'image', path, required=False)
+            checker.weight(level, path)
+        checker.unique_ids(levels, ('levels',))
+        checker.unique_ids(levels, ('levels',), key='level_name')
+        checker.total_weight(levels, pointer('levels'))
+
+    activities = data['activities']
+    if checker.mapping(activities, pointer('activities')):
+        for pool in ACTIVITY_POOLS:
+            entries = activities.get(pool, [])
+            if not checker.sequence(entries, pointer('activities', pool)):
+                continue
+            for i, activity in enumerate(entries):
+                path = ('activities', pool, i)
+                if checker.mapping(activity, pointer(*path)):
+                    checker.text(activity, 'name', path)
+                    checker.text(activity, 'description', path)
+
+    domains = data['domains']
+    if checker.sequence(domains, pointer('domains')):
+        for i, domain in enumerate(domains):
+            path = ('domains', i)
+            if not checker.mapping(domain, pointer(*path)):
+                continue
+            checker.text(domain, 'name', path)
+            fortunes = domain.get('fortunes', {})
+            if checker.mapping(fortunes, pointer(*path, 'fortunes')):
+                for level_name in fortunes:
+                    checker.text(fortunes, level_name, (*path, 'fortunes'), required=False)
+
+    connectors = data['connectors']
+    if checker.mapping(connectors, pointer('connectors')):
+        for key, values in connectors.items():
+            if not checker.sequence(values, pointer('connectors', key)):
+                continue
+            for i, value in enumerate(values):
+                if not isinstance(value, str):
+                    checker.error(pointer('connectors', key, i), "应为字符串")
+    return checker.issues
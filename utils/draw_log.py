@@ -0,0 +1,378 @@
+"""抽取记录：只追加的事件日志与增量统计。
+
+每次抽取只在内存缓冲区追加一条事件；后台线程每隔几秒把缓冲区批量写入
+`<HF_DISK_PATH>/draws/<名称>.log`（JSON Lines，超过大小上限时轮转），并把这批
+事件计入统计。统计定期保存为快照，其中记录了已计入的日志位置，重启时只需
+加载快照并重放快照之后的日志尾部，从不重新扫描整个日志。
+
+集群模式下每个工作进程写自己的日志和快照，汇总时读取其他进程最近保存的快照，因此其他进程
+的部分最多落后一个快照间隔。
+"""
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from .logger import logger
+from .data_manager import _write_json_atomic
+
+SNAPSHOT_PREFIX = 'stats-'
+LOG_SUFFIX = '.log'
+DAY_SECONDS = 86400
+# 统计中最多保留的用户记录数，超出后淘汰最久没有抽取的用户
+DEFAULT_MAX_USERS = 100_000
+
+
+class DrawStats:
+    """可增量更新、可序列化、可合并的抽取统计。
+
+    计数按范围（`all` 或服务器 ID）和类型（tarot/fortune）分别累计；
+    用户记录为 [最后抽取日, 当前连续天数, 最长连续天数, 总次数]，按最近一次抽取的先后排列，
+    设置了 `max_users` 时超出部分从最久没有抽取的用户开始淘汰（再次抽取时从头计算）。
+    """
+
+    def __init__(self, utc_offset_hours=8, max_users=None):
+        self.utc_offset = utc_offset_hours * 3600
+        self.max_users = max_users
+        self.results = {}
+        self.orientations = Counter()
+        self.users = {}
+        self.events = 0
+
+    def _counter(self, scope, kind):
+        kinds = self.results.setdefault(scope, {})
+        counter = kinds.get(kind)
+        if counter is None:
+            counter = kinds[kind] = Counter()
+        return counter
+
+    def apply(self, event):
+        self.events += 1
+        kind, result = event['k'], event['r']
+        self._counter('all', kind)[result] += 1
+        if event.get('g'):
+            self._counter(str(event['g']), kind)[result] += 1
+        if event.get('o'):
+            self.orientations[event['o']] += 1
+
+        day = int(event['t'] + self.utc_offset) // DAY_SECONDS
+        key = str(event['u'])
+        # 取出后重新插入，使字典保持按最近一次抽取排序
+        user = self.users.pop(key, None)
+        if user is None:
+            user = [day, 1, 1, 0]
+        elif day == user[0] + 1:
+            user[1] += 1
+        elif day > user[0] + 1:
+            user[1] = 1
+        user[0] = max(user[0], day)
+        user[2] = max(user[2], user[1])
+        user[3] += 1
+        self.users[key] = user
+        if self.max_users and len(self.users) > self.max_users:
+            self._evict()
+
+    def _evict(self):
+        """一次淘汰约 10% 的最久未抽取用户，避免每条事件都触发淘汰。"""
+        excess = len(self.users) - self.max_users + max(1, self.max_users // 10)
+        for key in list(itertools.islice(self.users, excess)):
+            del self.users[key]
+
+    def merge(self, other):
+        """并入另一个进程的统计（集群模式下汇总各工作进程）。
+
+        同一用户在多个进程都有记录时（在分属不同进程的服务器中抽取），连续天数取最近一次抽取
+        所在进程的记录，最长连续天数取较大者；在这些服务器之间交替抽取的连续天数可能偏小。
+        """
+        self.events += other.events
+        for scope, kinds in other.results.items():
+            for kind, counter in kinds.items():
+                self._counter(scope, kind).update(counter)
+        self.orientations.update(other.orientations)
+        for user_id, record in other.users.items():
+            mine = self.users.get(user_id)
+            if mine is None:
+                self.users[user_id] = list(record)
+            else:
+                total = mine[3] + record[3]
+                latest = max(mine, record, key=lambda r: r[0])
+                self.users[user_id] = [latest[0], latest[1], max(mine[2], record[2]), total]
+
+    def to_dict(self):
+        return {
+            "events": self.events,
+            "results": {scope: {kind: dict(c) for kind, c in kinds.items()} for scope, kinds in self.results.items()},
+            "orientations": dict(self.orientations),
+            "users": self.users,
+        }
+
+    def subset(self, scope='all', user_id=None):
+        """只包含一个范围的计数和一位用户记录的副本，用于汇总单次查询而不必合并全部统计。"""
+        stats = DrawStats(self.utc_offset / 3600)
+        if scope in self.results:
+            stats.results[scope] = self.results[scope]
+        record = self.users.get(str(user_id)) if user_id is not None else None
+        if record is not None:
+            stats.users[str(user_id)] = record
+        return stats
+
+    def counters(self):
+        """不含用户记录的副本（计数对象共享），合并全局分布时不必逐个合并用户。"""
+        stats = DrawStats(self.utc_offset / 3600)
+        stats.events = self.events
+        stats.results = self.results
+        stats.orientations = self.orientations
+        return stats
+
+    @classmethod
+    def from_dict(cls, data, utc_offset_hours=8, max_users=None):
+        stats = cls(utc_offset_hours, max_users)
+        stats.events = data.get("events", 0)
+        stats.results = {
+            scope: {kind: Counter(c) for kind, c in kinds.items()} for scope, kinds in data.get("results", {}).items()
+        }
+        stats.orientations = Counter(data.get("orientations", {}))
+        stats.users = {user_id: list(record) for user_id, record in data.get("users", {}).items()}
+        return stats
+
+    def summary(self, guild_id=None, user_id=None, top=10):
+        """汇总某个范围（默认全部）的分布，以及某位用户的连续抽取记录。"""
+        kinds = self.results.get(str(guild_id) if guild_id else 'all', {})
+        summary = {"total": sum(sum(c.values()) for c in kinds.values()), "kinds": {}}
+        for kind, counter in kinds.items():
+            total = sum(counter.values())
+            summary["kinds"][kind] = {
+                "total": total,
+                "top": [(name, count, count / total) for name, count in counter.most_common(top)],
+            }
+        if user_id is not None:
+            record = self.users.get(str(user_id))
+            if record is not None:
+                today = int(time.time() + self.utc_offset) // DAY_SECONDS
+                # 昨天之前中断的连续记录已不再有效
+                streak = record[1] if today - record[0] <= 1 else 0
+                summary["user"] = {"streak": streak, "best": record[2], "total": record[3]}
+        return summary
+
+    def guild_totals(self, top=10):
+        """抽取次数最多的服务器，返回 [(服务器 ID, 次数)]。"""
+        totals = Counter({
+            int(scope): sum(sum(c.values()) for c in kinds.values())
+            for scope, kinds in self.results.items() if scope != 'all'
+        })
+        return totals.most_common(top)
+
+
+class DrawLog:
+    """只追加的抽取日志，写入在后台线程中批量完成。"""
+
+    def __init__(self, log_dir=None, name='main', flush_interval=2.0, snapshot_interval=60.0,
+                 max_bytes=None, backups=None, utc_offset_hours=None):
+        self.log_dir = log_dir or os.path.join(os.getenv('HF_DISK_PATH', 'data'), 'draws')
+        self.name = name
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self.max_bytes = max_bytes or int(os.getenv('DRAW_LOG_MAX_BYTES', 10 * 1024 * 1024))
+        self.backups = backups if backups is not None else int(os.getenv('DRAW_LOG_BACKUPS', 5))
+        self.utc_offset_hours = utc_offset_hours if utc_offset_hours is not None else float(os.getenv('FORTUNE_UTC_OFFSET', 8))
+        self.max_users = int(os.getenv('DRAW_STATS_MAX_USERS', DEFAULT_MAX_USERS))
+        self._buffer = []
+        self._lock = threading.Lock()
+        # 串行化刷新与快照，保证统计与日志位置一致
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._stats = None
+        self._last_snapshot = 0.0
+        # 其他进程的快照：{路径: (mtime_ns, DrawStats)}，文件未变化时不重新解析
+        self._peers = {}
+        # (本进程事件数, 各快照版本) -> 去重后的用户数
+        self._user_count = (None, 0)
+
+    @property
+    def log_path(self):
+        return os.path.join(self.log_dir, f"{self.name}{LOG_SUFFIX}")
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.log_dir, f"{SNAPSHOT_PREFIX}{self.name}.json")
+
+    def configure(self, name=None, log_dir=None):
+        """在首次记录之前修改日志名称或目录（例如集群工作进程使用各自的文件）。"""
+        if self._stats is not None or self._buffer:
+            raise RuntimeError("抽取日志已开始使用，不能再修改配置")
+        self.name = name or self.name
+        self.log_dir = log_dir or self.log_dir
+
+    def record(self, kind, guild_id, user_id, result, orientation=None):
+        """记录一次抽取，只在内存中追加，可在事件循环中直接调用。"""
+        event = {"t": int(time.time()), "k": kind, "g": guild_id, "u": user_id, "r": result}
+        if orientation:
+            event["o"] = orientation
+        with self._lock:
+            self._buffer.append(event)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='draw-log', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("写入抽取日志失败: %s", e)
+
+    def summary(self, guild_id=None, user_id=None, top=10):
+        """所有进程统计的汇总，见 `DrawStats.summary`（首次调用时从快照和日志尾部恢复）。
+
+        服务器总是由同一个进程处理，其计数是实时的；用户可能在多个进程的服务器中抽取，
+        连续天数会并入其他进程最近的快照。
+        """
+        scope = str(guild_id) if guild_id else 'all'
+        combined = DrawStats(self.utc_offset_hours)
+        with self._flush_lock:
+            combined.merge(self._ensure_stats().subset(scope, user_id))
+        for stats in self._peer_stats():
+            combined.merge(stats.subset(scope, user_id))
+        return combined.summary(guild_id, user_id, top)
+
+    def _ensure_stats(self):
+        if self._stats is None:
+            self._stats = self._restore()
+        return self._stats
+
+    def _restore(self):
+        offset = 0
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            stats = DrawStats.from_dict(snapshot["stats"], self.utc_offset_hours, self.max_users)
+            offset = snapshot.get("offset", 0)
+        except FileNotFoundError:
+            stats = DrawStats(self.utc_offset_hours, self.max_users)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("读取抽取统计快照失败，将从当前日志重新统计: %s", e)
+            stats = DrawStats(self.utc_offset_hours, self.max_users)
+
+        # 只重放快照之后写入的日志尾部
+        try:
+            with open(self.log_path, 'rb') as f:
+                if offset <= os.fstat(f.fileno()).st_size:
+                    f.seek(offset)
+                replayed = 0
+                for line in f:
+                    try:
+                        stats.apply(json.loads(line))
+                        replayed += 1
+                    except ValueError:
+                        continue
+            if replayed:
+                logger.info("已从 %s 重放 %s 条抽取记录", self.log_path, replayed)
+        except FileNotFoundError:
+            pass
+        return stats
+
+    def flush(self, force_snapshot=False):
+        """把缓冲区写入日志并计入统计，必要时轮转日志和保存快照。"""
+        with self._flush_lock:
+            stats = self._ensure_stats()
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if batch:
+                os.makedirs(self.log_dir, exist_ok=True)
+                payload = ''.join(
+                    json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n' for event in batch
+                ).encode('utf-8')
+                try:
+                    size = os.path.getsize(self.log_path)
+                except OSError:
+                    size = 0
+                if size and size + len(payload) > self.max_bytes:
+                    self._rotate()
+                    # 轮转后新日志为空，快照位置从 0 开始
+                    self._save_snapshot(stats, 0)
+                with open(self.log_path, 'ab') as f:
+                    f.write(payload)
+                for event in batch:
+                    stats.apply(event)
+
+            now = time.monotonic()
+            if force_snapshot or (batch and now - self._last_snapshot >= self.snapshot_interval):
+                try:
+                    offset = os.path.getsize(self.log_path)
+                except OSError:
+                    offset = 0
+                self._save_snapshot(stats, offset)
+
+    def _save_snapshot(self, stats, offset):
+        os.makedirs(self.log_dir, exist_ok=True)
+        _write_json_atomic(self.snapshot_path, {"offset": offset, "stats": stats.to_dict()})
+        self._last_snapshot = time.monotonic()
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            source = f"{self.log_path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.log_path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.log_path, f"{self.log_path}.1")
+        else:
+            os.remove(self.log_path)
+        logger.info("抽取日志已轮转: %s", self.log_path)
+
+    def close(self):
+        """停止后台线程，写出剩余事件并保存快照（关闭前调用）。"""
+        self._stopped.set()
+        if self._stats is not None or self._buffer:
+            self.flush(force_snapshot=True)
+
+    def _peer_stats(self):
+        """同目录下其他进程最近保存的统计快照。"""
+        try:
+            names = os.listdir(self.log_dir)
+        except FileNotFoundError:
+            names = []
+        peers = {}
+        for name in names:
+            path = os.path.join(self.log_dir, name)
+            if not name.startswith(SNAPSHOT_PREFIX) or not name.endswith('.json') or path == self.snapshot_path:
+                continue
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                cached = self._peers.get(path)
+                if cached is None or cached[0] != mtime:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        cached = (mtime, DrawStats.from_dict(json.load(f)["stats"], self.utc_offset_hours))
+                peers[path] = cached
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("读取抽取统计快照 %s 失败: %s", name, e)
+        self._peers = peers
+        return [stats for _, stats in peers.values()]
+
+    def combined_stats(self):
+        """本进程的实时统计加上同目录下其他进程最近保存的快照，只合并计数，不含用户记录。"""
+        combined = DrawStats(self.utc_offset_hours)
+        with self._flush_lock:
+            combined.merge(self._ensure_stats().counters())
+        for stats in self._peer_stats():
+            combined.merge(stats.counters())
+        return combined
+
+    def user_count(self):
+        """所有进程中抽取过的用户数（去重），本进程统计和各快照都没有变化时直接返回上次的结果。"""
+        peers = self._peer_stats()
+        with self._flush_lock:
+            own = self._ensure_stats()
+            key = (own.events, tuple(sorted((path, mtime) for path, (mtime, _) in self._peers.items())))
+            if self._user_count[0] == key:
+                return self._user_count[1]
+            users = set(own.users)
+        for stats in peers:
+            users.update(stats.users)
+        self._user_count = (key, len(users))
+        return len(users)
+
+draw_log = DrawLog()
+atexit.register(draw_log.close)
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import random
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+import discord
+from .alias_table import AliasTable
+from .data_manager import validate_fortune_deck
+from .deck_schema import DEFAULT_WEIGHT, MAX_STARS, clean_lines
+
+STAR_ICONS = {'heart': '❤️', 'coin': '💰', 'star': '✨', 'thorn': '🥀', 'skull': '💀'}
+LUCK_COLORS = {
+    "good": discord.Color.gold().value,
+    "neutral": discord.Color.light_grey().value,
+    "bad": discord.Color.dark_purple().value,
+}
+
+
+def luck_type_for(stars):
+    """根据星级判断吉/平/凶。"""
+    if stars >= 5:
+        return "good"
+    if stars <= 2:
+        return "bad"
+    return "neutral"
+
+
+class CompiledLevel:
+    """单个运势等级的预计算结果：抽取时只需替换少量字段。"""
+    __slots__ = ('id', 'name', 'stars', 'star_shape', 'luck_type', 'good_count', 'bad_count',
+                 'title', 'color', 'head_fields', 'domain_field', 'image', 'outros', 'weight')
+
+    def __init__(self, level, domain_text, good_pool_size, bad_pool_size, outros):
+        self.id = level["id"]
+        self.name = level["level_name"].strip()
+        self.stars = level.get("stars", 3)
+        self.weight = level.get("weight", DEFAULT_WEIGHT)
+        self.luck_type = luck_type_for(self.stars)
+        self.good_count = min(level.get("good_events", 2), good_pool_size)
+        self.bad_count = min(level.get("bad_events", 2), bad_pool_size)
+
+        self.star_shape = level.get("star_shape", "star")
+        star_symbol = STAR_ICONS.get(self.star_shape, '✨')
+        stars_display = star_symbol * self.stars + '🖤' * (MAX_STARS - self.stars)
+
+        self.title = f"今日运势 - {self.name}"
+        self.color = LUCK_COLORS[self.luck_type]
+        self.head_fields = (
+            {"name": "幸运等级", "value": f"**{self.name}**", "inline": True},
+            {"name": "幸运星", "value": stars_display, "inline": True},
+        )
+        self.domain_field = {"name": "各领域运势", "value": domain_text, "inline": False} if domain_text else None
+        self.image = (level.get("image") or "").strip() or None
+        self.outros = outros
+
+
+class FortuneDraw:
+    """一次抽取的结果，可复现地渲染为 embed。"""
+    __slots__ = ('level', 'good_text', 'bad_text', 'outro')
+
+    def __init__(self, level, good_text, bad_text, outro):
+        self.level = level
+        self.good_text = good_text
+        self.bad_text = bad_text
+        self.outro = outro
+
+
+class FortuneModel:
+    """按牌组版本编译一次的运势模型（只读）。
+
+    等级按 id 和名称建立索引并按 `weight` 构建别名表，宜忌活动预先渲染为字符串元组，各领域解读按等级
+    预先拼接好，连接语去掉空白和空项，因此一次抽取只需要几个随机下标加上字段替换。
+    """
+
+    def __init__(self, fortune_data):
+        # 内容指纹，跨进程重启保持稳定，用作每日运势种子的一部分
+        canonical = json.dumps(fortune_data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        self.fingerprint = hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+
+        activities = fortune_data.get("activities", {})
+        self.good_pool = tuple(
+            f"**{e['name'].strip()}**: {e['description'].strip()}" for e in activities.get("good", []))
+        self.bad_pool = tuple(
+            f"**{e['name'].strip()}**: {e['description'].strip()}" for e in activities.get("bad", []))
+
+        connectors = fortune_data.get("connectors", {})
+        outros = {luck: tuple(clean_lines(connectors.get(f"outro_{luck}", []))) for luck in LUCK_COLORS}
+
+        domains = fortune_data.get("domains", [])
+        levels = []
+        for level in fortune_data["levels"]:
+            level_name = level["level_name"]
+            domain_lines = []
+            for domain in domains:
+                domain_name = domain["name"].strip()
+                fortune_text = (domain.get("fortunes", {}).get(level_name) or "").strip()
+                if fortune_text:
+                    domain_lines.append(f"**{domain_name}**: {fortune_text}")
+            stars = level.get("stars", 3)
+            levels.append(CompiledLevel(
+                level, "\n".join(domain_lines), len(self.good_pool), len(self.bad_pool),
+                outros[luck_type_for(stars)],
+            ))
+
+        self.levels = tuple(levels)
+        self.level_table = AliasTable([level.weight for level in self.levels])
+        self.by_id = MappingProxyType({level.id: level for level in self.levels})
+        self.by_name = MappingProxyType({level.name: level for level in self.levels})
+
+    def draw(self, rng=random):
+        """抽取一次运势，`rng` 可传入带种子的 `random.Random` 以便复现。"""
+        level = self.levels[self.level_table.sample(rng)]
+        good_text = "\n".join(rng.sample(self.good_pool, level.good_count)) if level.good_count else ""
+        bad_text = "\n".join(rng.sample(self.bad_pool, level.bad_count)) if level.bad_count else ""
+        outro = level.outros[rng.randrange(len(level.outros))] if level.outros else ""
+        return FortuneDraw(level, good_text, bad_text, outro)
+
+    @staticmethod
+    def render(draw, mention, image_resolver=None):
+        """把抽取结果填入该等级预渲染的 embed 骨架，返回可交给 `discord.Embed.from_dict` 的字典。
+
+        `image_resolver(level)` 可返回替代的图片 URL（例如预渲染的背景），返回 None 时使用原图。
+        """
+        level = draw.level
+        fields = list(level.head_fields)
+        if draw.good_text:
+            fields.append({"name": "今日宜", "value": draw.good_text, "inline": False})
+        if draw.bad_text:
+            fields.append({"name": "今日忌", "value": draw.bad_text, "inline": False})
+        if level.domain_field:
+            fields.append(level.domain_field)
+
+        embed = {
+            "type": "rich",
+            "title": level.title,
+            "description": f"喵~ {mention}，这是你今天的运势指引！",
+            "color": level.color,
+            "fields": fields,
+        }
+        if draw.outro:
+            embed["footer"] = {"text": draw.outro}
+        image_url = (image_resolver(level) if image_resolver else None) or level.image
+        if image_url:
+            embed["image"] = {"url": image_url}
+        return embed
+
+
+def daily_rng(user_id, guild_id, day, fingerprint):
+    """由 (用户, 服务器, 日期, 牌组指纹) 派生的确定性随机数生成器，便于复现某次结果。"""
+    key = f"{user_id}:{guild_id or 0}:{day.isoformat()}:{fingerprint}".encode('utf-8')
+    seed = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big')
+    return random.Random(seed)
+
+
+class DailyFortuneCache:
+    """每日运势的 LRU 缓存，日期切换时整体清空。
+
+    只在事件循环线程中使用，因此不加锁。缓存的是渲染好的 embed 字典，
+    同一天内重复请求直接命中，不再抽取和渲染。
+    """
+
+    def __init__(self, maxsize=10000, utc_offset_hours=8):
+        self.maxsize = maxsize
+        self.utc_offset = timedelta(hours=utc_offset_hours)
+        self._entries = OrderedDict()
+        self._day = None
+        self.hits = 0
+        self.misses = 0
+
+    def today(self):
+        return (datetime.now(timezone.utc) + self.utc_offset).date()
+
+    def get_or_render(self, model, user_id, guild_id, mention, image_resolver=None, on_draw=None):
+        """返回当天的运势 embed；只有真正抽取时才调用 `on_draw(draw)`，命中缓存时不调用。"""
+        day = self.today()
+        if day != self._day:
+            self._entries.clear()
+            self._day = day
+
+        key = (user_id, guild_id, model.fingerprint)
+        embed = self._entries.get(key)
+        if embed is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embed
+
+        self.misses += 1
+        draw = model.draw(daily_rng(user_id, guild_id, day, model.fingerprint))
+        if on_draw is not None:
+            on_draw(draw)
+        embed = model.render(draw, mention, image_resolver)
+        self._entries[key] = embed
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return embed
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def compile_fortune(fortune_data):
+    """编译运势数据，结构不正确时返回 None。"""
+    if validate_fortune_deck(fortune_data):
+        return None
+    return FortuneModel(fortune_data)
@@ -0,0 +1,145 @@
+"""网页后台的 HTTP 缓存与压缩。
+
+- 编辑页面的 ETag 由牌组缓存版本号推导，未变化时直接返回 304，变化前的渲染结果按版本缓存；
+- 以内容哈希命名的上传图片与渲染结果永不改变，使用文件名中的哈希作为 ETag 并允许长期缓存；
+- 文本响应按 Accept-Encoding 使用 brotli（已安装 `brotli` 包时）或 gzip 压缩。
+"""
+import gzip
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from .metrics import registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+# 太小的响应压缩后几乎不变，反而多花 CPU
+MIN_COMPRESS_BYTES = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# static/ 下以内容哈希命名的文件：image_ingest 的上传图片与 renderer 的渲染结果
+HASHED_STATIC_FILE = re.compile(r'^(?:uploads|renders)/([0-9a-f]{24,64})\.[A-Za-z0-9]+$')
+
+not_modified_responses = registry.counter(
+    'tarot_web_not_modified_total', '返回 304 的网页请求数量', ('endpoint',))
+page_render_cache_hits = registry.counter(
+    'tarot_web_render_cache_hits_total', '编辑页面命中渲染缓存的次数', ('template',))
+compressed_bytes = registry.counter(
+    'tarot_web_compressed_bytes_total', '压缩前后的响应字节数', ('encoding', 'stage'))
+
+
+def page_etag(*parts):
+    """由页面内容的全部来源（模板、牌组版本号、服务器列表等）计算 ETag。"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20]
+
+
+class CachedPage:
+    """渲染好的页面正文及其各种压缩版本（压缩结果按需生成并缓存）。"""
+    __slots__ = ('body', 'rendered_at', '_encoded')
+
+    def __init__(self, body, rendered_at):
+        self.body = body
+        self.rendered_at = rendered_at
+        self._encoded = {}
+
+    def encoded(self, encoding):
+        """返回 (正文, 实际使用的编码)；正文太小或客户端不支持压缩时编码为 None。"""
+        if encoding is None or len(self.body) < MIN_COMPRESS_BYTES:
+            return self.body, None
+        compressed = self._encoded.get(encoding)
+        if compressed is None:
+            compressed = self._encoded[encoding] = encode_body(self.body, encoding)
+        return compressed, encoding
+
+
+class RenderCache:
+    """按 ETag 缓存渲染好的页面（`CachedPage`），超过容量时淘汰最久未用的。"""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render, template=''):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            page_render_cache_hits.inc(template=template)
+            return entry
+        # 渲染在锁外进行；并发的重复渲染结果相同，后写入的覆盖先写入的即可
+        entry = CachedPage(render().encode('utf-8'), time.time())
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+def apply_static_caching(response, filename, request):
+    """内容哈希文件改用哈希作为 ETag 并允许长期缓存；其他静态文件每次都需重新验证。"""
+    match = HASHED_STATIC_FILE.match(filename or '')
+    if match is None:
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    if response.status_code == 200:
+        # 哈希不随 mtime 变化，集群或重新部署后复制的文件仍能命中客户端缓存
+        response.set_etag(match.group(1))
+        response.make_conditional(request)
+    return response
+
+
+def choose_encoding(accept_encodings):
+    """根据 Accept-Encoding 选择压缩方式，不支持时返回 None。"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def encode_body(body, encoding):
+    if encoding == 'br':
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    compressed_bytes.inc(len(body), encoding=encoding, stage='before')
+    compressed_bytes.inc(len(compressed), encoding=encoding, stage='after')
+    return compressed
+
+
+def compress_response(response, accept_encodings):
+    """就地压缩文本响应。强 ETag 会变为弱 ETag，因为压缩后的字节与原始表示不同。"""
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(encode_body(body, encoding))
+    mark_encoded(response, encoding)
+    return response
+
+
+def mark_encoded(response, encoding):
+    """标记响应已压缩：设置 Content-Encoding，并把强 ETag 改为弱 ETag。"""
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
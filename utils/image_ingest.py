@@ -0,0 +1,210 @@
+"""图片导入管线：镜像远程卡面、缩放到 Discord embed 尺寸、重新编码并去除元数据。
+
+命令行用法（在仓库根目录）:
+    python -m utils.image_ingest [--data-dir data]
+会把 tarot.json / fortune.json 中所有远程图片镜像到 static/uploads，并写回本地路径。
+"""
+import argparse
+import hashlib
+import http.server
+import io
+import mimetypes
+import os
+import threading
+from PIL import Image, ImageOps
+from .logger import logger
+from .data_manager import deck_store, update_deck, validate_tarot_deck, validate_fortune_deck
+from .renderer import fetch_source, open_image
+
+UPLOAD_FOLDER = 'static/uploads'
+# Discord embed 大图的显示区域远小于原图，超过此尺寸的图片只会浪费带宽
+MAX_DIMENSIONS = (800, 1200)
+WEBP_QUALITY = 82
+JPEG_QUALITY = 85
+
+
+def optimize_image(data, max_dimensions=MAX_DIMENSIONS, image_format=None):
+    """缩放并重新编码图片，返回 (字节, 宽, 高, 扩展名)。
+
+    重新编码时不携带 EXIF/ICC 等元数据；默认输出 WebP，设置
+    `IMAGE_FORMAT=jpeg` 时对不透明图片输出 JPEG。
+    """
+    image_format = (image_format or os.getenv('IMAGE_FORMAT', 'webp')).lower()
+    with open_image(data) as source:
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail(max_dimensions, Image.LANCZOS)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        output = io.BytesIO()
+        if image_format == 'jpeg' and not has_alpha:
+            image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            extension = 'jpg'
+        else:
+            image.save(output, 'WEBP', quality=WEBP_QUALITY, method=6)
+            extension = 'webp'
+        return output.getvalue(), image.width, image.height, extension
+
+
+def store_image(data, upload_folder=UPLOAD_FOLDER):
+    """优化图片并以内容哈希命名保存，返回 (相对路径, 元数据)。
+
+    文件名由优化后内容的哈希决定，相同内容只保存一次，且同名文件内容永远不变。
+    """
+    optimized, width, height, extension = optimize_image(data)
+    digest = hashlib.sha256(optimized).hexdigest()
+    filename = f"{digest[:24]}.{extension}"
+    os.makedirs(upload_folder, exist_ok=True)
+    save_path = os.path.join(upload_folder, filename)
+    if not os.path.exists(save_path):
+        tmp_path = f"{save_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(optimized)
+        os.replace(tmp_path, save_path)
+    relative_path = os.path.join(upload_folder, filename).replace(os.path.sep, '/')
+    meta = {"width": width, "height": height, "sha256": digest, "bytes": len(optimized)}
+    return relative_path, meta
+
+
+def mirror_url(url, upload_folder=UPLOAD_FOLDER):
+    """下载远程图片并保存为本地优化副本，返回 (相对路径, 元数据)。"""
+    return store_image(fetch_source(url), upload_folder)
+
+
+IMAGE_FIELDS = ('image', 'image_source', 'image_meta')
+
+def resolve_image(url, upload_folder=UPLOAD_FOLDER):
+    """为图片地址生成条目字段；远程地址会尽量镜像到本地，失败时保留原地址。
+
+    涉及网络请求，应在持有牌组写锁之前调用，再用 `apply_image` 写入条目。
+    """
+    if not url or not url.startswith('http'):
+        return {'image': url}
+    try:
+        local_path, meta = mirror_url(url, upload_folder)
+    except Exception as e:
+        logger.warning("镜像图片 %s 失败，将直接使用远程地址: %s", url, e)
+        return {'image': url}
+    return {'image': local_path, 'image_source': url, 'image_meta': meta}
+
+
+def apply_image(entry, fields):
+    """把 `resolve_image` 的结果写入条目，并清除不再适用的旧字段。"""
+    for key in IMAGE_FIELDS:
+        if key in fields:
+            entry[key] = fields[key]
+        else:
+            entry.pop(key, None)
+
+
+def replace_entry_image(kind, entry_id, fields, data):
+    """牌组 mutator：把 id 为 `entry_id` 的牌或运势等级的图片换成 `fields`，返回 (条目, 旧地址)。
+
+    条目不存在时返回 None，不写入。用 `functools.partial` 绑定前三个参数后可以被 pickle，
+    集群模式下会被发送给监督进程执行。
+    """
+    entries = data if kind == 'tarot' else data.get('levels', [])
+    entry = next((e for e in entries if e['id'] == entry_id), None)
+    if entry is None:
+        return None
+    old_url = entry.get('image', '')
+    apply_image(entry, fields)
+    return entry, old_url
+
+
+def _resolve_remote(entries, upload_folder):
+    """镜像一组条目中的远程图片，返回 {原地址: 字段}（只包含镜像成功的）。"""
+    resolved = {}
+    for entry in entries:
+        url = entry.get('image') or ''
+        if url.startswith('http') and url not in resolved:
+            fields = resolve_image(url, upload_folder)
+            if 'image_source' in fields:
+                resolved[url] = fields
+    return resolved
+
+
+def _apply_resolved(entries, resolved):
+    count = 0
+    for entry in entries:
+        fields = resolved.get(entry.get('image'))
+        if fields:
+            apply_image(entry, fields)
+            count += 1
+    return count or None
+
+
+def ingest_decks(data_dir, upload_folder=UPLOAD_FOLDER):
+    """镜像两个牌组中所有远程图片并写回，返回 {牌组文件: 镜像数量}。"""
+    results = {}
+    tarot_file = os.path.join(data_dir, 'tarot.json')
+    fortune_file = os.path.join(data_dir, 'fortune.json')
+
+    # 先在锁外完成下载，再在写锁内一次性写回
+    tarot_cards = deck_store.get(tarot_file, validator=validate_tarot_deck)
+    resolved = _resolve_remote(tarot_cards, upload_folder)
+    results[tarot_file] = update_deck(
+        tarot_file, lambda cards: _apply_resolved(cards, resolved), validator=validate_tarot_deck) or 0
+
+    levels = deck_store.get(fortune_file, default_data={}, validator=validate_fortune_deck).get('levels', [])
+    resolved = _resolve_remote(levels, upload_folder)
+    results[fortune_file] = update_deck(
+        fortune_file, lambda data: _apply_resolved(data.get('levels', []), resolved),
+        default_data={}, validator=validate_fortune_deck) or 0
+    return results
+
+
+class StubImageServer:
+    """在本地线程中提供固定图片内容的 HTTP 服务器，用于测试镜像流程而不依赖外部 CDN。
+
+    下载时默认拒绝内网地址，使用前需把 `127.0.0.1` 加入 `IMAGE_FETCH_ALLOWED_HOSTS`:
+
+        with StubImageServer({'/card.png': png_bytes}) as server:
+            mirror_url(server.url('/card.png'))
+    """
+
+    def __init__(self, files, host='127.0.0.1', port=0):
+        files = dict(files)
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                body = files.get(path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def url(self, path):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="镜像牌组中的远程图片到本地")
+    parser.add_argument("--data-dir", default=os.getenv('HF_DISK_PATH', 'data'), help="牌组数据目录")
+    args = parser.parse_args()
+    for path, count in ingest_decks(args.data_dir).items():
+        logger.info("%s: 已镜像 %s 张图片", path, count)
+
+
+if __name__ == "__main__":
+    main()
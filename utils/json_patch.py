@@ -0,0 +1,95 @@
+"""JSON Patch (RFC 6902) 的子集：add / replace / remove / test，用于网页后台的按字段编辑。"""
+
+
+class PatchError(ValueError):
+    """补丁格式错误，或路径在文档中不存在。"""
+
+
+class PatchTestFailed(PatchError):
+    """`test` 操作的值与文档不一致。"""
+
+
+def parse_pointer(pointer):
+    """把 JSON Pointer (RFC 6901) 解析为片段列表。"""
+    if pointer == '':
+        return []
+    if not isinstance(pointer, str) or not pointer.startswith('/'):
+        raise PatchError(f"无效的路径: {pointer!r}")
+    return [part.replace('~1', '/').replace('~0', '~') for part in pointer[1:].split('/')]
+
+def _index(container, token, allow_end=False):
+    if token == '-' and allow_end:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith('0')):
+        raise PatchError(f"无效的数组下标: {token!r}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise PatchError(f"数组下标越界: {index}")
+    return index
+
+def resolve_parent(doc, pointer):
+    """返回 (父容器, 最后一个片段)，供调用方就地修改。"""
+    parts = parse_pointer(pointer)
+    if not parts:
+        raise PatchError("不支持替换整个文档")
+    node = doc
+    for token in parts[:-1]:
+        try:
+            node = node[_index(node, token)] if isinstance(node, list) else node[token]
+        except (KeyError, TypeError):
+            raise PatchError(f"路径不存在: {pointer}")
+    if not isinstance(node, (dict, list)):
+        raise PatchError(f"路径不存在: {pointer}")
+    return node, parts[-1]
+
+def get_value(doc, pointer):
+    parent, token = resolve_parent(doc, pointer)
+    try:
+        return parent[_index(parent, token)] if isinstance(parent, list) else parent[token]
+    except KeyError:
+        raise PatchError(f"路径不存在: {pointer}")
+
+
+def apply_operation(doc, operation):
+    """就地执行一个补丁操作。"""
+    if not isinstance(operation, dict) or 'path' not in operation:
+        raise PatchError(f"无效的补丁操作: {operation!r}")
+    op, path = operation.get('op'), operation['path']
+    if op in ('add', 'replace', 'test') and 'value' not in operation:
+        raise PatchError(f"{op} 操作缺少 value: {path}")
+
+    if op == 'test':
+        if get_value(doc, path) != operation['value']:
+            raise PatchTestFailed(f"{path} 的当前值与预期不一致")
+        return
+
+    parent, token = resolve_parent(doc, path)
+    if op == 'add':
+        if isinstance(parent, list):
+            parent.insert(_index(parent, token, allow_end=True), operation['value'])
+        else:
+            parent[token] = operation['value']
+    elif op == 'replace':
+        if isinstance(parent, list):
+            parent[_index(parent, token)] = operation['value']
+        elif token in parent:
+            parent[token] = operation['value']
+        else:
+            raise PatchError(f"路径不存在: {path}")
+    elif op == 'remove':
+        if isinstance(parent, list):
+            del parent[_index(parent, token)]
+        elif token in parent:
+            del parent[token]
+        else:
+            raise PatchError(f"路径不存在: {path}")
+    else:
+        raise PatchError(f"不支持的操作: {op!r}")
+
+def apply_patch(doc, operations):
+    """依次执行所有操作；任何一步失败都会抛出 PatchError，调用方应丢弃部分修改过的文档。"""
+    if not isinstance(operations, list):
+        raise PatchError("补丁应为操作列表")
+    for operation in operations:
+        apply_operation(doc, operation)
+    return doc
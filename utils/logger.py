@@ -1,34 +1,139 @@
+"""日志配置：所有记录先进入内存队列，由后台线程格式化并写出，事件循环中记录日志不会阻塞在 I/O 上。
+
+`LOG_FORMAT=json` 时每条记录输出为一行 JSON，`log_event` 传入的字段（服务器、用户、指令、延迟等）
+成为独立的键；默认的文本格式把这些字段以 `key=value` 附在消息之后。
+"""
+import atexit
+import json
 import os
 import logging
 import logging.handlers
+import queue
+import random
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# 高频事件的默认采样率，可用 LOG_SAMPLE_<事件名> 覆盖，例如 LOG_SAMPLE_DRAW=0.01
+DEFAULT_SAMPLE_RATES = {'draw': 0.1, 'rate_limited': 0.1}
+
+
+class TextFormatter(logging.Formatter):
+    """默认的文本格式，结构化字段以 key=value 附在消息之后。"""
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' | ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出为一行 JSON。"""
+
+    def format(self, record):
+        payload = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        event = getattr(record, 'event', None)
+        if event is not None:
+            payload['event'] = event
+            payload['sample_rate'] = getattr(record, 'sample_rate', 1.0)
+        payload.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _EnqueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # 只在调用线程中合并参数（防止参数对象随后被修改），格式化与异常栈渲染都交给监听线程
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _formatter():
+    if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+        return JsonFormatter()
+    return TextFormatter(TEXT_FORMAT)
 
 def setup_loggers():
-    """配置并返回根日志记录器和操作日志记录器。"""
-    # 配置根日志记录器
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[logging.StreamHandler()]
-    )
-    
-    # 配置操作日志记录器
+    """配置并返回根日志记录器、操作日志记录器和队列监听器。"""
+    root = logging.getLogger()
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(_formatter())
+
+    # 配置操作日志记录器：记录照常传播到根记录器，文件处理器只接收 operations 的记录
     op_log_dir = 'logs'
     os.makedirs(op_log_dir, exist_ok=True)
     op_log_file = os.path.join(op_log_dir, 'operations.log')
-    
     op_logger = logging.getLogger('operations')
     op_logger.setLevel(logging.INFO)
-    
+    file_handler = logging.handlers.RotatingFileHandler(
+        op_log_file, maxBytes=5*1024*1024, backupCount=2, encoding='utf-8'
+    )
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    file_handler.addFilter(logging.Filter('operations'))
+
     # 防止在重新加载时重复添加处理器
-    if not op_logger.handlers:
-        handler = logging.handlers.RotatingFileHandler(
-            op_log_file, maxBytes=5*1024*1024, backupCount=2, encoding='utf-8'
-        )
-        formatter = logging.Formatter('%(asctime)s - %(message)s')
-        handler.setFormatter(formatter)
-        op_logger.addHandler(handler)
-        
-    return logging.getLogger(), op_logger
+    for handler in list(root.handlers):
+        if isinstance(handler, (_EnqueueHandler, logging.StreamHandler)):
+            root.removeHandler(handler)
+    log_queue = queue.SimpleQueue()
+    root.addHandler(_EnqueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    return root, op_logger, listener
+
+
+def _sample_rate(event):
+    """读取事件的采样率，环境变量无效时记录警告并使用默认值（结果由调用方缓存，只警告一次）。"""
+    env_name = f'LOG_SAMPLE_{event.upper()}'
+    default = DEFAULT_SAMPLE_RATES.get(event, 1.0)
+    value = os.getenv(env_name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError as e:
+        logger.warning("%s 无效，使用默认值 %s: %s", env_name, default, e)
+        return default
+
+def log_event(event, message=None, level=logging.INFO, **fields):
+    """记录一条结构化事件日志，字段如 guild_id、user_id、command、latency_ms。
+
+    级别未启用或未被采样时直接返回，不构造任何记录。
+    """
+    if not logger.isEnabledFor(level):
+        return
+    rate = _sample_rates.get(event)
+    if rate is None:
+        rate = _sample_rates[event] = _sample_rate(event)
+    if rate < 1.0 and random.random() >= rate:
+        return
+    logger.log(level, message or event, extra={'event': event, 'fields': fields, 'sample_rate': rate})
+
+def flush_logs():
+    """写出队列中剩余的日志并停止后台线程（进程退出前调用），之后的日志改为同步写出。"""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    # stop() 在队列末尾放入哨兵，监听线程处理完之前的所有记录后才退出
+    listener.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, _EnqueueHandler):
+            root.removeHandler(handler)
+    for handler in listener.handlers:
+        root.addHandler(handler)
 
+_sample_rates = {}
 # 在模块级别调用一次，以便其他模块可以导入 logger 和 op_logger
-logger, op_logger = setup_loggers()
+logger, op_logger, _listener = setup_loggers()
+atexit.register(flush_logs)
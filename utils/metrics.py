@@ -0,0 +1,238 @@
+"""进程内指标，以 Prometheus 文本格式从网页后台的 `/metrics` 导出。
+
+不依赖 prometheus_client：机器人只需要少量计数器、仪表和直方图，
+全部在这里实现，并以模块级实例的形式供 cogs 与网页路由使用。
+"""
+import asyncio
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from .logger import logger
+from .data_manager import deck_store
+
+# 单位为秒；覆盖从自动补全的亚毫秒级到交互 3 秒时限之外
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # 回调在导出时取值，返回数值、{标签值(元组): 数值} 或 None（不导出）
+        self._callback = callback
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """返回 (后缀, 标签值, 额外标签, 数值) 序列。"""
+        if self._callback is None:
+            with self._lock:
+                return [('', key, (), value) for key, value in sorted(self._values.items())]
+        try:
+            result = self._callback()
+        except Exception:
+            return []
+        if result is None:
+            return []
+        if not isinstance(result, dict):
+            return [('', (), (), result)]
+        return [('', key if isinstance(key, tuple) else (key,), (), value) for key, value in sorted(result.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames, callback)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames, callback)
+        self._values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数..., 总数, 求和]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文，退出时记录耗时（异常时同样记录）。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(self._key(labels))
+        return sum(series[:-1]) if series else 0
+
+    def samples(self):
+        with self._lock:
+            snapshot = sorted((key, list(series)) for key, series in self._series.items())
+        result = []
+        for key, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                result.append(('_bucket', key, (('le', _format_value(float(bound))),), cumulative))
+            cumulative += series[len(self.buckets)]
+            result.append(('_bucket', key, (('le', '+Inf'),), cumulative))
+            result.append(('_count', key, (), cumulative))
+            result.append(('_sum', key, (), series[-1]))
+        return result
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            # 模块或 cog 重新加载时复用已有指标
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        return self._register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """以 Prometheus 文本格式 0.0.4 导出所有指标。"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+command_duration = registry.histogram(
+    'tarot_command_duration_seconds', '斜杠指令从开始处理到处理函数返回的耗时', ('command',))
+command_phase_duration = registry.histogram(
+    'tarot_command_phase_seconds', '指令各阶段耗时（load: 读取数据, build: 构建 embed, respond: 发送响应）',
+    ('command', 'phase'))
+interaction_response_delay = registry.histogram(
+    'tarot_interaction_response_seconds', '从 Discord 创建交互到本进程发出首个响应的时间（时限为 3 秒）',
+    ('command',))
+interaction_errors = registry.counter(
+    'tarot_interaction_errors_total', '处理过程中抛出未捕获异常的交互数量', ('command',))
+autocomplete_duration = registry.histogram(
+    'tarot_autocomplete_duration_seconds', '自动补全请求的处理耗时', ('command',))
+event_loop_lag = registry.histogram(
+    'tarot_event_loop_lag_seconds', '事件循环调度延迟的采样值')
+deck_cache_hits = registry.counter(
+    'tarot_deck_cache_hits_total', '牌组缓存命中次数', callback=lambda: deck_store.hits)
+deck_cache_misses = registry.counter(
+    'tarot_deck_cache_misses_total', '牌组缓存未命中次数', callback=lambda: deck_store.misses)
+startup_phase_duration = registry.gauge(
+    'tarot_startup_phase_seconds', '启动各阶段耗时（cogs、render、command_sync 以及到 ready 为止的总时间）', ('phase',))
+command_syncs = registry.counter(
+    'tarot_command_sync_total', '指令同步结果（synced: 已同步, skipped: 指令未变化而跳过, failed: 失败）', ('result',))
+deck_cache_reloads = registry.counter(
+    'tarot_deck_cache_reloads_total', '牌组从磁盘重新加载的次数', callback=lambda: deck_store.reloads)
+
+
+def observe_response(command, created_at, now=None):
+    """记录从交互创建（`created_at`，带时区的 datetime）到现在的响应延迟，并返回该延迟（秒）。"""
+    now = now or datetime.now(timezone.utc)
+    delay = max(0.0, (now - created_at).total_seconds())
+    interaction_response_delay.observe(delay, command=command)
+    return delay
+
+
+async def sample_event_loop_lag(interval=0.5):
+    """定期睡眠 `interval` 秒，把实际唤醒时间超出预期的部分记为事件循环延迟。"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(0.0, loop.time() - start - interval))
+
+
+@contextmanager
+def startup_phase(phase):
+    """记录一个启动阶段的耗时，并在结束时写入日志。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        startup_phase_duration.set(elapsed, phase=phase)
+        logger.info("启动阶段 %s 耗时 %.3fs", phase, elapsed)
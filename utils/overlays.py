@@ -0,0 +1,242 @@
+import asyncio
+import copy
+import os
+import threading
+from collections import OrderedDict
+from .logger import logger
+from .deck_schema import DeckValidationError
+from .data_manager import deck_store, update_deck, validate_tarot_deck, validate_fortune_deck, validate_overrides
+
+# 运势数据中整体覆盖的部分；等级则按 id 逐条覆盖
+FORTUNE_SECTIONS = ('activities', 'domains', 'connectors')
+DECK_KINDS = {
+    'tarot': (None, validate_tarot_deck),
+    'fortune': ({}, validate_fortune_deck),
+}
+
+
+def overrides_path(base_file):
+    """基础牌组对应的服务器覆盖文件，例如 tarot.json -> tarot_overrides.json。"""
+    root, ext = os.path.splitext(base_file)
+    return f"{root}_overrides{ext}"
+
+
+def merge_patch(base, patch):
+    """返回把 `patch` 合并到 `base` 上的新字典：嵌套字典递归合并，值为 None 表示删除该字段。"""
+    merged = dict(base)
+    for key, value in patch.items():
+        if value is None:
+            merged.pop(key, None)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_patch(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def diff_patch(base, edited):
+    """返回把 `base` 变为 `edited` 所需的最小补丁，是 `merge_patch` 的逆运算。"""
+    patch = {}
+    for key, value in edited.items():
+        if key not in base:
+            patch[key] = value
+        elif isinstance(value, dict) and isinstance(base[key], dict):
+            nested = diff_patch(base[key], value)
+            if nested:
+                patch[key] = nested
+        elif value != base[key]:
+            patch[key] = value
+    for key in base:
+        if key not in edited:
+            patch[key] = None
+    return patch
+
+
+def _merge_entries(entries, patches):
+    # 未被覆盖的条目直接共享基础牌组中的对象
+    if not patches:
+        return entries
+    return [merge_patch(e, patches[str(e['id'])]) if str(e['id']) in patches else e for e in entries]
+
+def _diff_entries(entries, edited_entries):
+    base_by_id = {str(e['id']): e for e in entries}
+    patches = {}
+    for entry in edited_entries:
+        base = base_by_id.get(str(entry['id']))
+        # 覆盖层只能修改已有条目，不能增删
+        if base is not None:
+            patch = diff_patch(base, entry)
+            if patch:
+                patches[str(entry['id'])] = patch
+    return patches
+
+def apply_overlay(kind, base, patch):
+    """把一个服务器的覆盖合并到基础牌组上，返回合并后的视图。"""
+    if kind == 'tarot':
+        return _merge_entries(base, patch.get('cards'))
+    merged = dict(base)
+    merged['levels'] = _merge_entries(base.get('levels', []), patch.get('levels'))
+    for section in FORTUNE_SECTIONS:
+        if section in patch:
+            merged[section] = patch[section]
+    return merged
+
+def diff_overlay(kind, base, edited):
+    """计算编辑后的牌组相对基础牌组的稀疏覆盖。"""
+    if kind == 'tarot':
+        cards = _diff_entries(base, edited)
+        return {'cards': cards} if cards else {}
+    patch = {}
+    levels = _diff_entries(base.get('levels', []), edited.get('levels', []))
+    if levels:
+        patch['levels'] = levels
+    for section in FORTUNE_SECTIONS:
+        if edited.get(section) != base.get(section):
+            patch[section] = edited.get(section)
+    return patch
+
+
+class _GuildView:
+    __slots__ = ('base', 'patch', 'data', 'compiled')
+
+    def __init__(self, base, patch, data):
+        self.base = base
+        self.patch = patch
+        self.data = data
+        self.compiled = {}
+
+
+class GuildDecks:
+    """基础牌组之上的按服务器覆盖层（写时复制）。
+
+    每个服务器只保存与基础牌组不同的字段（`<牌组>_overrides.json`），没有覆盖的
+    服务器直接读取基础牌组。有覆盖的服务器在首次读取时合并出一个视图并按 LRU
+    缓存，未被覆盖的条目与基础牌组共享对象，因此内存随覆盖数量而不是服务器数量
+    增长；基础牌组或该服务器的覆盖变化后视图自动重建。
+    """
+
+    def __init__(self, base_file, kind, max_views=1024):
+        self.base_file = os.path.abspath(base_file)
+        self.overrides_file = overrides_path(self.base_file)
+        self.kind = kind
+        self.default_data, self.validator = DECK_KINDS[kind]
+        self.max_views = max_views
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def base(self):
+        return deck_store.get(self.base_file, self.default_data, self.validator)
+
+    def _overrides(self):
+        return deck_store.get(self.overrides_file, default_data={}, validator=validate_overrides, optional=True)
+
+    def patch_for(self, guild_id):
+        """返回服务器的覆盖数据，没有覆盖时返回 None。"""
+        if guild_id is None:
+            return None
+        return self._overrides().get('guilds', {}).get(str(guild_id)) or None
+
+    def guild_ids(self):
+        """返回所有存在覆盖的服务器 ID。"""
+        return sorted(int(guild_id) for guild_id, patch in self._overrides().get('guilds', {}).items() if patch)
+
+    def _view(self, guild_id):
+        patch = self.patch_for(guild_id)
+        if not patch:
+            return None
+        base = self.base()
+        with self._lock:
+            view = self._views.get(guild_id)
+            # 覆盖文件重新加载后对象会变，但内容相同的视图仍然有效
+            if view is not None and view.base is base and (view.patch is patch or view.patch == patch):
+                view.patch = patch
+                self._views.move_to_end(guild_id)
+                return view
+
+            merged = apply_overlay(self.kind, base, patch)
+            error = self.validator(merged)
+            if error:
+                logger.error("服务器 %s 对 %s 的覆盖无效，改用基础牌组: %s", guild_id, os.path.basename(self.base_file), error)
+                merged = base
+            view = self._views[guild_id] = _GuildView(base, patch, merged)
+            if len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+            return view
+
+    def get(self, guild_id):
+        """返回服务器的牌组视图（只读），`guild_id` 为 None 时返回基础牌组。"""
+        view = self._view(guild_id)
+        return view.data if view is not None else self.base()
+
+    def get_compiled(self, guild_id, key, builder):
+        """与 `DeckStore.get_compiled` 相同，但基于服务器的牌组视图。"""
+        view = self._view(guild_id)
+        if view is None:
+            return deck_store.get_compiled(self.base_file, key, builder, self.default_data, self.validator)
+        compiled = view.compiled.get(key)
+        if compiled is None:
+            compiled = view.compiled.setdefault(key, builder(view.data))
+        return compiled
+
+    def update(self, guild_id, mutator, coalesce=False):
+        """对服务器的牌组视图执行读-改-写，只把与基础牌组的差异写入覆盖文件。
+
+        `mutator` 的约定与 `update_deck` 相同；合并后的牌组未通过校验时抛出 `DeckValidationError`。
+        `guild_id` 为 None 时直接修改基础牌组。
+        """
+        if guild_id is None:
+            return update_deck(self.base_file, mutator, self.default_data, self.validator, coalesce)
+
+        def apply(overrides):
+            guilds = overrides.setdefault('guilds', {})
+            base = self.base()
+            edited = copy.deepcopy(apply_overlay(self.kind, base, guilds.get(str(guild_id), {})))
+            result = mutator(edited)
+            if result is None:
+                return None
+            error = self.validator(edited)
+            if error:
+                raise DeckValidationError(error)
+            patch = diff_overlay(self.kind, base, edited)
+            if patch:
+                guilds[str(guild_id)] = patch
+            else:
+                guilds.pop(str(guild_id), None)
+            return result
+
+        return update_deck(self.overrides_file, apply, default_data={'guilds': {}},
+                           validator=validate_overrides, coalesce=coalesce, optional=True)
+
+    async def update_async(self, guild_id, mutator):
+        """`update` 的异步版本，磁盘读写在线程池中完成；集群工作进程中改由监督进程执行（见 `route_updates`）。"""
+        if _remote_update is not None:
+            future = _remote_update(os.path.basename(self.base_file), self.kind, guild_id, mutator)
+            return await asyncio.wait_for(asyncio.wrap_future(future), REMOTE_UPDATE_TIMEOUT)
+        return await asyncio.to_thread(self.update, guild_id, mutator)
+
+    def reset(self, guild_id):
+        """删除服务器的全部覆盖，恢复为基础牌组。"""
+        def remove(overrides):
+            return overrides.get('guilds', {}).pop(str(guild_id), None)
+        return update_deck(self.overrides_file, remove, default_data={'guilds': {}}, validator=validate_overrides,
+                           optional=True)
+
+
+_guild_decks = {}
+_guild_decks_lock = threading.Lock()
+# 集群工作进程中由 `route_updates` 设置：update_async 把修改转交给监督进程
+_remote_update = None
+REMOTE_UPDATE_TIMEOUT = 30
+
+def route_updates(submit):
+    """让本进程的 `update_async` 改为调用 `submit(牌组文件名, kind, guild_id, mutator)`，它返回一个 Future。"""
+    global _remote_update
+    _remote_update = submit
+
+def guild_decks(base_file, kind):
+    """返回基础牌组对应的共享覆盖层实例，cogs、网页后台与渲染服务共用同一份视图缓存。"""
+    path = os.path.abspath(base_file)
+    with _guild_decks_lock:
+        decks = _guild_decks.get(path)
+        if decks is None:
+            decks = _guild_decks[path] = GuildDecks(path, kind)
+        return decks
@@ -0,0 +1,156 @@
+"""抽取指令的限流：每位用户、每个服务器各有一个令牌桶。
+
+被限流的调用不读取牌组、不构建 embed，只回复一条 ephemeral 提示：同一冷却期内的第一次
+给出剩余秒数，之后的重复调用回复更短的固定文本（每次交互都必须被响应，否则用户会看到
+“应用未响应”）。已补满的桶与不存在的桶等价，会被定期清除，因此内存只与最近活跃的用户和服务器数量相关。
+"""
+import math
+import os
+import time
+from .logger import logger, log_event
+from .metrics import registry
+
+DEFAULT_USER_RATE = '3/10'
+DEFAULT_GUILD_RATE = '120/60'
+
+rate_limited_calls = registry.counter(
+    'tarot_rate_limited_total', '被限流的抽取指令（scope: 触发的桶, reply: sent 首次冷却提示 / repeat 冷却期内的重复提示）',
+    ('command', 'scope', 'reply'))
+
+
+def parse_rate(value):
+    """解析 "次数/秒数"（例如 "3/10"），返回 (容量, 每秒补充量)；空值或 0 表示不限流。
+
+    格式错误，或容量小于 1（任何调用都拿不到令牌）时抛出 ValueError。
+    """
+    if not value or value.strip() in ('0', 'off'):
+        return None
+    count, _, seconds = value.partition('/')
+    capacity = float(count)
+    period = float(seconds or 1)
+    if capacity == 0:
+        return None
+    if capacity < 1 or period <= 0:
+        raise ValueError(f"无效的频率限制: {value!r}，次数至少为 1，秒数必须大于 0")
+    return capacity, capacity / period
+
+def _configured_rate(value, env_name, default):
+    """解析传入值或环境变量中的频率限制，环境变量无效时记录警告并使用默认值。"""
+    if value is not None:
+        return parse_rate(value)
+    try:
+        return parse_rate(os.getenv(env_name, default))
+    except ValueError as e:
+        logger.warning("%s 无效，使用默认值 %s: %s", env_name, default, e)
+        return parse_rate(default)
+
+
+class TokenBuckets:
+    """按键独立的令牌桶，每个桶为 [令牌数, 上次更新时间]。"""
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _tokens(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        return min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_rate)
+
+    def wait_time(self, key, now):
+        """还需等待多少秒才有一个令牌，当前可用时返回 0。"""
+        tokens = self._tokens(key, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.refill_rate
+
+    def take(self, key, now):
+        self._buckets[key] = [self._tokens(key, now) - 1, now]
+
+    def sweep(self, now):
+        """清除已经补满的桶。"""
+        idle = [key for key in self._buckets if self._tokens(key, now) >= self.capacity]
+        for key in idle:
+            del self._buckets[key]
+        return len(idle)
+
+
+class DrawLimiter:
+    """抽取指令共用的限流器。
+
+    只在事件循环线程中使用，因此不加锁。`DRAW_RATE_USER` / `DRAW_RATE_GUILD` 的格式为
+    "次数/秒数"，设为 0 关闭对应的限制。
+    """
+
+    def __init__(self, user_rate=None, guild_rate=None, sweep_interval=60.0, clock=time.monotonic):
+        user = _configured_rate(user_rate, 'DRAW_RATE_USER', DEFAULT_USER_RATE)
+        guild = _configured_rate(guild_rate, 'DRAW_RATE_GUILD', DEFAULT_GUILD_RATE)
+        self.users = TokenBuckets(*user) if user else None
+        self.guilds = TokenBuckets(*guild) if guild else None
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        # 用户 ID -> 冷却提示的有效期，期间只回复简短的重复提示
+        self._notified = {}
+        self._last_sweep = clock()
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        for buckets in (self.users, self.guilds):
+            if buckets is not None:
+                buckets.sweep(now)
+        self._notified = {user_id: until for user_id, until in self._notified.items() if until > now}
+
+    def check(self, user_id, guild_id):
+        """尝试为一次抽取扣除令牌，返回 (需要等待的秒数, 触发限流的范围)；允许时返回 (0, None)。
+
+        两个桶都有令牌时才同时扣除，被拒绝的调用不消耗任何令牌。
+        """
+        now = self.clock()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._sweep(now)
+        wait, scope = 0.0, None
+        if self.users is not None:
+            wait, scope = self.users.wait_time(user_id, now), 'user'
+        if self.guilds is not None and guild_id is not None:
+            guild_wait = self.guilds.wait_time(guild_id, now)
+            if guild_wait > wait:
+                wait, scope = guild_wait, 'guild'
+        if wait > 0:
+            return wait, scope
+        if self.users is not None:
+            self.users.take(user_id, now)
+        if self.guilds is not None and guild_id is not None:
+            self.guilds.take(guild_id, now)
+        return 0.0, None
+
+    async def reject(self, interaction, command):
+        """被限流时处理该交互并返回 True，调用方应直接返回。"""
+        wait, scope = self.check(interaction.user.id, interaction.guild_id)
+        if not wait:
+            return False
+        log_event('rate_limited', command=command, scope=scope, guild_id=interaction.guild_id,
+                  user_id=interaction.user.id, retry_after=round(wait, 1))
+        now = self.clock()
+        if self._notified.get(interaction.user.id, 0) > now:
+            rate_limited_calls.inc(command=command, scope=scope, reply='repeat')
+            await interaction.response.send_message("喵~ 还在冷却中。", ephemeral=True)
+            return True
+        self._notified[interaction.user.id] = now + wait
+        rate_limited_calls.inc(command=command, scope=scope, reply='sent')
+        await interaction.response.send_message(f"喵~ 抽得太快啦，请 {math.ceil(wait)} 秒后再试。", ephemeral=True)
+        return True
+
+    def bucket_counts(self):
+        return {
+            ('user',): len(self.users) if self.users is not None else 0,
+            ('guild',): len(self.guilds) if self.guilds is not None else 0,
+        }
+
+
+draw_limiter = DrawLimiter()
+
+registry.gauge('tarot_rate_limit_buckets', '限流器中正在跟踪的令牌桶数量', ('scope',),
+               callback=draw_limiter.bucket_counts)
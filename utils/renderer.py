@@ -0,0 +1,421 @@
+import hashlib
+import io
+import ipaddress
+import json
+import math
+import multiprocessing
+import os
+import re
+import socket
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urljoin, urlsplit
+import requests
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+from .logger import logger
+from .data_manager import deck_store, _write_json_atomic
+from .deck_schema import MAX_STARS
+from .fortune_engine import compile_fortune
+from .overlays import guild_decks, overrides_path
+from .tarot_engine import compile_tarot
+
+# 修改任何渲染样式时递增，使旧的渲染结果全部失效
+TEMPLATE_VERSION = 1
+RENDER_DIR = os.path.join('static', 'renders')
+MANIFEST_FILE = 'manifest.json'
+
+TAROT_MAX_SIZE = (600, 1000)
+FORTUNE_SIZE = (800, 450)
+STAR_COLORS = {
+    'heart': (231, 76, 60),
+    'coin': (241, 196, 15),
+    'star': (255, 215, 90),
+    'thorn': (155, 89, 182),
+    'skull': (189, 195, 199),
+}
+EMPTY_STAR_COLOR = (60, 60, 60)
+FONT_CANDIDATES = (
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc',
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',
+    '/System/Library/Fonts/PingFang.ttc',
+    'C:/Windows/Fonts/msyh.ttc',
+)
+FETCH_TIMEOUT = 15
+# 源图下载与解码的上限：超过的图片不会被读完或解码
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+MAX_SOURCE_PIXELS = 40_000_000
+MAX_REDIRECTS = 3
+FETCH_CHUNK_SIZE = 64 * 1024
+
+# B 站图床在 URL 末尾用 `@...` 指定缩放/转码参数，去掉后即为原图
+_BILI_SUFFIX = re.compile(r'^(https?://[^/]*hdslb\.com/.+?)@[^/]*$')
+
+
+def source_url(url):
+    """返回图片的原始地址（去掉图床的缩放/转码后缀）。"""
+    match = _BILI_SUFFIX.match(url)
+    return match.group(1) if match else url
+
+def public_url(path):
+    """把本地相对路径转换为 Discord 可访问的完整 URL。"""
+    if path.startswith('http'):
+        return path
+    base_url = os.getenv("BASE_URL", "http://localhost:7860")
+    return f"{base_url}/{path}"
+
+class ImageSourceError(ValueError):
+    """源图不可用：地址指向内网、内容不是图片，或大小、像素数超出上限。"""
+
+
+def _allowed_hosts():
+    return {host.strip().lower() for host in os.getenv('IMAGE_FETCH_ALLOWED_HOSTS', '').split(',') if host.strip()}
+
+def _check_public_url(url):
+    """只允许下载公网上的 http(s) 地址，避免后台填写的链接被用来访问内网服务。"""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageSourceError(f"不支持的图片地址: {url}")
+    host = parts.hostname.lower()
+    if host in _allowed_hosts():
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 80, proto=socket.IPPROTO_TCP)}
+    except socket.gaierror as e:
+        raise ImageSourceError(f"无法解析图片地址的主机 {host}: {e}") from e
+    for address in addresses:
+        if not ipaddress.ip_address(address.split('%', 1)[0]).is_global:
+            raise ImageSourceError(f"图片地址指向内网地址 {address}: {url}")
+
+def _download(url):
+    """流式下载远程图片：逐跳检查重定向目标，要求 `image/*` 类型，超过 `MAX_SOURCE_BYTES` 时中止。"""
+    for _ in range(MAX_REDIRECTS + 1):
+        _check_public_url(url)
+        with requests.get(url, timeout=FETCH_TIMEOUT, stream=True, allow_redirects=False) as response:
+            if response.is_redirect:
+                url = urljoin(url, response.headers['Location'])
+                continue
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+            if not content_type.startswith('image/'):
+                raise ImageSourceError(f"不是图片（Content-Type: {content_type or '无'}）: {url}")
+            if int(response.headers.get('Content-Length') or 0) > MAX_SOURCE_BYTES:
+                raise ImageSourceError(f"图片超过 {MAX_SOURCE_BYTES} 字节: {url}")
+            data = bytearray()
+            for chunk in response.iter_content(FETCH_CHUNK_SIZE):
+                data += chunk
+                if len(data) > MAX_SOURCE_BYTES:
+                    raise ImageSourceError(f"图片超过 {MAX_SOURCE_BYTES} 字节: {url}")
+            return bytes(data)
+    raise ImageSourceError(f"重定向次数超过 {MAX_REDIRECTS} 次: {url}")
+
+def fetch_source(ref):
+    """读取图片原始字节：远程 URL 通过 HTTP 下载，其余视为本地路径。"""
+    if ref.startswith('http'):
+        return _download(source_url(ref))
+    with open(ref, 'rb') as f:
+        data = f.read(MAX_SOURCE_BYTES + 1)
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ImageSourceError(f"图片超过 {MAX_SOURCE_BYTES} 字节: {ref}")
+    return data
+
+def open_image(data):
+    """打开图片字节（此时只读取了文件头），像素数超过 `MAX_SOURCE_PIXELS` 的图片（解压炸弹）在解码前拒绝。"""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            image = Image.open(io.BytesIO(data))
+    except (Image.DecompressionBombWarning, Image.DecompressionBombError) as e:
+        raise ImageSourceError(str(e)) from e
+    if image.width * image.height > MAX_SOURCE_PIXELS:
+        image.close()
+        raise ImageSourceError(f"图片尺寸 {image.width}x{image.height} 超过 {MAX_SOURCE_PIXELS} 像素")
+    return image
+
+def fortune_variant(level_name, stars, star_shape):
+    """运势背景的渲染变体标识，等级名称、星级或形状变化都会产生新的渲染。"""
+    return f"fortune:{level_name}:{stars}:{star_shape}"
+
+
+def _load_font(size):
+    """加载支持中文的字体，找不到时返回 None（此时只绘制星星）。"""
+    for path in (os.getenv('RENDER_FONT_PATH'),) + FONT_CANDIDATES:
+        if path and os.path.exists(path):
+            try:
+                return ImageFont.truetype(path, size)
+            except OSError:
+                continue
+    return None
+
+def _star_points(cx, cy, outer, inner):
+    points = []
+    for i in range(10):
+        radius = outer if i % 2 == 0 else inner
+        angle = -math.pi / 2 + i * math.pi / 5
+        points.append((cx + radius * math.cos(angle), cy + radius * math.sin(angle)))
+    return points
+
+def _render_tarot(image, orientation):
+    image = image.convert('RGBA')
+    image.thumbnail(TAROT_MAX_SIZE, Image.LANCZOS)
+    if orientation == 'reversed':
+        image = image.rotate(180)
+    return image
+
+def _render_fortune(image, level_name, stars, star_shape):
+    image = ImageOps.fit(image.convert('RGB'), FORTUNE_SIZE, Image.LANCZOS).convert('RGBA')
+    width, height = image.size
+    band_top = int(height * 0.68)
+
+    overlay = Image.new('RGBA', image.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    draw.rectangle((0, band_top, width, height), fill=(0, 0, 0, 150))
+
+    font = _load_font(44)
+    star_y = (band_top + height) // 2
+    if font is not None:
+        draw.text((24, (band_top + height) // 2), level_name, font=font, fill=(255, 255, 255, 255), anchor='lm')
+
+    outer = (height - band_top) * 0.22
+    spacing = outer * 2.4
+    start_x = width - 24 - spacing * (MAX_STARS - 1) - outer
+    color = STAR_COLORS.get(star_shape, STAR_COLORS['star'])
+    for i in range(MAX_STARS):
+        fill = color if i < stars else EMPTY_STAR_COLOR
+        draw.polygon(_star_points(start_x + i * spacing, star_y, outer, outer * 0.45), fill=fill + (255,))
+
+    return Image.alpha_composite(image, overlay)
+
+def _render_job(job):
+    """在工作进程中执行的渲染任务，返回 (清单键, 输出文件名)。"""
+    data = fetch_source(job['ref'])
+    source_hash = hashlib.sha256(data).hexdigest()
+    digest = hashlib.sha256(f"{source_hash}|{job['variant']}|{TEMPLATE_VERSION}".encode('utf-8')).hexdigest()[:32]
+    filename = f"{digest}.webp"
+    output_path = os.path.join(job['render_dir'], filename)
+    if not os.path.exists(output_path):
+        image = ImageOps.exif_transpose(open_image(data))
+        if job['kind'] == 'tarot':
+            rendered = _render_tarot(image, job['variant'])
+        else:
+            rendered = _render_fortune(image, job['level_name'], job['stars'], job['star_shape'])
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        rendered.save(tmp_path, 'WEBP', quality=88, method=4)
+        os.replace(tmp_path, output_path)
+    return job['key'], filename
+
+
+class RenderService:
+    """牌面图片的预渲染服务。
+
+    监听牌组变更，在进程池中把所有塔罗牌的正/逆位和所有运势等级背景渲染到
+    内容寻址的缓存目录（文件名由源图哈希、变体和模板版本决定）。抽取时只查询
+    清单，从不在交互中渲染；尚未渲染完成时返回 None，由调用方回退到原图。
+    """
+
+    def __init__(self, render_dir=RENDER_DIR, max_workers=None, debounce=2.0):
+        self.render_dir = render_dir
+        self.max_workers = max_workers or int(os.getenv('RENDER_WORKERS', min(4, os.cpu_count() or 1)))
+        self.debounce = debounce
+        self._manifest = {}
+        # 本地源图在渲染时的 mtime：只在后台重建时检查，抽取时查询清单不做任何磁盘 I/O
+        self._sources = {}
+        self._watched = {}
+        self._triggers = set()
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._timer = None
+        self._executor = None
+        self._subscribed = False
+        self._listeners = []
+
+    @staticmethod
+    def _key(ref, variant):
+        return f"{ref}|{variant}"
+
+    @staticmethod
+    def _signature(ref):
+        """本地源图的 mtime，用于发现被同名覆盖的文件；远程地址和不存在的文件返回 None。"""
+        if ref.startswith('http'):
+            return None
+        try:
+            return os.stat(ref).st_mtime_ns
+        except OSError:
+            return None
+
+    def lookup(self, ref, variant):
+        """返回已渲染图片的相对路径，尚未渲染时返回 None。"""
+        if not ref:
+            return None
+        filename = self._manifest.get(self._key(ref, variant))
+        return f"{self.render_dir}/{filename}".replace(os.path.sep, '/') if filename else None
+
+    def watch(self, tarot_file=None, fortune_file=None):
+        """开始监听牌组文件，并立即安排一次全量预渲染。"""
+        os.makedirs(self.render_dir, exist_ok=True)
+        self.load_manifest()
+        with self._lock:
+            for path, kind in ((tarot_file, 'tarot'), (fortune_file, 'fortune')):
+                if path:
+                    path = os.path.abspath(path)
+                    self._watched[path] = kind
+                    # 服务器覆盖层中的图片同样需要渲染
+                    self._triggers.update((path, overrides_path(path)))
+            subscribe = not self._subscribed
+            self._subscribed = True
+        # 订阅回调会在 deck_store 的锁内获取 self._lock，因此这里不能反过来嵌套
+        if subscribe:
+            deck_store.subscribe(self._on_deck_change)
+        self.schedule(delay=0)
+
+    def _on_deck_change(self, path, version):
+        if path in self._triggers:
+            self.schedule()
+
+    def schedule(self, delay=None):
+        """合并短时间内的多次变更，延迟后在后台线程中执行一次 `rebuild`。"""
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.debounce if delay is None else delay, self._run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.rebuild()
+        except Exception as e:
+            logger.error("预渲染牌面时出错: %s", e)
+
+    @staticmethod
+    def _compiled_views(decks, key, builder):
+        """基础牌组以及每个有覆盖的服务器视图的编译结果，结构不正确的视图被跳过。"""
+        for guild_id in (None, *decks.guild_ids()):
+            compiled = decks.get_compiled(guild_id, key, builder)
+            if compiled is not None:
+                yield compiled
+
+    def jobs(self):
+        """根据当前牌组（含各服务器覆盖）列出所有需要的渲染任务。
+
+        与抽取时一样读取编译后的牌组，图片地址和等级名称都已去掉首尾空白，保证这里生成的清单键
+        与 cog 查询时使用的键一致。
+        """
+        jobs = []
+        for path, kind in list(self._watched.items()):
+            decks = guild_decks(path, kind)
+            if kind == 'tarot':
+                cards = (card for deck in self._compiled_views(decks, 'tarot_deck', compile_tarot) for card in deck)
+                for card in cards:
+                    if not card.image:
+                        continue
+                    for orientation in ('upright', 'reversed'):
+                        jobs.append({'kind': 'tarot', 'ref': card.image, 'variant': orientation})
+            else:
+                levels = (level for model in self._compiled_views(decks, 'fortune_model', compile_fortune)
+                          for level in model.levels)
+                for level in levels:
+                    if not level.image:
+                        continue
+                    jobs.append({
+                        'kind': 'fortune', 'ref': level.image,
+                        'variant': fortune_variant(level.name, level.stars, level.star_shape),
+                        'level_name': level.name, 'stars': level.stars, 'star_shape': level.star_shape,
+                    })
+        unique = {}
+        for job in jobs:
+            job['key'] = self._key(job['ref'], job['variant'])
+            job['render_dir'] = self.render_dir
+            unique.setdefault(job['key'], job)
+        signatures = {}
+        for job in unique.values():
+            if job['ref'] not in signatures:
+                signatures[job['ref']] = self._signature(job['ref'])
+            job['signature'] = signatures[job['ref']]
+        return list(unique.values())
+
+    def rebuild(self):
+        """渲染所有缺失的变体，清理不再需要的文件，并持久化清单。"""
+        with self._run_lock:
+            jobs = self.jobs()
+            wanted = {job['key'] for job in jobs}
+            pending = [job for job in jobs if not self._is_rendered(job)]
+
+            manifest = {key: name for key, name in self._manifest.items() if key in wanted}
+            sources = {job['ref']: job['signature'] for job in jobs if job['signature'] is not None}
+            if pending:
+                logger.info("开始预渲染 %s 张牌面图片", len(pending))
+                executor = self._get_executor()
+                futures = {executor.submit(_render_job, job): job for job in pending}
+                failed = 0
+                for future in as_completed(futures):
+                    try:
+                        key, filename = future.result()
+                        manifest[key] = filename
+                    except BrokenProcessPool as e:
+                        failed += 1
+                        logger.warning("渲染进程异常退出，将在下次重建进程池: %s", e)
+                        self._executor = None
+                    except Exception as e:
+                        failed += 1
+                        logger.warning("渲染 %s 失败: %s", futures[future]['ref'], e)
+                logger.info("预渲染完成: 成功 %s，失败 %s", len(pending) - failed, failed)
+
+            self._manifest = manifest
+            self._sources = sources
+            self._prune(set(manifest.values()))
+            _write_json_atomic(os.path.join(self.render_dir, MANIFEST_FILE), {'renders': manifest, 'sources': sources})
+        for listener in self._listeners:
+            listener()
+
+    def add_listener(self, listener):
+        """注册在每次 `rebuild` 完成后调用的无参回调。"""
+        self._listeners.append(listener)
+
+    def _is_rendered(self, job):
+        filename = self._manifest.get(job['key'])
+        if filename is None or not os.path.exists(os.path.join(self.render_dir, filename)):
+            return False
+        # 本地源图被同名覆盖后重新渲染；在此之前查询仍返回旧的渲染结果
+        return self._sources.get(job['ref']) == job['signature']
+
+    def _get_executor(self):
+        if self._executor is None:
+            # 使用 spawn，避免在多线程进程中 fork 带来的死锁
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _prune(self, keep):
+        for name in os.listdir(self.render_dir):
+            if name != MANIFEST_FILE and name not in keep:
+                try:
+                    os.remove(os.path.join(self.render_dir, name))
+                except OSError:
+                    pass
+
+    def load_manifest(self):
+        """从磁盘重新读取渲染清单（例如由其他进程完成渲染后）。"""
+        try:
+            with open(os.path.join(self.render_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        self._manifest = data.get('renders', {})
+        self._sources = data.get('sources', {})
+
+    def shutdown(self):
+        """停止定时器并关闭进程池。"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+render_service = RenderService()
@@ -0,0 +1,9 @@
+"""斜杠指令的响应辅助函数。"""
+
+
+async def send_reply(interaction, content=None, **kwargs):
+    """发送一条响应；交互已经响应过（或已延迟响应）时改用 followup，避免 InteractionResponded。"""
+    if interaction.response.is_done():
+        await interaction.followup.send(content, **kwargs)
+    else:
+        await interaction.response.send_message(content, **kwargs)
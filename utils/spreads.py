@@ -0,0 +1,50 @@
+import random
+
+# Discord 单条消息最多 10 个 embed，牌阵位置数不能超过它
+MAX_EMBEDS_PER_MESSAGE = 10
+ORIENTATIONS = ('upright', 'reversed')
+ORIENTATION_TEXT = {'upright': '正位', 'reversed': '逆位'}
+
+
+class Spread:
+    """牌阵定义：名称、简介以及按顺序排列的各位置含义。"""
+    __slots__ = ('key', 'name', 'description', 'positions')
+
+    def __init__(self, key, name, description, positions):
+        if len(positions) > MAX_EMBEDS_PER_MESSAGE:
+            raise ValueError(f"牌阵 {name} 有 {len(positions)} 个位置，超过单条消息的 embed 上限")
+        self.key = key
+        self.name = name
+        self.description = description
+        self.positions = tuple(positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+SPREADS = {
+    spread.key: spread for spread in (
+        Spread('three_card', '三张牌', '过去、现在与未来', ('过去', '现在', '未来')),
+        Spread('celtic_cross', '凯尔特十字', '全面审视一个问题的十张牌阵', (
+            '现状', '阻碍', '潜意识', '过去', '显意识', '近期未来',
+            '自我', '环境', '希望与恐惧', '最终结果',
+        )),
+    )
+}
+
+
+def draw_spread(tarot_deck, spread, rng=random):
+    """一次性不放回地抽取整个牌阵，返回 [(位置, 牌, 正逆位), ...]。
+
+    `tarot_deck` 为编译后的 `TarotDeck`，牌按权重不放回地抽取（未设置权重时等价于一次 `rng.sample`），
+    正逆位由一次 `getrandbits` 的各个比特决定。
+    """
+    count = len(spread)
+    if count > tarot_deck.drawable:
+        raise ValueError(f"牌组只有 {tarot_deck.drawable} 张可抽取的牌，不足以组成 {spread.name}")
+    cards = tarot_deck.draw_distinct(count, rng)
+    bits = rng.getrandbits(count)
+    return [
+        (position, card, ORIENTATIONS[(bits >> i) & 1])
+        for i, (position, card) in enumerate(zip(spread.positions, cards))
+    ]
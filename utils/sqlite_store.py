@@ -0,0 +1,329 @@
+"""可选的 SQLite 存储后端（STORAGE_BACKEND=sqlite）。
+
+牌组仍以“文件名”为键（tarot.json、fortune.json、*_overrides.json），对外的
+读取/保存接口与 JSON 文件完全相同；区别在于每张牌、每个运势等级、每个服务器的
+覆盖各占一行，保存时只写入内容发生变化的行，编辑历史记录在 history 表中。
+
+命令行用法（在仓库根目录）:
+    python -m utils.sqlite_store migrate [--data-dir data] [--db data/decks.db]
+    python -m utils.sqlite_store export  [--data-dir data] [--db data/decks.db]
+    python -m utils.sqlite_store history [--limit 20]
+"""
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from .logger import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decks (
+    name TEXT PRIMARY KEY,
+    doc TEXT,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS entries (
+    deck TEXT NOT NULL,
+    key NOT NULL,
+    name TEXT,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (deck, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_by_name ON entries (deck, name);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    deck TEXT NOT NULL,
+    entry_key TEXT,
+    entry_name TEXT,
+    guild_id INTEGER,
+    field TEXT NOT NULL,
+    old_value TEXT,
+    new_value TEXT,
+    source TEXT,
+    actor TEXT,
+    actor_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS history_by_entry ON history (deck, entry_key, created_at);
+"""
+
+# 各牌组拆分成行的方式：(类型, 字段)
+#   list: 整个文档是条目列表，按 id 分行
+#   items: 文档中 `字段` 是条目列表，按 id 分行，其余部分保存在 decks.doc
+#   map: 文档中 `字段` 是 {键: 值} 对象，每个键一行
+DECK_LAYOUTS = {
+    'tarot.json': ('list', None),
+    'fortune.json': ('items', 'levels'),
+    'tarot_overrides.json': ('map', 'guilds'),
+    'fortune_overrides.json': ('map', 'guilds'),
+}
+DECK_FILES = tuple(DECK_LAYOUTS)
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+def _split(name, data):
+    """把文档拆成 (文档其余部分, [(键, 名称, 数据)])。"""
+    kind, field = DECK_LAYOUTS.get(name, (None, None))
+    if kind == 'list':
+        return None, [(e['id'], e.get('name'), e) for e in data]
+    if kind == 'items' and isinstance(data.get(field), list):
+        doc = {k: v for k, v in data.items() if k != field}
+        return doc, [(e['id'], e.get('level_name') or e.get('name'), e) for e in data[field]]
+    if kind == 'map' and isinstance(data.get(field), dict):
+        doc = {k: v for k, v in data.items() if k != field}
+        return doc, [(str(k), None, v) for k, v in data[field].items()]
+    return data, []
+
+def _join(name, doc, rows):
+    kind, field = DECK_LAYOUTS.get(name, (None, None))
+    if kind == 'list':
+        return [json.loads(data) for _, data in rows]
+    if kind == 'items' and doc is not None:
+        return {**doc, field: [json.loads(data) for _, data in rows]}
+    if kind == 'map' and doc is not None:
+        return {**doc, field: {str(key): json.loads(data) for key, data in rows}}
+    return doc
+
+
+class SqliteBackend:
+    """DeckStore 的 SQLite 存储后端。
+
+    每个线程使用独立连接；数据库工作在 WAL 模式，读者不会被写入阻塞。decks.revision
+    在每次写入时递增，作为缓存判断变更的签名（相当于 JSON 文件的 mtime/大小）。
+    数据库中还没有某个牌组、而同名 JSON 文件存在时，首次访问会自动导入该文件。
+    """
+    name = 'sqlite'
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        # 每个牌组最近一次读写时各行的 (位置, 编码)，以及对应的修订号
+        self._rows = {}
+        self._rows_lock = threading.Lock()
+        self._migrated = set()
+        with contextlib.closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    @staticmethod
+    def _deck(path):
+        return os.path.basename(path)
+
+    def _import_json(self, path):
+        """数据库中没有该牌组时，从同名 JSON 文件导入（每个牌组只检查一次），返回是否导入。
+
+        JSON 文件无法解析时抛出 ValueError，而不是把牌组当作不存在。
+        """
+        name = self._deck(path)
+        if name in self._migrated:
+            return False
+        self._migrated.add(name)
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            self._migrated.discard(name)
+            raise ValueError(f"数据库中没有牌组 {name}，且无法导入 {path}: {e}") from e
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 其他进程可能已经抢先导入
+            exists = conn.execute('SELECT 1 FROM decks WHERE name = ?', (name,)).fetchone()
+            if not exists:
+                self._write_rows(conn, name, data)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if not exists:
+            logger.info("已把 %s 自动导入数据库 %s", path, self.db_path)
+        return not exists
+
+    def signature(self, path):
+        """返回牌组当前的修订号，不存在时返回 None。"""
+        row = self.conn.execute('SELECT revision FROM decks WHERE name = ?', (self._deck(path),)).fetchone()
+        if row is None:
+            try:
+                imported = self._import_json(path)
+            except ValueError:
+                # 由随后的 read 抛出并记录错误
+                imported = False
+            if imported:
+                row = self.conn.execute('SELECT revision FROM decks WHERE name = ?', (self._deck(path),)).fetchone()
+        return row[0] if row else None
+
+    def read(self, path):
+        """读取整个牌组文档，不存在时抛出 FileNotFoundError（与读取 JSON 文件一致）。"""
+        name = self._deck(path)
+        conn = self.conn
+        conn.execute('BEGIN')
+        try:
+            row = conn.execute('SELECT doc FROM decks WHERE name = ?', (name,)).fetchone()
+            rows = conn.execute(
+                'SELECT key, data FROM entries WHERE deck = ? ORDER BY position', (name,)).fetchall()
+        finally:
+            conn.execute('COMMIT')
+        if row is None:
+            if self._import_json(path):
+                return self.read(path)
+            raise FileNotFoundError(f"数据库中没有牌组 {name}")
+        return _join(name, json.loads(row[0]) if row[0] is not None else None, rows)
+
+    def write(self, path, data):
+        """保存整个牌组文档，只写入内容或顺序发生变化的行，返回写入的行数。"""
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            written = self._write_rows(conn, self._deck(path), data)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            with self._rows_lock:
+                self._rows.pop(self._deck(path), None)
+            raise
+        return written
+
+    def _write_rows(self, conn, name, data):
+        """调用方需已开启写事务。
+
+        文档交给后端时是编辑后的完整副本，没有记录哪些条目被改过，因此每行仍需编码后比较；
+        但上次写入的编码缓存在内存中（修订号未被其他进程改变时有效），不必每次读回全部行，
+        内容完全没有变化时也不递增修订号，读者不会因此重新加载。
+        """
+        doc, entries = _split(name, data)
+        doc_encoded = _dumps(doc) if doc is not None else None
+        row = conn.execute('SELECT doc, revision FROM decks WHERE name = ?', (name,)).fetchone()
+        with self._rows_lock:
+            cached = self._rows.get(name)
+        if row is not None and cached is not None and cached[0] == row[1]:
+            existing = cached[1]
+        else:
+            existing = {key: (position, stored) for key, position, stored in conn.execute(
+                'SELECT key, position, data FROM entries WHERE deck = ?', (name,))}
+        rows = {}
+        written = 0
+        for position, (key, entry_name, entry) in enumerate(entries):
+            rows[key] = (position, _dumps(entry))
+            if existing.get(key) != rows[key]:
+                conn.execute(
+                    'INSERT OR REPLACE INTO entries (deck, key, name, position, data) VALUES (?, ?, ?, ?, ?)',
+                    (name, key, entry_name, *rows[key]))
+                written += 1
+        for key in existing.keys() - rows.keys():
+            conn.execute('DELETE FROM entries WHERE deck = ? AND key = ?', (name, key))
+            written += 1
+        if row is not None and not written and row[0] == doc_encoded:
+            revision = row[1]
+        else:
+            conn.execute(
+                'INSERT INTO decks (name, doc, revision) VALUES (?, ?, 1) '
+                'ON CONFLICT(name) DO UPDATE SET doc = excluded.doc, revision = revision + 1',
+                (name, doc_encoded))
+            revision = row[1] + 1 if row is not None else 1
+        with self._rows_lock:
+            self._rows[name] = (revision, rows)
+        return written
+
+    def record_history(self, path, entry_key, entry_name, field, old_value, new_value,
+                       source=None, actor=None, actor_id=None, guild_id=None):
+        self.conn.execute(
+            'INSERT INTO history (created_at, deck, entry_key, entry_name, guild_id, field, old_value, new_value, '
+            'source, actor, actor_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (time.time(), self._deck(path), str(entry_key), entry_name, guild_id, field,
+             old_value, new_value, source, actor, actor_id))
+
+    def history(self, limit=20, deck=None, entry_key=None):
+        """返回最近的编辑历史（新的在前），每条为字典。"""
+        query, params = 'SELECT * FROM history', []
+        conditions = []
+        if deck is not None:
+            conditions.append('deck = ?')
+            params.append(deck)
+        if entry_key is not None:
+            conditions.append('entry_key = ?')
+            params.append(str(entry_key))
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        cursor = self.conn.execute(query, params)
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def migrate(data_dir, backend):
+    """把数据目录中现有的 JSON 牌组导入数据库，返回 {文件名: 条目数}。"""
+    results = {}
+    for name in DECK_FILES:
+        path = os.path.join(data_dir, name)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        backend.write(path, data)
+        results[name] = len(_split(name, data)[1])
+    return results
+
+def export(data_dir, backend):
+    """把数据库中的牌组导出回 JSON 文件（备份或切回 JSON 后端时使用）。"""
+    from .data_manager import _write_json_atomic
+    exported = []
+    for name in DECK_FILES:
+        path = os.path.join(data_dir, name)
+        try:
+            data = backend.read(path)
+        except FileNotFoundError:
+            continue
+        _write_json_atomic(path, data)
+        exported.append(name)
+    return exported
+
+
+def default_db_path(data_dir=None):
+    return os.getenv('SQLITE_PATH') or os.path.join(data_dir or os.getenv('HF_DISK_PATH', 'data'), 'decks.db')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="牌组 SQLite 存储工具")
+    parser.add_argument("command", choices=("migrate", "export", "history"))
+    parser.add_argument("--data-dir", default=os.getenv('HF_DISK_PATH', 'data'), help="牌组数据目录")
+    parser.add_argument("--db", default=None, help="数据库路径，默认为 SQLITE_PATH 或 <数据目录>/decks.db")
+    parser.add_argument("--limit", type=int, default=20, help="history 显示的条数")
+    args = parser.parse_args()
+
+    backend = SqliteBackend(args.db or default_db_path(args.data_dir))
+    if args.command == 'migrate':
+        for name, count in migrate(args.data_dir, backend).items():
+            logger.info("已导入 %s: %s 行", name, count)
+    elif args.command == 'export':
+        for name in export(args.data_dir, backend):
+            logger.info("已导出 %s", name)
+    else:
+        for row in backend.history(args.limit):
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['created_at']))
+            print(f"{when} [{row['deck']}#{row['entry_key']} {row['entry_name'] or ''}] guild={row['guild_id']} "
+                  f"{row['actor']}({row['actor_id']}) {row['field']}: {row['old_value']!r} -> {row['new_value']!r}")
+
+
+if __name__ == "__main__":
+    main()
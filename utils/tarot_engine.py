@@ -0,0 +1,60 @@
+import random
+from types import MappingProxyType
+from .alias_table import AliasTable
+from .data_manager import validate_tarot_deck
+from .deck_schema import DEFAULT_WEIGHT
+
+
+class TarotCard:
+    """编译后的塔罗牌（只读）：文字已去掉首尾空白，图片地址为空时为 None。"""
+    __slots__ = ('id', 'name', 'descriptions', 'image', 'weight')
+
+    def __init__(self, card):
+        self.id = card['id']
+        self.name = card['name'].strip()
+        description = card['description']
+        self.descriptions = MappingProxyType({
+            'upright': description['upright'].strip(),
+            'reversed': description['reversed'].strip(),
+        })
+        self.image = (card.get('image') or '').strip() or None
+        self.weight = card.get('weight', DEFAULT_WEIGHT)
+
+    def description(self, orientation):
+        return self.descriptions[orientation]
+
+
+class TarotDeck:
+    """编译后的塔罗牌组（只读）：牌的元组加上按 `weight` 预先构建的别名表。"""
+    __slots__ = ('cards', 'table')
+
+    def __init__(self, cards):
+        self.cards = tuple(cards)
+        self.table = AliasTable([card.weight for card in self.cards]) if self.cards else None
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __getitem__(self, index):
+        return self.cards[index]
+
+    @property
+    def drawable(self):
+        """权重大于 0、可以被抽到的牌数。"""
+        return self.table.support if self.table is not None else 0
+
+    def draw(self, rng=random):
+        """按权重抽取一张牌。"""
+        return self.cards[self.table.sample(rng)]
+
+    def draw_distinct(self, count, rng=random):
+        """按权重不放回地抽取 `count` 张不同的牌。"""
+        return [self.cards[i] for i in self.table.sample_distinct(count, rng)]
+
+
+def compile_tarot(tarot_cards):
+    """把塔罗牌组编译为 `TarotDeck`，抽取时直接读取属性；结构不正确时返回 None。"""
+    error = validate_tarot_deck(tarot_cards)
+    if error:
+        return None
+    return TarotDeck(TarotCard(card) for card in tarot_cards)
@@ -1,21 +1,247 @@
-from flask import Flask, render_template, request, redirect, url_for
-from werkzeug.utils import secure_filename
+from flask import Flask, Response, jsonify, render_template, request, redirect, url_for
 import os
+import secrets
 from utils.logger import logger
-from utils.data_manager import load_json_data, save_json_data
+from utils.data_manager import deck_store
+from utils.deck_schema import DEFAULT_WEIGHT, DeckValidationError, clean_lines
+from utils.image_ingest import UPLOAD_FOLDER, store_image, resolve_image, apply_image
+from utils.metrics import registry
+from utils.overlays import guild_decks
+from utils.draw_log import draw_log
+from utils.http_cache import (RenderCache, apply_static_caching, choose_encoding, compress_response, mark_encoded,
+                              not_modified_responses, page_etag)
+from utils.json_patch import PatchError, PatchTestFailed, apply_operation, resolve_parent
 
-UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+# 缓存版本号只在进程内递增，加上每次启动随机的前缀，避免重启后旧 ETag 碰巧匹配
+ETAG_EPOCH = secrets.token_hex(4)
 
 app = Flask(__name__, template_folder='../templates', static_folder='../static')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def apply_weight(entry, value):
+    """写入表单中的抽取权重；留空或等于默认权重时删除字段，使服务器覆盖保持稀疏。
+
+    无法解析的输入原样写入，由校验报告出错的字段。
+    """
+    value = value.strip()
+    try:
+        number = float(value) if value else DEFAULT_WEIGHT
+    except ValueError:
+        entry['weight'] = value
+        return
+    if number == DEFAULT_WEIGHT:
+        entry.pop('weight', None)
+    else:
+        entry['weight'] = int(number) if number.is_integer() else number
+
+def is_default_weight(operation):
+    """判断补丁操作是否只是把某个条目的权重设为默认值。"""
+    value = operation.get('value')
+    return (operation.get('op') in ('add', 'replace') and isinstance(operation.get('path'), str)
+            and operation['path'].endswith('/weight') and not isinstance(value, bool)
+            and value == DEFAULT_WEIGHT)
+
+@app.template_filter('pointer')
+def json_pointer_token(value):
+    """把字段名转义为 JSON Pointer 片段（~ -> ~0，/ -> ~1）。"""
+    return str(value).replace('~', '~0').replace('/', '~1')
+
+
+class PreconditionFailed(Exception):
+    """If-Match 与牌组当前的 ETag 不一致。"""
+
+
+@app.after_request
+def http_caching(response):
+    if request.endpoint == 'static':
+        apply_static_caching(response, (request.view_args or {}).get('filename'), request)
+    if response.status_code == 304:
+        not_modified_responses.inc(endpoint=request.endpoint or '')
+    return compress_response(response, request.accept_encodings)
+
 def register_routes(bot):
     tarot_file = os.path.join(bot.data_dir, 'tarot.json')
     fortune_file = os.path.join(bot.data_dir, 'fortune.json')
+    tarot_decks = guild_decks(tarot_file, 'tarot')
+    fortune_decks = guild_decks(fortune_file, 'fortune')
+
+    def selected_guild():
+        """当前编辑的服务器 ID（查询参数 guild），None 表示基础牌组。"""
+        return request.args.get('guild', type=int)
+
+    def guild_selector(decks, endpoint):
+        """服务器选择器的模板参数：机器人所在的服务器加上已有覆盖的服务器。"""
+        overridden = set(decks.guild_ids())
+        names = {guild.id: guild.name for guild in getattr(bot, 'guilds', [])}
+        guild_id = selected_guild()
+        for gid in overridden | ({guild_id} if guild_id is not None else set()):
+            names.setdefault(gid, f"服务器 {gid}")
+        guilds = sorted(names.items(), key=lambda item: (item[0] not in overridden, item[1]))
+        return {"guilds": guilds, "guild_id": guild_id, "overridden": overridden, "endpoint": endpoint}
+
+    deck_kinds = {'tarot': tarot_decks, 'fortune': fortune_decks}
+
+    def deck_etag(decks, guild_id):
+        """牌组视图的 ETag：基础牌组（以及覆盖文件）的缓存版本号，需先调用 `decks.get` 加载。"""
+        versions = [deck_store.version(decks.base_file)]
+        if guild_id is not None:
+            versions.append(deck_store.version(decks.overrides_file))
+        return '-'.join([ETAG_EPOCH] + [str(v) for v in versions])
+
+    def api_response(payload, status=200, etag=None):
+        response = jsonify(payload)
+        response.status_code = status
+        if etag is not None:
+            response.set_etag(etag)
+        return response
+
+    def check_if_match(decks, guild_id):
+        """在镜像图片等耗时的准备工作之前核对 If-Match，不满足时返回错误响应，否则返回 None。
+
+        写锁内还会再核对一次，这里只是让过期的请求尽早失败。
+        """
+        if not request.if_match:
+            return api_response({"error": "缺少 If-Match 请求头"}, 428)
+        decks.get(guild_id)
+        etag = deck_etag(decks, guild_id)
+        if not request.if_match.contains_weak(etag):
+            return api_response({"error": "牌组已被修改，请刷新后重试"}, 412, etag)
+        return None
+
+    def patch_deck(decks, guild_id, mutate):
+        """在写锁内核对 If-Match 后执行 `mutate`，校验通过才保存，返回 (响应, 状态码)。"""
+        rejected = check_if_match(decks, guild_id)
+        if rejected is not None:
+            return rejected
+
+        def apply(data):
+            decks.get(guild_id)
+            # 弱比较：压缩过的响应带的是同一版本的弱 ETag
+            if not request.if_match.contains_weak(deck_etag(decks, guild_id)):
+                raise PreconditionFailed()
+            mutate(data)
+            return True
+
+        try:
+            decks.update(guild_id, apply, coalesce=True)
+        except PreconditionFailed:
+            decks.get(guild_id)
+            return api_response({"error": "牌组已被修改，请刷新后重试"}, 412, deck_etag(decks, guild_id))
+        except PatchTestFailed as e:
+            return api_response({"error": str(e)}, 409)
+        except (PatchError, DeckValidationError) as e:
+            return api_response({"error": str(e)}, 422)
+        decks.get(guild_id)
+        return api_response({"status": "ok"}, etag=deck_etag(decks, guild_id))
+
+    render_cache = RenderCache()
+
+    def render_deck_page(template, decks, endpoint, data_name, **context):
+        """渲染编辑页面：ETag 由牌组版本号和服务器列表推导，未变化时返回 304 或复用缓存的渲染结果。"""
+        guild_id = selected_guild()
+        data = decks.get(guild_id)
+        selector = guild_selector(decks, endpoint)
+        etag = deck_etag(decks, guild_id)
+        tag = page_etag(template, etag, deck_store.version(decks.overrides_file), guild_id,
+                        selector['guilds'], sorted(selector['overridden']))
+        page = render_cache.get_or_render(
+            tag, lambda: render_template(template, etag=etag, **{data_name: data}, **selector, **context), template)
+        # 压缩结果随页面一起缓存，大牌组的页面不必每次请求都重新压缩
+        body, encoding = page.encoded(choose_encoding(request.accept_encodings))
+        response = Response(body, mimetype='text/html')
+        response.set_etag(tag)
+        if encoding is not None:
+            mark_encoded(response, encoding)
+        response.vary.add('Accept-Encoding')
+        response.last_modified = page.rendered_at
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    @app.route('/api/decks/<kind>', methods=['GET', 'PATCH'])
+    def deck_api(kind):
+        """读取牌组（支持 If-None-Match），或用 JSON Patch 按字段修改（必须带 If-Match）。"""
+        decks = deck_kinds.get(kind)
+        if decks is None:
+            return api_response({"error": f"未知的牌组: {kind}"}, 404)
+        guild_id = selected_guild()
+        if request.method == 'GET':
+            data = decks.get(guild_id)
+            etag = deck_etag(decks, guild_id)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+            return api_response(data, etag=etag)
+
+        operations = request.get_json(force=True, silent=True)
+        if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+            return api_response({"error": "请求体应为 JSON Patch 操作列表"}, 400)
+
+        rejected = check_if_match(decks, guild_id)
+        if rejected is not None:
+            return rejected
+
+        # 新填写的远程图片链接在写锁外镜像到本地，锁内再用 apply_image 写入所在条目
+        images = {}
+        for operation in operations:
+            path, value = operation.get('path'), operation.get('value')
+            if operation.get('op') in ('add', 'replace') and isinstance(path, str) and path.endswith('/image') \
+                    and isinstance(value, str):
+                images[path] = resolve_image(value)
+
+        def mutate(data):
+            for operation in operations:
+                if is_default_weight(operation):
+                    # 与表单保存一致：默认权重不写入覆盖，删除字段即可
+                    entry, token = resolve_parent(data, operation['path'])
+                    if isinstance(entry, dict):
+                        entry.pop(token, None)
+                        continue
+                fields = images.get(operation.get('path')) if operation.get('op') in ('add', 'replace') else None
+                if fields is None:
+                    apply_operation(data, operation)
+                    continue
+                entry, _ = resolve_parent(data, operation['path'])
+                if not isinstance(entry, dict):
+                    raise PatchError(f"路径不存在: {operation['path']}")
+                # 地址没变时保留已镜像的本地图片
+                if fields['image'] not in (entry.get('image'), entry.get('image_source')):
+                    apply_image(entry, fields)
+
+        return patch_deck(decks, guild_id, mutate)
+
+    @app.route('/api/decks/<kind>/entries/<int:entry_id>/image', methods=['POST'])
+    def deck_entry_image(kind, entry_id):
+        """上传单个条目的图片（multipart 字段 image），同样需要 If-Match。"""
+        decks = deck_kinds.get(kind)
+        if decks is None:
+            return api_response({"error": f"未知的牌组: {kind}"}, 404)
+        file = request.files.get('image')
+        if not file or not file.filename or not allowed_file(file.filename):
+            return api_response({"error": "请上传 png/jpg/gif/webp 图片"}, 400)
+        guild_id = selected_guild()
+        rejected = check_if_match(decks, guild_id)
+        if rejected is not None:
+            return rejected
+        try:
+            relative_path, meta = store_image(file.read())
+        except (OSError, ValueError) as e:
+            return api_response({"error": f"无法读取图片: {e}"}, 400)
+
+        def mutate(data):
+            entries = data if kind == 'tarot' else data.get('levels', [])
+            entry = next((e for e in entries if e['id'] == entry_id), None)
+            if entry is None:
+                raise PatchError(f"条目不存在: {entry_id}")
+            apply_image(entry, {'image': relative_path, 'image_meta': meta})
+
+        return patch_deck(decks, guild_id, mutate)
 
     @app.route('/')
     def index():
@@ -23,95 +249,159 @@ def register_routes(bot):
 
     @app.route('/health')
     def health():
-        return {"status": "healthy", "bot_ready": bot.is_ready() if hasattr(bot, 'is_ready') else False}
+        payload = {
+            "status": "healthy",
+            "bot_ready": bot.is_ready() if hasattr(bot, 'is_ready') else False,
+            "storage": deck_store.backend.name,
+            "deck_cache": deck_store.stats(),
+        }
+        if hasattr(bot, 'cluster_status'):
+            payload["cluster"] = bot.cluster_status()
+        return payload
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/stats')
+    def stats_web():
+        try:
+            guild_id = selected_guild()
+            # 本进程的实时统计加上其他进程（集群工作进程）最近的快照，都是增量维护的，不扫描日志；
+            # 页面只需要计数和用户总数，不逐个合并用户记录
+            stats = draw_log.combined_stats()
+            return render_template(
+                'stats.html', guild_id=guild_id, summary=stats.summary(guild_id, top=25),
+                user_count=draw_log.user_count(), orientations=stats.orientations if guild_id is None else None,
+                guild_totals=stats.guild_totals() if guild_id is None else [],
+            )
+        except Exception as e:
+            logger.error("Error in stats_web: %s", e)
+            return "Error loading stats", 500
 
     @app.route('/tarot', methods=['GET', 'POST'])
     def tarot_web():
         try:
-            tarot_cards = load_json_data(tarot_file)
+            guild_id = selected_guild()
             if request.method == 'POST':
-                for card in tarot_cards:
-                    upright_desc = request.form.get(f'upright_{card["id"]}')
-                    if upright_desc is not None:
-                        card['description']['upright'] = upright_desc
+                if request.form.get('form_type') == 'reset_overlay' and guild_id is not None:
+                    tarot_decks.reset(guild_id)
+                    return redirect(url_for('tarot_web', guild=guild_id))
+
+                # 先在写锁外完成上传图片的缩放与重新编码
+                uploads = {}
+                for file_key, file in request.files.items():
+                    if file_key.startswith('image_upload_') and file and file.filename and allowed_file(file.filename):
+                        relative_path, meta = store_image(file.read())
+                        uploads[file_key] = {'image': relative_path, 'image_meta': meta}
+
+                def apply_form(tarot_cards):
+                    for card in tarot_cards:
+                        upright_desc = request.form.get(f'upright_{card["id"]}')
+                        if upright_desc is not None:
+                            card['description']['upright'] = upright_desc
                     
-                    reversed_desc = request.form.get(f'reversed_{card["id"]}')
-                    if reversed_desc is not None:
-                        card['description']['reversed'] = reversed_desc
-
-                    file_key = f'image_upload_{card["id"]}'
-                    if file_key in request.files:
-                        file = request.files[file_key]
-                        if file and file.filename and allowed_file(file.filename):
-                            filename = secure_filename(f"tarot_{card['id']}{os.path.splitext(file.filename)[1]}")
-                            save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                            file.save(save_path)
-                            card['image'] = os.path.join(UPLOAD_FOLDER, filename).replace(os.path.sep, '/')
+                        reversed_desc = request.form.get(f'reversed_{card["id"]}')
+                        if reversed_desc is not None:
+                            card['description']['reversed'] = reversed_desc
+
+                        weight = request.form.get(f'weight_{card["id"]}')
+                        if weight is not None:
+                            apply_weight(card, weight)
+
+                        upload = uploads.get(f'image_upload_{card["id"]}')
+                        if upload:
+                            apply_image(card, upload)
                 
-                save_json_data(tarot_file, tarot_cards)
-                return redirect(url_for('tarot_web'))
-            return render_template('tarot.html', tarot_cards=tarot_cards)
+                    return True
+
+                tarot_decks.update(guild_id, apply_form, coalesce=True)
+                return redirect(url_for('tarot_web', guild=guild_id))
+            return render_deck_page('tarot.html', tarot_decks, 'tarot_web', 'tarot_cards')
+        except DeckValidationError as e:
+            return f"保存失败，牌组未通过校验: {e}", 422
         except Exception as e:
-            logger.error(f"Error in tarot_web: {e}")
+            logger.error("Error in tarot_web: %s", e)
             return "Error loading tarot data", 500
 
     @app.route('/fortune', methods=['GET', 'POST'])
     def fortune_web():
         try:
-            fortune_data = load_json_data(fortune_file)
+            guild_id = selected_guild()
             if request.method == 'POST':
                 form_type = request.form.get('form_type')
+                if form_type == 'reset_overlay' and guild_id is not None:
+                    fortune_decks.reset(guild_id)
+                    return redirect(url_for('fortune_web', guild=guild_id))
 
+                # 新填写的远程图片链接在写锁外镜像到本地
+                resolved_images = {}
                 if form_type == 'levels':
-                    for level in fortune_data['levels']:
-                        level_id = level['id']
-                        level['level_name'] = request.form.get(f'level_name_{level_id}', level['level_name'])
-                        level['stars'] = int(request.form.get(f'stars_{level_id}', level['stars']))
-                        level['star_shape'] = request.form.get(f'star_shape_{level_id}', level['star_shape'])
-                        level['image'] = request.form.get(f'image_{level_id}', '')
-                        level['good_events'] = int(request.form.get(f'good_events_{level_id}', 2))
-                        level['bad_events'] = int(request.form.get(f'bad_events_{level_id}', 2))
-
-                elif form_type == 'activities':
-                    pool_name = request.form.get('pool_name')
-                    if pool_name in fortune_data['activities']:
-                        # Handle deletion
-                        if 'delete_activity' in request.form:
-                            activity_name_to_delete = request.form.get('delete_activity')
-                            fortune_data['activities'][pool_name] = [a for a in fortune_data['activities'][pool_name] if a['name'] != activity_name_to_delete]
-                        # Handle addition
-                        elif 'new_name' in request.form and 'new_description' in request.form:
-                            new_name = request.form.get('new_name')
-                            new_description = request.form.get('new_description')
-                            if new_name and new_description:
-                                fortune_data['activities'][pool_name].append({'name': new_name, 'description': new_description})
-                        # Handle updates
-                        else:
-                            for i, activity in enumerate(fortune_data['activities'][pool_name]):
-                                original_name = request.form.get(f'original_name_{i}')
-                                activity['name'] = request.form.get(f'name_{i}', original_name)
-                                activity['description'] = request.form.get(f'description_{i}', activity['description'])
-
-                elif form_type == 'domains':
-                    for domain in fortune_data['domains']:
-                        domain_name = domain['name']
+                    current = fortune_decks.get(guild_id)
+                    for level in current.get('levels', []):
+                        url = request.form.get(f'image_{level["id"]}', '')
+                        if url != level.get('image', '') and url != level.get('image_source'):
+                            resolved_images[level['id']] = resolve_image(url)
+
+                def apply_form(fortune_data):
+                    if form_type == 'levels':
                         for level in fortune_data['levels']:
-                            level_name = level['level_name']
-                            key = f"domain_{domain_name}_{level_name}"
-                            domain['fortunes'][level_name] = request.form.get(key, domain['fortunes'].get(level_name, ''))
+                            level_id = level['id']
+                            level['level_name'] = request.form.get(f'level_name_{level_id}', level['level_name'])
+                            level['stars'] = int(request.form.get(f'stars_{level_id}', level['stars']))
+                            level['star_shape'] = request.form.get(f'star_shape_{level_id}', level['star_shape'])
+                            if level_id in resolved_images:
+                                apply_image(level, resolved_images[level_id])
+                            level['good_events'] = int(request.form.get(f'good_events_{level_id}', 2))
+                            level['bad_events'] = int(request.form.get(f'bad_events_{level_id}', 2))
+                            weight = request.form.get(f'weight_{level_id}')
+                            if weight is not None:
+                                apply_weight(level, weight)
+
+                    elif form_type == 'activities':
+                        pool_name = request.form.get('pool_name')
+                        if pool_name in fortune_data['activities']:
+                            # Handle deletion
+                            if 'delete_activity' in request.form:
+                                activity_name_to_delete = request.form.get('delete_activity')
+                                fortune_data['activities'][pool_name] = [a for a in fortune_data['activities'][pool_name] if a['name'] != activity_name_to_delete]
+                            # Handle addition
+                            elif 'new_name' in request.form and 'new_description' in request.form:
+                                new_name = request.form.get('new_name')
+                                new_description = request.form.get('new_description')
+                                if new_name and new_description:
+                                    fortune_data['activities'][pool_name].append({'name': new_name, 'description': new_description})
+                            # Handle updates
+                            else:
+                                for i, activity in enumerate(fortune_data['activities'][pool_name]):
+                                    original_name = request.form.get(f'original_name_{i}')
+                                    activity['name'] = request.form.get(f'name_{i}', original_name)
+                                    activity['description'] = request.form.get(f'description_{i}', activity['description'])
+
+                    elif form_type == 'domains':
+                        for domain in fortune_data['domains']:
+                            domain_name = domain['name']
+                            for level in fortune_data['levels']:
+                                level_name = level['level_name']
+                                key = f"domain_{domain_name}_{level_name}"
+                                domain['fortunes'][level_name] = request.form.get(key, domain['fortunes'].get(level_name, ''))
                 
-                elif form_type == 'connectors':
-                    fortune_data['connectors']['intro'] = request.form.get('intro', '').split(',')
-                    fortune_data['connectors']['outro_good'] = request.form.get('outro_good', '').split(',')
-                    fortune_data['connectors']['outro_neutral'] = request.form.get('outro_neutral', '').split(',')
-                    fortune_data['connectors']['outro_bad'] = request.form.get('outro_bad', '').split(',')
-
-                save_json_data(fortune_file, fortune_data)
-                return redirect(url_for('fortune_web'))
+                    elif form_type == 'connectors':
+                        # 逗号前后的空白和连续逗号产生的空项都不保存
+                        for key in ('intro', 'outro_good', 'outro_neutral', 'outro_bad'):
+                            fortune_data['connectors'][key] = clean_lines(request.form.get(key, '').split(','))
+
+                    return True
+
+                fortune_decks.update(guild_id, apply_form, coalesce=True)
+                return redirect(url_for('fortune_web', guild=guild_id))
                 
-            return render_template('fortune.html', fortune_data=fortune_data)
+            return render_deck_page('fortune.html', fortune_decks, 'fortune_web', 'fortune_data',
+                                    patch_url=url_for('deck_api', kind='fortune', guild=guild_id))
+        except DeckValidationError as e:
+            return f"保存失败，牌组未通过校验: {e}", 422
         except Exception as e:
-            logger.error(f"Error in fortune_web: {e}")
+            logger.error("Error in fortune_web: %s", e)
             return "Error loading fortune data", 500
     
     return app